@@ -0,0 +1,64 @@
+"""
+PSA 表在 pandas (insert_df / query_df) 與 Arrow (insert_arrow / query_arrow) 兩種傳輸方式下的吞吐量。
+
+    python -m benchmarks.bench_arrow_transport --rows 1000000
+
+以 benchmarks.bench_psa_engine 的合成 raw 資料經 transform_psa 產生 PSA 資料後，
+分別寫入 scratch database 的 PSA 表並讀回。
+"""
+import argparse
+import time
+from datetime import datetime
+import utilx.clickhouse_client as ch
+from benchmarks.bench_psa_engine import SYNTHETIC_RAW_SQL, psa
+
+SCRATCH_DB = 'bench_arrow_transport'
+
+def timed(label: str, rows: int, fn) -> None:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<36}: {elapsed:8.2f}s  {rows / elapsed:>12,.0f} rows/sec')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    client = ch.get_client()
+    client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+    client.command(f'CREATE DATABASE {SCRATCH_DB}')
+    try:
+        client.command(f'CREATE TABLE {SCRATCH_DB}.online_retails AS raw.online_retails')
+        client.command(f'CREATE TABLE {SCRATCH_DB}.psa AS raw.psa_online_retails')
+        client.command(SYNTHETIC_RAW_SQL.format(db=SCRATCH_DB, rows=args.rows))
+        source_sql = psa.PSA_FULL_SQL.replace('raw.online_retails', f'{SCRATCH_DB}.online_retails')
+        load_datetime = datetime.utcnow().replace(microsecond=0)
+        print(f'--- {args.rows:,} raw rows ---')
+
+        timed('query  raw  query_df', args.rows, lambda: client.query_df(source_sql))
+        timed('query  raw  query_arrow', args.rows, lambda: ch.query_arrow(client, source_sql))
+        timed('query  raw  query_arrow + to pandas', args.rows, lambda: ch.arrow_to_frame(ch.query_arrow(client, source_sql)))
+
+        raw = ch.arrow_to_frame(ch.query_arrow(client, source_sql))
+        frames = {key_format: psa.transform_psa(raw.copy(), load_datetime, key_format=key_format) for key_format in ('uuid', 'arrow')}
+        rows = len(frames['uuid'])
+        del raw
+
+        for label, insert in (
+            ('insert psa  insert_df (uuid keys)', lambda: client.insert_df(f'{SCRATCH_DB}.psa', frames['uuid'])),
+            ('insert psa  arrow (uuid keys)', lambda: ch.insert_frame_arrow(
+                client, f'{SCRATCH_DB}.psa', frames['uuid'], decimals=psa.PSA_DECIMAL_COLUMNS)),
+            ('insert psa  arrow (arrow keys)', lambda: ch.insert_frame_arrow(
+                client, f'{SCRATCH_DB}.psa', frames['arrow'], decimals=psa.PSA_DECIMAL_COLUMNS)),
+        ):
+            client.command(f'TRUNCATE TABLE {SCRATCH_DB}.psa')
+            timed(label, rows, insert)
+
+        timed('query  psa  query_df', rows, lambda: client.query_df(f'SELECT * FROM {SCRATCH_DB}.psa'))
+        timed('query  psa  query_arrow', rows, lambda: ch.query_arrow(client, f'SELECT * FROM {SCRATCH_DB}.psa'))
+    finally:
+        client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+
+if __name__ == '__main__':
+    main()
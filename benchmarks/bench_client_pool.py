@@ -0,0 +1,60 @@
+"""
+ClickHouse client 建立方式與傳輸壓縮的延遲比較。
+
+    python -m benchmarks.bench_client_pool --queries 200 --threads 8 --rows 1000000
+
+- 每個查詢建立新 client (舊的 get_client 行為) 與共用 pool 的 get_client('metrics')，各跑 --queries 次小查詢
+- none / lz4 / zstd 三種傳輸壓縮讀取 --rows 列的 Arrow 結果
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import clickhouse_connect
+import utilx.clickhouse_client as ch
+
+SMALL_QUERY = 'SELECT count() FROM system.one'
+
+def fresh_client():
+    return clickhouse_connect.get_client(
+        host=os.getenv('CLICKHOUSE_HOST', 'localhost'),
+        port=int(os.getenv('CLICKHOUSE_PORT', 8123)),
+        user=os.getenv('CLICKHOUSE_USER', 'default'),
+        password=os.getenv('CLICKHOUSE_PASSWORD', ''),
+    )
+
+def run_queries(label: str, queries: int, threads: int, get) -> None:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: get().command(SMALL_QUERY), range(queries)))
+    elapsed = time.perf_counter() - start
+    print(f'{label:<24}: {elapsed:8.2f}s  {elapsed / queries * 1000:8.2f} ms/query')
+
+def run_transfer(rows: int, repeat: int) -> None:
+    query = f"SELECT number, toString(number) AS s, number % 100 AS c FROM numbers({rows})"
+    for compression in ('none', 'lz4', 'zstd'):
+        os.environ['CLICKHOUSE_COMPRESSION'] = compression
+        ch.reset()
+        client = ch.get_client()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ch.query_arrow(client, query)
+            timings.append(time.perf_counter() - start)
+        print(f'compression {compression:<12}: best {min(timings):8.2f}s for {rows:,} rows')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ch.get_client()  # 載入 .env
+    run_queries('new client per query', args.queries, args.threads, fresh_client)
+    run_queries('pooled get_client', args.queries, args.threads, lambda: ch.get_client('metrics'))
+    run_transfer(args.rows, args.repeat)
+
+if __name__ == '__main__':
+    main()
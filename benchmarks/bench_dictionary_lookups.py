@@ -0,0 +1,89 @@
+"""
+fact 建置中 dictGet 查詢與原本 IN 子查詢的一致性檢查與耗時比較。
+
+    python -m benchmarks.bench_dictionary_lookups --rows 10000000
+
+預設 --rows 約為 Online Retail II (約 107 萬列) 的 10 倍。在 scratch database 以合成資料建立 PSA、
+全部 vault 表與 dictionary，量測 (FACT_LINES_SQL) 的 missing_customer 以 dictGet 查詢 vs IN (CustomerID = 0 的 hub_customer key)。
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+import utilx.clickhouse_client as ch
+from benchmarks.bench_psa_engine import SYNTHETIC_RAW_SQL, psa
+from tasks.vault import dictionaries, loader  # bench_psa_engine 已將 online_retails 加入 sys.path
+from tasks.mart.build_fact_table import FACT_LINES_SQL
+
+SCRATCH_DB = 'bench_dictionary_lookups'
+
+MISSING_CUSTOMER_DICT = "dictGetOrDefault('vault.dict_customer', 'CustomerID', tuple(c.hub_customer_hash_key), toUInt64(1)) = 0"
+MISSING_CUSTOMER_IN = "c.hub_customer_hash_key in (select hub_customer_hash_key from vault.hub_customer where CustomerID=0)"
+
+def scratch(sql: str) -> str:
+    """vault 表 / dictionary 改指向 scratch database"""
+    return sql.replace('vault.', f'{SCRATCH_DB}.').replace('{db}', SCRATCH_DB)
+
+def timed(client, sql: str, repeat: int, parameters: dict = None):
+    """最短耗時與查詢結果"""
+    best, rows = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = client.query(sql, parameters=parameters).result_rows
+        best = min(best, time.perf_counter() - start)
+    return best, rows
+
+def prepare(client, rows: int) -> None:
+    client.command(f'CREATE TABLE {SCRATCH_DB}.online_retails AS raw.online_retails')
+    client.command(f'CREATE TABLE {SCRATCH_DB}.psa AS raw.psa_online_retails')
+    client.command(SYNTHETIC_RAW_SQL.format(db=SCRATCH_DB, rows=rows))
+    source_sql = psa.PSA_FULL_SQL.replace('raw.online_retails', f'{SCRATCH_DB}.online_retails')
+    client.command(
+        psa.psa_insert_select_sql(source_sql, target=f'{SCRATCH_DB}.psa'),
+        parameters={'load_datetime': datetime.utcnow().replace(microsecond=0)},
+    )
+    for table, spec in loader.VAULT_SPECS.items():
+        client.command(f'CREATE TABLE {SCRATCH_DB}.{table} AS vault.{table}')
+        client.command(loader.vault_insert_sql(
+            spec, full_scan=True, source=f'{SCRATCH_DB}.psa', target=f'{SCRATCH_DB}.{table}'))
+    # FACT_LINES_SQL 讀取的 current view，定義中的 vault.sat_invoice 改指向 scratch 表
+    client.command(scratch(client.query('SHOW CREATE TABLE vault.sat_invoice_current').result_rows[0][0]))
+    # scratch database 不在 dictionary_reader 的權限內，以 pipeline 的帳號讀取
+    for name in dictionaries.DICTIONARIES:
+        client.command(dictionaries.dictionary_ddl(
+            name, database=SCRATCH_DB, user=os.getenv('CLICKHOUSE_USER', 'default'), password=os.getenv('CLICKHOUSE_PASSWORD', '')))
+        client.command(f'SYSTEM RELOAD DICTIONARY {SCRATCH_DB}.{name}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    client = ch.get_client('heavy')
+    client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+    client.command(f'CREATE DATABASE {SCRATCH_DB}')
+    try:
+        prepare(client, args.rows)
+        months = [int(m) for m, in client.query(
+            f'SELECT DISTINCT toYYYYMM(InvoiceDate) FROM {SCRATCH_DB}.hub_invoice').result_rows]
+        print(f'--- {args.rows:,} raw rows, {len(months)} invoice months, best of {args.repeat} ---')
+
+        lines_sql = 'SELECT count(), countIf(missing_customer), sum(total_amount) FROM ({lines})'
+        variants = {
+            'dictGet': scratch(lines_sql.format(lines=FACT_LINES_SQL)),
+            'in': scratch(lines_sql.format(lines=FACT_LINES_SQL.replace(MISSING_CUSTOMER_DICT, MISSING_CUSTOMER_IN))),
+        }
+        if variants['dictGet'] == variants['in']:
+            raise SystemExit('FACT_LINES_SQL no longer contains the dictGet expression benchmarked here')
+        results = {}
+        for name, sql in variants.items():
+            elapsed, results[name] = timed(client, sql, args.repeat, parameters={'months': months})
+            print(f'fact lines     {name:<8}: {elapsed:8.2f}s')
+        if results['dictGet'] != results['in']:
+            raise SystemExit(f'fact lines differ: {results}')
+    finally:
+        client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Hash Key 表示方式的前後比較報告：
+
+- Python 端：PSA 10 個 key 欄位在 str / uuid / binary 三種表示下的記憶體與產生時間
+- ClickHouse 端：以 String 與 UUID 存放 key 的 hub_invoice / link_invoice_product 的磁碟大小與 join 延遲
+
+    python -m benchmarks.bench_hash_key_format --rows 1000000
+"""
+import argparse
+import sys
+import time
+import utilx.clickhouse_client as ch
+from benchmarks.bench_hashx import HASH_KEYS, synthetic_psa
+from utilx.hashx import generate_hash_keys
+
+SCRATCH_DB = 'bench_hash_keys'
+
+def key_memory_bytes(keys) -> int:
+    """估算 key 欄位實際佔用的記憶體 (uuid.UUID 的 int 屬性不在 memory_usage 計算內)"""
+    total = int(keys.memory_usage(deep=True).sum())
+    first = keys.iloc[0, 0] if len(keys) else None
+    if hasattr(first, 'int'):
+        total += sys.getsizeof(first.int) * keys.size
+    return total
+
+def python_report(rows: int) -> None:
+    df = synthetic_psa(rows)
+    print(f'--- Python: {rows:,} rows, {len(HASH_KEYS)} key columns ---')
+    for key_format in ('uuid', 'binary'):
+        start = time.perf_counter()
+        keys = generate_hash_keys(df, HASH_KEYS, key_format=key_format)
+        elapsed = time.perf_counter() - start
+        print(f'{key_format:<7}: {key_memory_bytes(keys) / 1e6:9.1f} MB  {elapsed:7.2f}s')
+        if key_format == 'uuid':
+            as_str = keys.astype(str)
+            print(f'{"str":<7}: {key_memory_bytes(as_str) / 1e6:9.1f} MB')
+
+def clickhouse_report(rows: int, repeat: int) -> None:
+    client = ch.get_client()
+    client.command(f'CREATE DATABASE IF NOT EXISTS {SCRATCH_DB}')
+    print(f'--- ClickHouse: {rows:,} rows ---')
+    for key_type in ('String', 'UUID'):
+        cast = 'toString' if key_type == 'String' else ''
+        hub = f'{SCRATCH_DB}.hub_invoice_{key_type.lower()}'
+        link = f'{SCRATCH_DB}.link_invoice_product_{key_type.lower()}'
+        client.command(f'DROP TABLE IF EXISTS {hub}')
+        client.command(f'DROP TABLE IF EXISTS {link}')
+        client.command(f'CREATE TABLE {hub} (hub_invoice_hash_key {key_type}) ENGINE = MergeTree() ORDER BY hub_invoice_hash_key')
+        client.command(f"""
+        CREATE TABLE {link} (link_invoice_product_hash_key {key_type}, hub_invoice_hash_key {key_type})
+        ENGINE = MergeTree() ORDER BY link_invoice_product_hash_key
+        """)
+        # 兩張表共用同一組 invoice key，確保兩種型態的 join 命中率相同
+        client.command(f"""
+        INSERT INTO {hub}
+        SELECT {cast}(reinterpretAsUUID(MD5(toString(number)))) FROM numbers({rows})
+        """)
+        client.command(f"""
+        INSERT INTO {link}
+        SELECT {cast}(reinterpretAsUUID(MD5(concat('link', toString(number))))), {cast}(reinterpretAsUUID(MD5(toString(number))))
+        FROM numbers({rows})
+        """)
+        client.command(f'OPTIMIZE TABLE {hub} FINAL')
+        client.command(f'OPTIMIZE TABLE {link} FINAL')
+
+        size = client.command(f"""
+        SELECT sum(bytes_on_disk) FROM system.parts
+        WHERE active AND database = '{SCRATCH_DB}' AND table LIKE '%\\_{key_type.lower()}'
+        """)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            client.command(f"""
+            SELECT count() FROM {hub} h
+            JOIN {link} l ON h.hub_invoice_hash_key = l.hub_invoice_hash_key
+            """)
+            timings.append(time.perf_counter() - start)
+        print(f'{key_type:<7}: {int(size) / 1e6:9.1f} MB on disk  join best {min(timings) * 1000:8.1f} ms')
+    client.command(f'DROP DATABASE {SCRATCH_DB}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-clickhouse', action='store_true')
+    args = parser.parse_args()
+
+    python_report(args.rows)
+    if not args.skip_clickhouse:
+        clickhouse_report(args.rows, args.repeat)
+
+if __name__ == '__main__':
+    main()
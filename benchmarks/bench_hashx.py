@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: utilx.hashx.generate_hash_key (逐列) vs generate_hash_keys (批次)
+
+    python -m benchmarks.bench_hashx --rows 1000000 10000000 --workers 4
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from utilx.hashx import generate_hash_key, generate_hash_keys
+
+HASH_KEYS = {
+    'hub_invoice_hash_key': ['InvoiceNo', 'StockCode', 'InvoiceDate'],
+    'hub_product_hash_key': ['StockCode'],
+    'hub_customer_hash_key': ['CustomerID'],
+    'hub_time_hash_key': ['InvoiceDate'],
+    'hub_country_hash_key': ['Country'],
+    'link_invoice_product_hash_key': ['hub_invoice_hash_key', 'hub_product_hash_key'],
+    'link_invoice_customer_hash_key': ['hub_invoice_hash_key', 'hub_customer_hash_key'],
+    'link_invoice_time_hash_key': ['hub_invoice_hash_key', 'hub_time_hash_key'],
+    'link_invoice_country_hash_key': ['hub_invoice_hash_key', 'hub_country_hash_key'],
+    'link_customer_country_hash_key': ['hub_customer_hash_key', 'hub_country_hash_key'],
+}
+
+def synthetic_psa(rows: int, seed: int = 0) -> pd.DataFrame:
+    """產生與 PSA 清理後相同欄位型態的測試資料"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'InvoiceNo': rng.integers(489434, 581588, rows).astype(str).astype(object),
+        'StockCode': rng.integers(10000, 90000, rows).astype(str).astype(object),
+        'InvoiceDate': (pd.Timestamp('2009-12-01') + pd.to_timedelta(rng.integers(0, 63_000_000, rows), unit='s')).astype(str).astype(object),
+        'CustomerID': pd.array(rng.integers(0, 6000, rows) + 12000, dtype='UInt64'),
+        'Country': rng.choice(['United Kingdom', 'France', 'Germany', 'EIRE', 'Spain'], rows).astype(object),
+    })
+
+def run_legacy(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    for key, columns in HASH_KEYS.items():
+        out[key] = generate_hash_key(out, columns)
+    return out[list(HASH_KEYS)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--skip-legacy-above', type=int, default=10_000_000,
+                        help='列數超過此值時略過逐列版本')
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = synthetic_psa(rows)
+        print(f'--- {rows:,} rows ---')
+
+        legacy = None
+        if rows <= args.skip_legacy_above:
+            start = time.perf_counter()
+            legacy = run_legacy(df)
+            print(f'generate_hash_key x10        : {time.perf_counter() - start:8.2f}s')
+
+        for workers in sorted({1, args.workers}):
+            start = time.perf_counter()
+            batch = generate_hash_keys(df, HASH_KEYS, workers=workers)
+            print(f'generate_hash_keys workers={workers:<2}: {time.perf_counter() - start:8.2f}s')
+            if legacy is not None:
+                assert legacy.equals(batch), 'batch keys differ from generate_hash_key'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+pipeline 主要查詢在固定合成資料上的離線效能回歸檢查 (tasks/metrics/perf_gate.py，suite=offline)。
+
+    python -m benchmarks.bench_perf_gate --rows 1000000 [--fail]
+
+需要已套用 ddl/init.sql 的本機 ClickHouse (讀取 system.query_log、寫入 quality.pipeline_perf)。
+在 scratch database 以固定的合成資料與 load_datetime 依序執行 PSA、vault、fact lines 與每日彙總，
+各階段的查詢以 online_retails:<stage>: 標記；與先前 offline 執行的中位數比較，--fail 時有退化則以非 0 結束。
+"""
+import argparse
+import os
+from datetime import datetime
+import utilx.clickhouse_client as ch
+from benchmarks.bench_psa_engine import SYNTHETIC_RAW_SQL, psa
+from tasks.vault import dictionaries, loader  # bench_psa_engine 已將 online_retails 加入 sys.path
+from tasks.mart.build_fact_table import FACT_LINES_SQL
+from tasks.metrics import perf_gate
+
+SCRATCH_DB = 'bench_perf_gate'
+
+# 固定的 load_datetime，讓每次執行的資料與查詢完全相同
+LOAD_DATETIME = datetime(2024, 1, 1)
+
+DAILY_SQL = """
+SELECT toDate(invoice_date) AS date, count(), sum(total_amount), quantileTDigest(toFloat64(total_amount))
+FROM ({lines})
+GROUP BY date
+"""
+
+def scratch(sql: str) -> str:
+    """vault 表 / dictionary 改指向 scratch database"""
+    return sql.replace('vault.', f'{SCRATCH_DB}.').replace('{db}', SCRATCH_DB)
+
+def stages(rows: int):
+    """(stage 名稱, 以 client 執行該階段的函式)；stage 即 pipeline_perf 的 task"""
+    def load_raw(client):
+        client.command(f'CREATE TABLE {SCRATCH_DB}.online_retails AS raw.online_retails')
+        client.command(SYNTHETIC_RAW_SQL.format(db=SCRATCH_DB, rows=rows))
+
+    def load_psa(client):
+        client.command(f'CREATE TABLE {SCRATCH_DB}.psa AS raw.psa_online_retails')
+        source_sql = psa.PSA_FULL_SQL.replace('raw.online_retails', f'{SCRATCH_DB}.online_retails')
+        client.command(psa.psa_insert_select_sql(source_sql, target=f'{SCRATCH_DB}.psa'),
+                       parameters={'load_datetime': LOAD_DATETIME})
+
+    def load_vault(client):
+        for table, spec in loader.VAULT_SPECS.items():
+            client.command(f'CREATE TABLE {SCRATCH_DB}.{table} AS vault.{table}')
+            client.command(loader.vault_insert_sql(
+                spec, full_scan=True, source=f'{SCRATCH_DB}.psa', target=f'{SCRATCH_DB}.{table}'))
+        client.command(scratch(client.query('SHOW CREATE TABLE vault.sat_invoice_current').result_rows[0][0]))
+        # scratch database 不在 dictionary_reader 的權限內，以 pipeline 的帳號讀取
+        for name in dictionaries.DICTIONARIES:
+            client.command(dictionaries.dictionary_ddl(
+                name, database=SCRATCH_DB, user=os.getenv('CLICKHOUSE_USER', 'default'), password=os.getenv('CLICKHOUSE_PASSWORD', '')))
+            client.command(f'SYSTEM RELOAD DICTIONARY {SCRATCH_DB}.{name}')
+
+    def months(client):
+        return [int(m) for m, in client.query(
+            f'SELECT DISTINCT toYYYYMM(InvoiceDate) FROM {SCRATCH_DB}.hub_invoice').result_rows]
+
+    def fact_lines(client):
+        client.query(scratch(f'SELECT count(), countIf(missing_customer), sum(total_amount) FROM ({FACT_LINES_SQL})'),
+                     parameters={'months': months(client)})
+
+    def daily_rollup(client):
+        client.query(scratch(DAILY_SQL.format(lines=FACT_LINES_SQL)), parameters={'months': months(client)})
+
+    return [('raw', load_raw), ('psa', load_psa), ('vault', load_vault),
+            ('fact_lines', fact_lines), ('daily_rollup', daily_rollup)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--window', type=int, default=7)
+    parser.add_argument('--fail', action='store_true', help='有退化時以非 0 結束')
+    args = parser.parse_args()
+
+    client = ch.get_client('heavy')
+    client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+    client.command(f'CREATE DATABASE {SCRATCH_DB}')
+    query_ids = []
+    try:
+        for stage, run in stages(args.rows):
+            with ch.tagged_queries(stage) as queries:
+                run(ch.get_client('heavy'))
+            query_ids += [q.query_id for q in queries]
+            print(f'{stage:<12}: {len(queries)} queries')
+    finally:
+        client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+
+    flow_run = f"offline-{datetime.utcnow():%Y%m%dT%H%M%S}"
+    regressions = perf_gate.check_run(ch.get_client('metrics'), query_ids, flow_run, suite='offline',
+                                      threshold=args.threshold, window=args.window)
+    print(f'--- {flow_run}: {args.rows:,} raw rows, {len(regressions)} regressions beyond {args.threshold:.0%} ---')
+    for regression in regressions:
+        print(regression)
+    if regressions and args.fail:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
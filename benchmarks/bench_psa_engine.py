@@ -0,0 +1,99 @@
+"""
+PSA 轉換引擎 pandas 與 clickhouse 的一致性檢查與耗時比較。
+
+    python -m benchmarks.bench_psa_engine --rows 1000000
+
+在 scratch database 以合成資料建立 raw 表，分別以兩種引擎全量轉換到各自的 PSA 表，
+比對兩邊的列數與所有欄位 (LOAD_DATETIME 除外) 是否相同。
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+import utilx.clickhouse_client as ch
+from utilx.resource_usage import peak_rss_mb
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'online_retails'))
+from tasks.raw import extract_online_retails as psa  # noqa: E402
+
+SCRATCH_DB = 'bench_psa_engine'
+
+SYNTHETIC_RAW_SQL = """
+INSERT INTO {db}.online_retails
+SELECT
+    concat(if(number % 50 = 0, 'C', ''), toString(489434 + intDiv(number, 20))) AS InvoiceNo,
+    if(number % 997 = 0, NULL, toString(10000 + cityHash64(number, 's') % 5000)) AS StockCode,
+    if(number % 13 = 0, NULL, concat('ITEM ', toString(cityHash64(number, 's') % 5000))) AS Description,
+    toInt32(cityHash64(number, 'q') % 50) - 2 AS Quantity,
+    toString(toDateTime('2009-12-01 07:45:00', 'UTC') + intDiv(number, 20) * 60) AS InvoiceDate,
+    round((cityHash64(number, 'p') % 2000) / 100, 2) AS UnitPrice,
+    if(number % 5 = 0, NULL, 12346 + cityHash64(intDiv(number, 20), 'c') % 6000) AS CustomerID,
+    ['United Kingdom', 'France', 'EIRE', 'Germany'][1 + cityHash64(intDiv(number, 20), 'k') % 4] AS Country,
+    Quantity * UnitPrice AS TotalAmount
+FROM numbers({rows})
+"""
+
+def compared_columns() -> str:
+    return ', '.join(c for c in psa.PSA_COLUMNS if c != 'LOAD_DATETIME')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--hash-workers', type=int, default=1)
+    args = parser.parse_args()
+
+    client = ch.get_client()
+    client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+    client.command(f'CREATE DATABASE {SCRATCH_DB}')
+    try:
+        client.command(f'CREATE TABLE {SCRATCH_DB}.online_retails AS raw.online_retails')
+        for engine in psa.PSA_ENGINES:
+            client.command(f'CREATE TABLE {SCRATCH_DB}.psa_{engine} AS raw.psa_online_retails')
+        client.command(SYNTHETIC_RAW_SQL.format(db=SCRATCH_DB, rows=args.rows))
+        source_sql = psa.PSA_FULL_SQL.replace('raw.online_retails', f'{SCRATCH_DB}.online_retails')
+        load_datetime = datetime.utcnow().replace(microsecond=0)
+        print(f'--- {args.rows:,} raw rows ---')
+
+        start = time.perf_counter()
+        df = ch.arrow_to_frame(ch.query_arrow(client, source_sql))
+        df_psa = psa.transform_psa(df, load_datetime, hash_workers=args.hash_workers, key_format='arrow')
+        ch.insert_frame_arrow(client, f'{SCRATCH_DB}.psa_pandas', df_psa, decimals=psa.PSA_DECIMAL_COLUMNS)
+        elapsed = time.perf_counter() - start
+        del df, df_psa
+        print(f'{"pandas":<11}: {elapsed:8.2f}s  {args.rows / elapsed:>10,.0f} rows/sec  peak RSS {peak_rss_mb():,.0f} MB')
+
+        start = time.perf_counter()
+        client.command(
+            psa.psa_insert_select_sql(source_sql, target=f'{SCRATCH_DB}.psa_clickhouse'),
+            parameters={'load_datetime': load_datetime},
+        )
+        elapsed = time.perf_counter() - start
+        print(f'{"clickhouse":<11}: {elapsed:8.2f}s  {args.rows / elapsed:>10,.0f} rows/sec')
+
+        counts = {
+            engine: int(client.command(f'SELECT count() FROM {SCRATCH_DB}.psa_{engine}'))
+            for engine in psa.PSA_ENGINES
+        }
+        columns = compared_columns()
+        only_pandas = int(client.command(f"""
+        SELECT count() FROM (
+            SELECT {columns} FROM {SCRATCH_DB}.psa_pandas
+            EXCEPT SELECT {columns} FROM {SCRATCH_DB}.psa_clickhouse
+        )
+        """))
+        only_clickhouse = int(client.command(f"""
+        SELECT count() FROM (
+            SELECT {columns} FROM {SCRATCH_DB}.psa_clickhouse
+            EXCEPT SELECT {columns} FROM {SCRATCH_DB}.psa_pandas
+        )
+        """))
+        print(f'rows: {counts}  only in pandas: {only_pandas}  only in clickhouse: {only_clickhouse}')
+        if counts['pandas'] != counts['clickhouse'] or only_pandas or only_clickhouse:
+            raise SystemExit('PSA engines produced different results')
+        print('parity ok')
+    finally:
+        client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+
+if __name__ == '__main__':
+    main()
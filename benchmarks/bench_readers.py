@@ -0,0 +1,67 @@
+"""
+各 reader backend 讀取 Online Retail II 的耗時比較 (整表讀取與串流讀取)。
+
+    python -m benchmarks.bench_readers path/to/online_retail_II.xlsx  (或下載的 .zip)
+
+CSV 與 Parquet 由同一份資料轉出，用來比較格式本身的解析成本。
+"""
+import argparse
+import os
+import tempfile
+import time
+import zipfile
+import pandas as pd
+from utilx import readers
+
+def extract_workbook(path: str, workdir: str) -> str:
+    if not path.lower().endswith('.zip'):
+        return path
+    with zipfile.ZipFile(path) as z:
+        member = next(m for m in z.namelist() if m.lower().endswith(readers.EXCEL_SUFFIXES))
+        return z.extract(member, path=workdir)
+
+def timed(label: str, fn) -> None:
+    start = time.perf_counter()
+    rows = fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<28}: {elapsed:8.2f}s  {rows:>9,} rows  {rows / elapsed:>10,.0f} rows/sec')
+
+def read_all(path: str, reader: str) -> int:
+    return sum(len(readers.read_frame(path, sheet, reader)) for sheet in readers.list_sheets(path, reader))
+
+def stream_all(path: str, reader: str, chunk_size: int) -> int:
+    return sum(
+        len(chunk)
+        for sheet in readers.list_sheets(path, reader)
+        for chunk in readers.iter_frames(path, sheet, reader, chunk_size)
+    )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workbook = extract_workbook(args.path, workdir)
+        print(f'--- {os.path.basename(workbook)} ({os.path.getsize(workbook) / 1e6:.1f} MB) ---')
+
+        for reader in readers.EXCEL_READERS:
+            timed(f'{reader} read_frame', lambda: read_all(workbook, reader))
+            timed(f'{reader} iter_frames', lambda: stream_all(workbook, reader, args.chunk_size))
+
+        data = pd.concat(
+            [readers.read_frame(workbook, sheet, 'calamine') for sheet in readers.list_sheets(workbook, 'calamine')],
+            ignore_index=True,
+        )
+        csv_path = os.path.join(workdir, 'online_retail_II.csv')
+        parquet_path = os.path.join(workdir, 'online_retail_II.parquet')
+        data.to_csv(csv_path, index=False)
+        data.astype({'Invoice': str, 'StockCode': str}).to_parquet(parquet_path, index=False)
+
+        for reader, path in (('csv', csv_path), ('parquet', parquet_path)):
+            timed(f'{reader} read_frame', lambda: read_all(path, reader))
+            timed(f'{reader} iter_frames', lambda: stream_all(path, reader, args.chunk_size))
+
+if __name__ == '__main__':
+    main()
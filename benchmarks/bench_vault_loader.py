@@ -0,0 +1,83 @@
+"""
+vault 載入策略 anti_join 與 not_in (舊作法) 在 vault 大小成長時的耗時比較。
+
+    python -m benchmarks.bench_vault_loader --vault-rows 100000 1000000 --batch-rows 50000
+
+每個 --vault-rows 在 scratch database 先以合成資料建立歷史 PSA 與已載入的 vault，
+再寫入一批 --batch-rows 的新 PSA batch，量測兩種策略把該 batch 載入全部 13 張 vault 表的時間。
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+import utilx.clickhouse_client as ch
+from benchmarks.bench_psa_engine import SYNTHETIC_RAW_SQL, psa
+from tasks.vault import loader  # bench_psa_engine 已將 online_retails 加入 sys.path
+
+SCRATCH_DB = 'bench_vault_loader'
+
+def target(table: str, strategy: str) -> str:
+    return f'{SCRATCH_DB}.{table}__{strategy}'
+
+def load_psa(client, offset: int, rows: int, load_datetime: datetime) -> None:
+    client.command(f'TRUNCATE TABLE {SCRATCH_DB}.online_retails')
+    client.command(SYNTHETIC_RAW_SQL.format(db=SCRATCH_DB, rows=f'{offset}, {rows}'))
+    source_sql = psa.PSA_FULL_SQL.replace('raw.online_retails', f'{SCRATCH_DB}.online_retails')
+    client.command(
+        psa.psa_insert_select_sql(source_sql, target=f'{SCRATCH_DB}.psa'),
+        parameters={'load_datetime': load_datetime},
+    )
+
+def run(client, vault_rows: int, batch_rows: int) -> None:
+    client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+    client.command(f'CREATE DATABASE {SCRATCH_DB}')
+    client.command(f'CREATE TABLE {SCRATCH_DB}.online_retails AS raw.online_retails')
+    client.command(f'CREATE TABLE {SCRATCH_DB}.psa AS raw.psa_online_retails')
+    for table in loader.VAULT_SPECS:
+        for strategy in loader.VAULT_STRATEGIES:
+            client.command(f'CREATE TABLE {target(table, strategy)} AS vault.{table}')
+
+    # 歷史資料：PSA 與兩組 vault 表內容相同
+    history = datetime.utcnow().replace(microsecond=0) - timedelta(days=1)
+    load_psa(client, 0, vault_rows, history)
+    for table, spec in loader.VAULT_SPECS.items():
+        for strategy in loader.VAULT_STRATEGIES:
+            client.command(loader.vault_insert_sql(
+                spec, full_scan=True, source=f'{SCRATCH_DB}.psa', target=target(table, strategy)))
+
+    batch = history + timedelta(days=1)
+    load_psa(client, vault_rows, batch_rows, batch)
+    for strategy in loader.VAULT_STRATEGIES:
+        start = time.perf_counter()
+        for table, spec in loader.VAULT_SPECS.items():
+            client.command(
+                loader.vault_insert_sql(spec, strategy, source=f'{SCRATCH_DB}.psa', target=target(table, strategy)),
+                parameters={'load_datetime': batch},
+            )
+        elapsed = time.perf_counter() - start
+        print(f'vault {vault_rows:>12,} rows  {strategy:<10}: {elapsed:8.2f}s')
+
+    # satellite 在 anti_join 下會另外寫入 Hash Diff 變動的版本，兩種策略只比對 key 數
+    for table, spec in loader.VAULT_SPECS.items():
+        counts = {
+            strategy: int(client.command(f'SELECT uniqExact({spec.key}) FROM {target(table, strategy)}'))
+            for strategy in loader.VAULT_STRATEGIES
+        }
+        if len(set(counts.values())) != 1:
+            raise SystemExit(f'{table}: strategies produced different key counts {counts}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vault-rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--batch-rows', type=int, default=50_000)
+    args = parser.parse_args()
+
+    client = ch.get_client('heavy')
+    print(f'--- batch of {args.batch_rows:,} PSA rows ---')
+    try:
+        for vault_rows in args.vault_rows:
+            run(client, vault_rows, args.batch_rows)
+    finally:
+        client.command(f'DROP DATABASE IF EXISTS {SCRATCH_DB}')
+
+if __name__ == '__main__':
+    main()
@@ -45,10 +45,37 @@ CREATE TABLE IF NOT EXISTS raw.psa_online_retails (
     ReturnStatus LowCardinality(String),
     -- DV2.0 Standard Columns
     LOAD_DATETIME DateTime64(0,'UTC'),
-    RECORD_SOURCE String
+    RECORD_SOURCE String,
+    -- raw 列的指紋，增量載入時用來判斷該列是否已寫入 PSA
+    RAW_FINGERPRINT UInt64,
+    -- Hash Diff：satellite 描述屬性的雜湊，寫入時由 ClickHouse 計算 (兩種 PSA 引擎結果一致)
+    sat_invoice_hashdiff UInt64 MATERIALIZED cityHash64(Quantity, UnitPrice, TotalAmount, toString(ReturnStatus)),
+    sat_product_hashdiff UInt64 MATERIALIZED cityHash64(isNull(Description), ifNull(Description, '')),
+    -- bit i 為 1 表示 tasks.vault.loader.KEY_INDEX_TABLES[i] 的 key 可能尚未載入 vault (由 PSA 依 key 索引清除)
+    KEY_CANDIDATES UInt16 DEFAULT 65535,
+    -- vault 載入只讀最近一次 LOAD_DATETIME 的 batch
+    INDEX idx_load_datetime LOAD_DATETIME TYPE minmax GRANULARITY 1
 ) ENGINE = MergeTree()
 ORDER BY (InvoiceDate, hub_invoice_hash_key);
 
+-- 既有環境補上 RAW_FINGERPRINT、Hash Diff、KEY_CANDIDATES 欄位與 LOAD_DATETIME 索引
+ALTER TABLE raw.psa_online_retails ADD COLUMN IF NOT EXISTS RAW_FINGERPRINT UInt64;
+ALTER TABLE raw.psa_online_retails ADD COLUMN IF NOT EXISTS sat_invoice_hashdiff UInt64 MATERIALIZED cityHash64(Quantity, UnitPrice, TotalAmount, toString(ReturnStatus));
+ALTER TABLE raw.psa_online_retails ADD COLUMN IF NOT EXISTS sat_product_hashdiff UInt64 MATERIALIZED cityHash64(isNull(Description), ifNull(Description, ''));
+ALTER TABLE raw.psa_online_retails ADD COLUMN IF NOT EXISTS KEY_CANDIDATES UInt16 DEFAULT 65535;
+ALTER TABLE raw.psa_online_retails ADD INDEX IF NOT EXISTS idx_load_datetime LOAD_DATETIME TYPE minmax GRANULARITY 1;
+
+-- 1.3 PSA 載入紀錄 (每次執行的模式、watermark 與增量大小)
+CREATE TABLE IF NOT EXISTS raw.psa_load_log (
+    LOAD_DATETIME DateTime64(0,'UTC'),
+    mode LowCardinality(String),
+    watermark Nullable(DateTime64(0,'UTC')),
+    raw_rows UInt64,
+    delta_rows UInt64,
+    psa_rows UInt64
+) ENGINE = MergeTree()
+ORDER BY LOAD_DATETIME;
+
 
 -- ====================================================================
 -- 2. VAULT DATABASE: 儲存核心業務模型
@@ -82,7 +109,7 @@ CREATE TABLE IF NOT EXISTS vault.hub_customer (
 ) ENGINE = MergeTree()
 PRIMARY KEY hub_customer_hash_key;
 
-drop table vault.hub_time;
+DROP TABLE IF EXISTS vault.hub_time;
 CREATE TABLE IF NOT EXISTS vault.hub_time (
     hub_time_hash_key UUID,
     InvoiceDate DateTime64(0, 'UTC'),
@@ -154,6 +181,8 @@ CREATE TABLE IF NOT EXISTS vault.sat_invoice (
     UnitPrice Decimal(10, 4),
     TotalAmount Decimal(10, 4),
     ReturnStatus Enum8('Normal' = 0, 'Return' = 1),
+    -- 與 PSA sat_invoice_hashdiff 相同的運算式，既有資料讀取時以 DEFAULT 計算
+    HASHDIFF UInt64 DEFAULT cityHash64(Quantity, UnitPrice, TotalAmount, toString(ReturnStatus)),
     EFFECTIVE_FROM DateTime64(0, 'UTC'),
     LOAD_DATETIME DateTime64(0, 'UTC'),
     RECORD_SOURCE String
@@ -164,6 +193,8 @@ ORDER BY (hub_invoice_hash_key, EFFECTIVE_FROM);
 CREATE TABLE IF NOT EXISTS vault.sat_product (
     hub_product_hash_key UUID,
     Description Nullable(String),
+    -- 與 PSA sat_product_hashdiff 相同的運算式
+    HASHDIFF UInt64 DEFAULT cityHash64(isNull(Description), ifNull(Description, '')),
     EFFECTIVE_FROM DateTime64(0, 'UTC'),
     LOAD_DATETIME DateTime64(0, 'UTC'),
     RECORD_SOURCE String
@@ -171,6 +202,10 @@ CREATE TABLE IF NOT EXISTS vault.sat_product (
 PRIMARY KEY hub_product_hash_key
 ORDER BY (hub_product_hash_key, EFFECTIVE_FROM);
 
+-- 既有環境補上 HASHDIFF 欄位
+ALTER TABLE vault.sat_invoice ADD COLUMN IF NOT EXISTS HASHDIFF UInt64 DEFAULT cityHash64(Quantity, UnitPrice, TotalAmount, toString(ReturnStatus)) AFTER ReturnStatus;
+ALTER TABLE vault.sat_product ADD COLUMN IF NOT EXISTS HASHDIFF UInt64 DEFAULT cityHash64(isNull(Description), ifNull(Description, '')) AFTER Description;
+
 
 CREATE TABLE IF NOT EXISTS vault.sat_time (
     hub_time_hash_key UUID,
@@ -185,73 +220,169 @@ CREATE TABLE IF NOT EXISTS vault.sat_time (
 PRIMARY KEY hub_time_hash_key
 ORDER BY (hub_time_hash_key, EFFECTIVE_FROM);
 
+-- 2.4 CURRENT SATELLITES (每個 hash key 最新 EFFECTIVE_FROM 的版本，供 marts 使用) --
+
+CREATE VIEW IF NOT EXISTS vault.sat_invoice_current AS
+SELECT
+    hub_invoice_hash_key,
+    latest.1 AS Quantity,
+    latest.2 AS UnitPrice,
+    latest.3 AS TotalAmount,
+    latest.4 AS ReturnStatus,
+    latest.5 AS EFFECTIVE_FROM
+FROM (
+    SELECT hub_invoice_hash_key, argMax((Quantity, UnitPrice, TotalAmount, ReturnStatus, EFFECTIVE_FROM), EFFECTIVE_FROM) AS latest
+    FROM vault.sat_invoice
+    GROUP BY hub_invoice_hash_key
+);
+
+CREATE VIEW IF NOT EXISTS vault.sat_product_current AS
+SELECT
+    hub_product_hash_key,
+    latest.1 AS Description,
+    latest.2 AS EFFECTIVE_FROM
+FROM (
+    SELECT hub_product_hash_key, argMax((Description, EFFECTIVE_FROM), EFFECTIVE_FROM) AS latest
+    FROM vault.sat_product
+    GROUP BY hub_product_hash_key
+);
+
+-- 2.5 DICTIONARIES (vault.dict_customer，fact 建置以 dictGet 查詢) --
+-- 由 tasks/vault/dictionaries.py 的 refresh_dictionaries 建立並重新載入。來源以專用的唯讀帳號 dictionary_reader 讀取，
+-- dictionary 定義中不含 pipeline 的帳號密碼；帳號的密碼來自 .env (CLICKHOUSE_DICTIONARY_PASSWORD)，
+-- 由 tasks/maintenance/create_dictionary_user.py 建立並授予此 role
+CREATE ROLE IF NOT EXISTS vault_reader;
+GRANT SELECT ON vault.* TO vault_reader;
+
 
 -- ====================================================================
 -- 3. MARTS DATABASE: 存放供分析的 Star Schema 及監控指標
 -- ====================================================================
 CREATE DATABASE IF NOT EXISTS marts;
 
--- 3.1 Dimensions --
+-- 3.1 Dimensions (ReplacingMergeTree：以 updated_at 保留每個 key 最新寫入的版本，支援依 key upsert；Dim_Time 為整表產生的日曆) --
 CREATE TABLE IF NOT EXISTS marts.Dim_Product (
     product_key UUID,
     stock_code String,
-    description Nullable(String)
-) ENGINE = MergeTree()
+    description Nullable(String),
+    updated_at DateTime64(0, 'UTC')
+) ENGINE = ReplacingMergeTree(updated_at)
 PRIMARY KEY product_key;
 
 CREATE TABLE IF NOT EXISTS marts.Dim_Customer (
     customer_key UUID,
     customer_id UInt64,
-    country_key UUID
-) ENGINE = MergeTree()
+    country_key UUID,
+    updated_at DateTime64(0, 'UTC')
+) ENGINE = ReplacingMergeTree(updated_at)
 ORDER BY(customer_key, country_key);
 
+-- 日粒度的日曆維度，涵蓋 vault.hub_invoice 的日期範圍 (約 800 列)，每次 flow 整表重新產生；
+-- date_key 為 YYYYMMDD，與 fact 的 date_key 對應
 CREATE TABLE IF NOT EXISTS marts.Dim_Time (
-    time_key UUID,
+    date_key UInt32,
     date Date,
     year UInt16,
+    quarter UInt8,
     month UInt8,
-    day_of_week UInt8
+    day_of_month UInt8,
+    week_of_year UInt8,
+    day_of_week UInt8,
+    is_weekend Bool
 ) ENGINE = MergeTree()
-PRIMARY KEY time_key;
+ORDER BY date_key;
 
 CREATE TABLE IF NOT EXISTS marts.Dim_Country (
     country_key UUID,
-    country_name String
-) ENGINE = MergeTree()
+    country_name String,
+    updated_at DateTime64(0, 'UTC')
+) ENGINE = ReplacingMergeTree(updated_at)
 PRIMARY KEY country_key;
 
 
 
--- 3.2 Facts --
+-- 3.2 Facts (依發票月份分區，每次只重算本次載入涉及的月份並以 REPLACE PARTITION 換入) --
 CREATE TABLE IF NOT EXISTS marts.Fact_Sales (
     sale_id UUID,
     invoice_no String,
+    invoice_date Date,
     product_key UUID,
     customer_key UUID,
-    time_key UUID,
+    date_key UInt32,
     country_key UUID,
     quantity Int32,
     unit_price Decimal(10, 4),
     total_amount Decimal(10, 4)
 ) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(invoice_date)
 ORDER BY (sale_id);
 
 
 CREATE TABLE IF NOT EXISTS marts.Fact_Sale_Returns (
     sale_id UUID,
     invoice_no String,
+    invoice_date Date,
     product_key UUID,
     customer_key UUID,
-    time_key UUID,
+    date_key UInt32,
     country_key UUID,
     quantity Int32,
     unit_price Decimal(10, 4),
     total_amount Decimal(10, 4)
 ) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(invoice_date)
 ORDER BY (sale_id);
 
 
+-- 3.3 Wide table (選用，MART_SALES_WIDE=true 時由 flow 與 Fact_Sales 同步重算受影響月份) --
+-- Fact_Sales 攤平日期 / 國家 / 商品屬性，dashboard (每日趨勢、近 30 天國家排行與熱門商品) 不需 join 維度；
+-- 以日期排序，近 30 天的查詢只讀取最近的分區與 granule
+CREATE TABLE IF NOT EXISTS marts.Sales_Wide (
+    date Date,
+    year UInt16,
+    month UInt8,
+    country_name LowCardinality(String),
+    stock_code LowCardinality(String),
+    description Nullable(String),
+    sale_id UUID,
+    invoice_no String,
+    quantity Int32,
+    unit_price Decimal(10, 4),
+    total_amount Decimal(10, 4)
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (date, country_name, stock_code);
+
+
+-- 3.4 Rollup (依發票月份分區，與 Fact_Sales 同步重算受影響月份) --
+-- 每日 × 國家 × 商品的可合併聚合狀態：近 30 天國家排行 / 熱門商品與每日銷售摘要只讀預先聚合的列；
+-- 跨列合併時 SimpleAggregateFunction 以 sum / min / max、total_amount_quantiles 以 quantileTDigestMerge 合併
+CREATE TABLE IF NOT EXISTS marts.Sales_Daily_Rollup (
+    date Date,
+    country_key UUID,
+    product_key UUID,
+    lines SimpleAggregateFunction(sum, UInt64),
+    quantity SimpleAggregateFunction(sum, Int64),
+    volume SimpleAggregateFunction(sum, Decimal(38, 4)),
+    min_total_amount SimpleAggregateFunction(min, Decimal(10, 4)),
+    max_total_amount SimpleAggregateFunction(max, Decimal(10, 4)),
+    total_amount_quantiles AggregateFunction(quantileTDigest, Float64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (date, country_key, product_key);
+
+-- 3.5 Build log --
+-- build_fact_partitions 每次發佈的目標表與重算的月份；沒有紀錄的表 (首次建置或結構遷移後) 全量重算，
+-- 而非以表是否為空判斷 (anomaly_customer_invoioces、Fact_Sale_Returns 可能正常地為空)
+CREATE TABLE IF NOT EXISTS marts.build_log (
+    table_name LowCardinality(String),
+    built_at DateTime64(0, 'UTC'),
+    full_refresh Bool,
+    months Array(UInt32)
+) ENGINE = MergeTree()
+ORDER BY (table_name, built_at);
+
+
 -- ====================================================================
 -- 4. METRICS DATABASE: 存放異常數據與品質檢查的監控指標
 -- ====================================================================
@@ -259,17 +390,20 @@ ORDER BY (sale_id);
 CREATE DATABASE IF NOT EXISTS quality;
 
 -- 4.1 Metrics for anomaly detection --
+-- 缺少客戶 ID 的發票明細，與 marts 的 fact 在同一次建置中產生，因此同樣依發票月份分區
 CREATE TABLE IF NOT EXISTS quality.anomaly_customer_invoioces (
     sale_id UUID,
     invoice_no String,
+    invoice_date Date,
     product_key UUID,
     customer_key UUID,
-    time_key UUID,
+    date_key UInt32,
     country_key UUID,
     quantity Int32,
     unit_price Decimal(10, 4),
     total_amount Decimal(10, 4)
 ) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(invoice_date)
 ORDER BY sale_id;
 
 
@@ -278,7 +412,7 @@ CREATE TABLE IF NOT EXISTS quality.anomaly_invoice (
     invoice_no String,
     product_key UUID,
     customer_key UUID,
-    time_key UUID,
+    date_key UInt32,
     country_key UUID,
     quantity Int32,
     unit_price Decimal(10, 4),
@@ -287,21 +421,76 @@ CREATE TABLE IF NOT EXISTS quality.anomaly_invoice (
 ORDER BY sale_id;
 
 
-CREATE TABLE IF NOT EXISTS quality.data_quality (
+-- 宣告式品質規則 (tasks/quality/marker.py 的 QUALITY_RULES) 的結果，每次檢查每條規則一列；
+-- partitions 為本次檢查的發票月份，空陣列表示檢查全部資料
+CREATE TABLE IF NOT EXISTS quality.rule_results (
     check_date Date,
-    missing_customer_id_ratio Float64,
-    anomaly_unit_price_count UInt64,
-    anomaly_quantity_count UInt64
-) ENGINE = ReplacingMergeTree(check_date)
-ORDER BY check_date;
-
-
-CREATE TABLE IF NOT EXISTS quality.sales_summary (
-    sales_date Date,
-    min_total_amount Float64,
-    max_total_amount Float64,
-    median_total_amount Float64,
-    avg_total_amount Float64,
-    volume Float64
-) ENGINE = ReplacingMergeTree(sales_date)
-ORDER BY sales_date;
+    checked_at DateTime64(0, 'UTC'),
+    rule LowCardinality(String),
+    kind LowCardinality(String),
+    source LowCardinality(String),
+    value Float64,
+    failed UInt64,
+    total UInt64,
+    partitions Array(UInt32)
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(check_date)
+ORDER BY (rule, checked_at);
+
+
+-- 每日最後一次全量檢查的監控指標 (與原本的 data_quality 表欄位相同)；既有環境以 tasks/maintenance/migrate_quality_rules.py 轉換。
+-- 只檢查部分月份的結果 (partitions 非空) 不代表整體資料狀態，不列入，見 data_quality_batches
+CREATE VIEW IF NOT EXISTS quality.data_quality AS
+SELECT
+    check_date,
+    argMaxIf(value, checked_at, rule = 'missing_customer_id_ratio') AS missing_customer_id_ratio,
+    toUInt64(argMaxIf(failed, checked_at, rule = 'anomaly_unit_price_count')) AS anomaly_unit_price_count,
+    toUInt64(argMaxIf(failed, checked_at, rule = 'anomaly_quantity_count')) AS anomaly_quantity_count
+FROM quality.rule_results
+WHERE empty(partitions)
+GROUP BY check_date;
+
+-- 只檢查本次 PSA batch 涉及月份 (QUALITY_PARTITIONED=true) 的結果，每次檢查一列，指標只代表 partitions 中的月份
+CREATE VIEW IF NOT EXISTS quality.data_quality_batches AS
+SELECT
+    checked_at,
+    partitions,
+    anyIf(value, rule = 'missing_customer_id_ratio') AS missing_customer_id_ratio,
+    toUInt64(anyIf(failed, rule = 'anomaly_unit_price_count')) AS anomaly_unit_price_count,
+    toUInt64(anyIf(failed, rule = 'anomaly_quantity_count')) AS anomaly_quantity_count
+FROM quality.rule_results
+WHERE notEmpty(partitions)
+GROUP BY checked_at, partitions;
+
+
+-- 每日銷售摘要 (與原本的 sales_summary 表欄位相同)，由 marts.Sales_Daily_Rollup 合併而來，中位數為 t-digest 近似值；
+-- 既有環境以 tasks/maintenance/migrate_sales_rollup.py 轉換。
+-- 以表別名 r 引用原始欄位：輸出欄位 volume / min_total_amount 等與來源欄位同名，未加別名時聚合中的 volume 會解析為輸出的別名
+CREATE VIEW IF NOT EXISTS quality.sales_summary AS
+SELECT
+    r.date AS sales_date,
+    toFloat64(min(r.min_total_amount)) AS min_total_amount,
+    toFloat64(max(r.max_total_amount)) AS max_total_amount,
+    toFloat64(quantileTDigestMerge(0.5)(r.total_amount_quantiles)) AS median_total_amount,
+    toFloat64(sum(r.volume)) / sum(r.lines) AS avg_total_amount,
+    toFloat64(sum(r.volume)) AS volume
+FROM marts.Sales_Daily_Rollup AS r
+GROUP BY r.date;
+
+
+-- 4.2 Pipeline performance history --
+-- 每次執行各 task 的 system.query_log 統計 (query_id 以 online_retails:<task>: 開頭)，
+-- tasks/metrics/perf_gate.py 以同一 suite (nightly / offline) 先前執行的中位數為 baseline 判斷退化
+CREATE TABLE IF NOT EXISTS quality.pipeline_perf (
+    suite LowCardinality(String),
+    flow_run String,
+    run_at DateTime64(0, 'UTC'),
+    task LowCardinality(String),
+    queries UInt64,
+    read_rows UInt64,
+    read_bytes UInt64,
+    memory_usage Int64,
+    query_duration_ms UInt64
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(run_at)
+ORDER BY (suite, task, run_at);
@@ -1,9 +1,9 @@
 from prefect import flow
 from tasks.raw import extract_online_retails
-from tasks.vault import load_hubs, load_links, load_sats
-from tasks.mart import build_fact_table, build_dim_table
+from tasks.vault import load_hubs, load_links, load_sats, dictionaries
+from tasks.mart import build_fact_table, build_dim_table, build_wide_table, build_rollup_table
 from tasks.quality import marker
-from tasks.metrics import notification
+from tasks.metrics import notification, perf_gate
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -21,50 +21,85 @@ def online_retail_elt_flow():
     url=os.getenv('ONLINE_RETAIL_DATA_URL', '') 
     
     # --- RAW Layer ---
-    raw_df_task = extract_online_retails.loading_online_retails(url=url)
-    psa_task = extract_online_retails.prepare_psa_online_retails(wait_for=[raw_df_task])
+    raw_df_task = extract_online_retails.loading_online_retails(
+        url=url,
+        streaming=os.getenv('EXTRACT_STREAMING', 'false').lower() == 'true',
+        chunk_size=int(os.getenv('EXTRACT_CHUNK_SIZE', 50000)),
+        parse_workers=int(os.getenv('EXTRACT_PARSE_WORKERS', 2)),
+        excel_reader=os.getenv('EXTRACT_EXCEL_READER', 'openpyxl'),
+        cache_dir=os.getenv('STAGING_CACHE_DIR') or None,
+        download_dir=os.getenv('DOWNLOAD_DIR') or None,
+        download_segments=int(os.getenv('DOWNLOAD_SEGMENTS', 1)),
+    )
+    psa_task = extract_online_retails.prepare_psa_online_retails(
+        hash_workers=int(os.getenv('HASH_KEY_WORKERS', 1)),
+        key_format=os.getenv('HASH_KEY_FORMAT', 'arrow'),
+        full_refresh=os.getenv('PSA_FULL_REFRESH', 'false').lower() == 'true',
+        lookback_days=int(os.getenv('PSA_LOOKBACK_DAYS', 7)),
+        engine=os.getenv('PSA_ENGINE', 'pandas'),
+        memory_budget_mb=int(os.getenv('PSA_MEMORY_BUDGET_MB') or 0) or None,
+        key_index_dir=os.getenv('VAULT_KEY_INDEX_DIR') or None,
+        key_index_fpr=float(os.getenv('VAULT_KEY_INDEX_FPR', 0.01)),
+        wait_for=[raw_df_task]
+    )
     
     # --- VAULT Layer ---
-    hub_invoice_task = load_hubs.hub_invoice(wait_for=[psa_task])
-    hub_product_task = load_hubs.hub_product(wait_for=[psa_task])
-    hub_customer_task = load_hubs.hub_customer(wait_for=[psa_task])
-    hub_time_task = load_hubs.hub_time(wait_for=[psa_task])
-    hub_country_task = load_hubs.hub_country(wait_for=[psa_task])
-    link_invoice_product_task = load_links.link_invoice_product(wait_for=[hub_invoice_task,hub_product_task])
-    link_invoice_customer_task = load_links.link_invoice_customer(wait_for=[hub_invoice_task,hub_customer_task])
-    link_invoice_time_task = load_links.link_invoice_time(wait_for=[hub_invoice_task,hub_time_task])
-    link_invoice_country_task = load_links.link_invoice_country(wait_for=[hub_invoice_task,hub_country_task])
-    link_customer_country_task = load_links.link_customer_country(wait_for=[hub_customer_task,hub_country_task])
-    sat_invoice_task = load_sats.sat_invoice(wait_for=[hub_invoice_task])
-    sat_product_task = load_sats.sat_product(wait_for=[hub_product_task])
-    sat_time_task = load_sats.sat_time(wait_for=[hub_time_task])
+    # 預設只載入最近一次 PSA batch；VAULT_FULL_SCAN=true 時重新比對整個 PSA (例如先前 vault 載入失敗)
+    vault_options = dict(
+        full_scan=os.getenv('VAULT_FULL_SCAN', 'false').lower() == 'true',
+        strategy=os.getenv('VAULT_LOAD_STRATEGY', 'anti_join'),
+        key_index_dir=os.getenv('VAULT_KEY_INDEX_DIR') or None,
+    )
+    hub_invoice_task = load_hubs.hub_invoice(**vault_options, wait_for=[psa_task])
+    hub_product_task = load_hubs.hub_product(**vault_options, wait_for=[psa_task])
+    hub_customer_task = load_hubs.hub_customer(**vault_options, wait_for=[psa_task])
+    hub_time_task = load_hubs.hub_time(**vault_options, wait_for=[psa_task])
+    hub_country_task = load_hubs.hub_country(**vault_options, wait_for=[psa_task])
+    link_invoice_product_task = load_links.link_invoice_product(**vault_options, wait_for=[hub_invoice_task,hub_product_task])
+    link_invoice_customer_task = load_links.link_invoice_customer(**vault_options, wait_for=[hub_invoice_task,hub_customer_task])
+    link_invoice_time_task = load_links.link_invoice_time(**vault_options, wait_for=[hub_invoice_task,hub_time_task])
+    link_invoice_country_task = load_links.link_invoice_country(**vault_options, wait_for=[hub_invoice_task,hub_country_task])
+    link_customer_country_task = load_links.link_customer_country(**vault_options, wait_for=[hub_customer_task,hub_country_task])
+    sat_invoice_task = load_sats.sat_invoice(**vault_options, wait_for=[hub_invoice_task])
+    sat_product_task = load_sats.sat_product(**vault_options, wait_for=[hub_product_task])
+    sat_time_task = load_sats.sat_time(**vault_options, wait_for=[hub_time_task])
+    # fact 以 dictGet 查詢的 dictionary，來源表載入後重新載入
+    dictionaries_task = dictionaries.refresh_dictionaries(wait_for=[hub_customer_task])
     
     # --- MARTS Layer ---
-    # Facts depend on Links and Sats
-    fact_sales_task = build_fact_table.fact_sales(wait_for=[hub_invoice_task, sat_invoice_task, link_invoice_product_task, link_invoice_customer_task, link_invoice_time_task, link_invoice_country_task])
-    fact_sale_returns_task = build_fact_table.fact_sale_returns(wait_for=[hub_invoice_task, sat_invoice_task, link_invoice_product_task, link_invoice_customer_task, link_invoice_time_task, link_invoice_country_task])
+    # 預設只重算本次 PSA batch 涉及的 fact 月份分區並 upsert 維度；MART_FULL_REFRESH=true 時全量重建
+    full_refresh = os.getenv('MART_FULL_REFRESH', 'false').lower() == 'true'
+    # Facts depend on Links and Sats; 同一次 join 同時產生 quality.anomaly_customer_invoioces
+    facts_task = build_fact_table.build_facts(full_refresh=full_refresh, wait_for=[dictionaries_task, hub_invoice_task, sat_invoice_task, link_invoice_product_task, link_invoice_customer_task, link_invoice_country_task])
 
     # Dimensions depend on Hubs and Sats
-    dim_product_task = build_dim_table.dim_product(wait_for=[sat_product_task, fact_sales_task])
-    dim_customer_task = build_dim_table.dim_customer(wait_for=[link_customer_country_task, fact_sales_task])
-    dim_time_task = build_dim_table.dim_time(wait_for=[sat_time_task, fact_sales_task])
-    dim_country_task = build_dim_table.dim_country(wait_for=[fact_sales_task])
+    dim_product_task = build_dim_table.dim_product(full_refresh=full_refresh, wait_for=[sat_product_task, facts_task])
+    dim_customer_task = build_dim_table.dim_customer(full_refresh=full_refresh, wait_for=[link_customer_country_task, facts_task])
+    dim_time_task = build_dim_table.dim_time(wait_for=[facts_task])
+    dim_country_task = build_dim_table.dim_country(full_refresh=full_refresh, wait_for=[facts_task])
+    # 選用的 dashboard 寬表：與 Fact_Sales 重算相同月份，攤平更新後的 country / product 維度
+    if os.getenv('MART_SALES_WIDE', 'false').lower() == 'true':
+        build_wide_table.sales_wide(full_refresh=full_refresh, wait_for=[facts_task, dim_product_task, dim_country_task])
 
     # Quality depend on Marts and Vault data
-    anomaly_customer_invoioces_task = marker.anomaly_customer_invoioces(wait_for=[hub_customer_task, hub_invoice_task, sat_invoice_task, link_invoice_customer_task, link_invoice_product_task, link_invoice_time_task, link_invoice_country_task])
-    anomaly_invoice_task = marker.anomaly_invoice(wait_for=[fact_sales_task])
-    data_quality_task = marker.data_quality(wait_for=[anomaly_customer_invoioces_task, anomaly_invoice_task, fact_sales_task, fact_sale_returns_task])
-    sales_summary_task = marker.sales_summary(wait_for=[fact_sales_task, link_invoice_time_task, sat_time_task])
+    anomaly_invoice_task = marker.anomaly_invoice(wait_for=[facts_task])
+    # 所有品質規則在一次 INSERT 中計算；QUALITY_PARTITIONED=true 時只檢查本次 PSA batch 涉及的月份，
+    # 結果在 quality.data_quality_batches，不更新 quality.data_quality 的每日指標 (只取全量檢查)
+    data_quality_task = marker.data_quality(partitioned=os.getenv('QUALITY_PARTITIONED', 'false').lower() == 'true', wait_for=[facts_task])
+    # quality.sales_summary 為 Sales_Daily_Rollup 的 view，rollup 與 Fact_Sales 同步重算受影響月份
+    sales_summary_task = build_rollup_table.sales_daily_rollup(full_refresh=full_refresh, wait_for=[facts_task])
 
-    # Notify quality to Prometheus
-    notification.anomaly_unit_price_count(wait_for=[data_quality_task])
-    notification.anomaly_quantity_count(wait_for=[data_quality_task])
-    notification.missing_customer_id_ratio(wait_for=[data_quality_task])
-    notification.latest_min_total_amount(wait_for=[sales_summary_task])
-    notification.latest_max_total_amount(wait_for=[sales_summary_task])
-    notification.latest_median_total_amount(wait_for=[sales_summary_task])
-    notification.latest_avg_total_amount(wait_for=[sales_summary_task])
-    notification.latest_sales_volume(wait_for=[sales_summary_task])
+    # Notify quality to Prometheus (一次查詢、一次推送)
+    metrics_task = notification.publish_metrics(wait_for=[data_quality_task, sales_summary_task])
+    # 各 task 的耗時、讀寫列數 / bytes 與記憶體 (labels: task, flow_run)
+    stats_task = notification.publish_pipeline_stats(wait_for=[metrics_task])
+    # 與先前執行的 query_log 統計比較；PERF_GATE_MODE=fail 時超過 PERF_GATE_THRESHOLD 的退化讓 flow 失敗
+    perf_gate.perf_gate(
+        mode=os.getenv('PERF_GATE_MODE', 'flag'),
+        threshold=float(os.getenv('PERF_GATE_THRESHOLD', 0.5)),
+        window=int(os.getenv('PERF_GATE_WINDOW', 7)),
+        wait_for=[stats_task],
+    )
 
 if __name__ == "__main__":
     online_retail_elt_flow()
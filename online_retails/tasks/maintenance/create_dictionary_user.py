@@ -0,0 +1,29 @@
+from prefect import flow, get_run_logger
+import os
+import utilx.clickhouse_client as ch
+from tasks.vault.dictionaries import DICTIONARY_ROLE, DICTIONARY_USER, sql_string
+
+@flow(name="Create Dictionary Reader")
+def create_dictionary_user_flow():
+    """
+    建立 (或更新密碼) vault dictionary 來源查詢使用的唯讀帳號，密碼為 .env 的 CLICKHOUSE_DICTIONARY_PASSWORD
+
+    帳號只允許本機連線，權限只有 ddl/init.sql 的 vault_reader role (SELECT ON vault.*)；
+    執行的帳號需要 ACCESS MANAGEMENT 權限，變更密碼後下一次 refresh_dictionaries 以新密碼重建 dictionary
+    """
+    logger = get_run_logger()
+    password = os.getenv('CLICKHOUSE_DICTIONARY_PASSWORD')
+    if not password:
+        raise ValueError("CLICKHOUSE_DICTIONARY_PASSWORD must be set")
+
+    client = ch.get_client('heavy')
+    identified = f"IDENTIFIED WITH sha256_password BY {sql_string(password)} HOST LOCAL"
+    client.command(f"CREATE USER IF NOT EXISTS {DICTIONARY_USER} {identified}")
+    client.command(f"ALTER USER {DICTIONARY_USER} {identified}")
+    client.command(f"GRANT {DICTIONARY_ROLE} TO {DICTIONARY_USER}")
+    client.command(f"ALTER USER {DICTIONARY_USER} DEFAULT ROLE {DICTIONARY_ROLE}")
+
+    logger.info(f"{DICTIONARY_USER} can read vault through the {DICTIONARY_ROLE} role.")
+
+if __name__ == "__main__":
+    create_dictionary_user_flow()
@@ -0,0 +1,73 @@
+from prefect import flow, task, get_run_logger
+import re
+from tasks.mart.incremental import forget_builds
+import utilx.clickhouse_client as ch
+from utilx.publish import PREVIOUS_SUFFIX
+
+# 仍以 time_key (hub_time hash key) 關聯 time 維度的表 (不含 __shadow / __previous 等衍生表)；Dim_Time 本身改為日曆結構，其餘表 time_key 改為 date_key (YYYYMMDD)
+LEGACY_TIME_KEY_SQL = """
+SELECT database, table FROM system.columns
+WHERE database IN ('marts', 'quality') AND name = 'time_key' AND position(table, '__') = 0
+ORDER BY database, table
+"""
+
+CALENDAR_DDL = """
+CREATE TABLE marts.Dim_Time__calendar (
+    date_key UInt32,
+    date Date,
+    year UInt16,
+    quarter UInt8,
+    month UInt8,
+    day_of_month UInt8,
+    week_of_year UInt8,
+    day_of_week UInt8,
+    is_weekend Bool
+) ENGINE = MergeTree()
+ORDER BY date_key
+"""
+
+def calendar_ddl(ddl: str, table: str) -> str:
+    """Dim_Time 改用日曆結構，其餘表改寫 SHOW CREATE TABLE 的 time_key 欄位"""
+    if table == 'marts.Dim_Time':
+        return CALENDAR_DDL
+    return re.sub(r"`time_key` UUID", "`date_key` UInt32", ddl, count=1)
+
+@task
+def migrate_time_key_table(database: str, table: str) -> None:
+    """以 date_key 結構建立空表，並以 EXCHANGE TABLES 原子替換；舊表保留為 <table>__time_key，下一次 flow 自動全量重建"""
+    logger = get_run_logger()
+    logger.info(f"Migrating {database}.{table} to the day-grain calendar...")
+
+    client = ch.get_client('heavy')
+    # command() 回傳 TSV 跳脫後的字串 (換行為 \n)，以 query 取得原始 DDL
+    ddl = client.query(f"SHOW CREATE TABLE {database}.{table}").result_rows[0][0]
+    ddl = ddl.replace(f"CREATE TABLE {database}.{table}", f"CREATE TABLE {database}.{table}__calendar", 1)
+
+    client.command(f"DROP TABLE IF EXISTS {database}.{table}__calendar")
+    client.command(calendar_ddl(ddl, f"{database}.{table}"))
+    client.command(f"EXCHANGE TABLES {database}.{table} AND {database}.{table}__calendar")
+    client.command(f"DROP TABLE IF EXISTS {database}.{table}__time_key")
+    client.command(f"RENAME TABLE {database}.{table}__calendar TO {database}.{table}__time_key")
+    # 上一個發佈版本仍是 time_key 結構，rollback 後會與建置的 SQL 不符
+    client.command(f"DROP TABLE IF EXISTS {database}.{table}{PREVIOUS_SUFFIX}")
+    forget_builds(client, [f"{database}.{table}"])
+
+    logger.info(f"{database}.{table} migrated, previous table kept as {database}.{table}__time_key.")
+
+@flow(name="Migrate Time Dimension to Calendar")
+def migrate_calendar_dimension_flow():
+    """一次性將 Dim_Time 改為日粒度日曆，fact / quality 表的 time_key 改為 date_key"""
+    logger = get_run_logger()
+    client = ch.get_client('heavy')
+    # fact 以 dictGet 查詢日期的 dictionary 已不再使用
+    client.command("DROP DICTIONARY IF EXISTS vault.dict_time")
+    tables = client.query(LEGACY_TIME_KEY_SQL).result_rows
+    if not tables:
+        logger.info("All marts and quality tables already use date_key.")
+        return
+
+    for database, table in tables:
+        migrate_time_key_table(database, table)
+
+if __name__ == "__main__":
+    migrate_calendar_dimension_flow()
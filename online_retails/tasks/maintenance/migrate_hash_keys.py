@@ -0,0 +1,62 @@
+from prefect import flow, task, get_run_logger
+import re
+import utilx.clickhouse_client as ch
+
+# 各層以字串存放的 hash key 欄位，一次性轉為 16 bytes 的 UUID
+KEY_COLUMNS_SQL = """
+SELECT database, table, groupArray(name) AS columns
+FROM system.columns
+WHERE database IN ('raw', 'vault', 'marts', 'quality')
+  AND (name LIKE '%hash_key' OR name IN ('sale_id', 'product_key', 'customer_key', 'time_key', 'country_key'))
+  AND type IN ('String', 'Nullable(String)', 'FixedString(36)')
+  AND NOT endsWith(table, '__string_keys')
+GROUP BY database, table
+ORDER BY database, table
+"""
+
+TABLE_BYTES_SQL = """
+SELECT sum(bytes_on_disk) FROM system.parts
+WHERE active AND database = {database:String} AND table = {table:String}
+"""
+
+@task
+def migrate_table_hash_keys(database: str, table: str, columns: list) -> None:
+    """以 UUID 欄位重建資料表，並以 EXCHANGE TABLES 原子替換；舊表保留為 <table>__string_keys"""
+    logger = get_run_logger()
+    logger.info(f"Migrating {database}.{table} ({', '.join(columns)}) to UUID keys...")
+
+    client = ch.get_client('heavy')
+    before = client.command(TABLE_BYTES_SQL, parameters={'database': database, 'table': table})
+
+    # command() 回傳 TSV 跳脫後的字串 (換行為 \n)，以 query 取得原始 DDL
+    ddl = client.query(f"SHOW CREATE TABLE {database}.{table}").result_rows[0][0]
+    ddl = ddl.replace(f"CREATE TABLE {database}.{table}", f"CREATE TABLE {database}.{table}__uuid", 1)
+    for column in columns:
+        # ORDER BY / PRIMARY KEY 欄位無法 ALTER MODIFY，因此改寫 DDL 後重建
+        ddl = re.sub(rf"(`{column}`\s+)(Nullable\(String\)|FixedString\(36\)|String)", r"\1UUID", ddl)
+
+    client.command(f"DROP TABLE IF EXISTS {database}.{table}__uuid")
+    client.command(ddl)
+    client.command(f"INSERT INTO {database}.{table}__uuid SELECT * FROM {database}.{table}")
+    client.command(f"EXCHANGE TABLES {database}.{table} AND {database}.{table}__uuid")
+    client.command(f"DROP TABLE IF EXISTS {database}.{table}__string_keys")
+    client.command(f"RENAME TABLE {database}.{table}__uuid TO {database}.{table}__string_keys")
+
+    after = client.command(TABLE_BYTES_SQL, parameters={'database': database, 'table': table})
+    logger.info(f"{database}.{table} migrated: {int(before or 0):,} -> {int(after or 0):,} bytes on disk.")
+
+@flow(name="Migrate Hash Keys to UUID")
+def migrate_hash_keys_flow():
+    """一次性將既有資料表中以字串存放的 hash key 轉為 UUID (16 bytes)"""
+    logger = get_run_logger()
+    client = ch.get_client('heavy')
+    tables = client.query(KEY_COLUMNS_SQL).result_rows
+    if not tables:
+        logger.info("All hash key columns are already UUID.")
+        return
+
+    for database, table, columns in tables:
+        migrate_table_hash_keys(database, table, columns)
+
+if __name__ == "__main__":
+    migrate_hash_keys_flow()
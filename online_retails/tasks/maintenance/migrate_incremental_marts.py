@@ -0,0 +1,58 @@
+from prefect import flow, task, get_run_logger
+import re
+from tasks.mart.incremental import forget_builds
+import utilx.clickhouse_client as ch
+
+# 尚未改為增量結構的表：fact (含同一次 fact 建置產生的 quality.anomaly_customer_invoioces) 未分區、dimension 不是 ReplacingMergeTree
+# (Dim_Time 為每次整批發佈的 MergeTree 日曆表，由 migrate_calendar_dimension 處理，不在此列)
+FACT_TABLES = ['marts.Fact_Sales', 'marts.Fact_Sale_Returns', 'quality.anomaly_customer_invoioces']
+LEGACY_MARTS_SQL = """
+SELECT database, name, database || '.' || name IN {fact_tables:Array(String)} AS is_fact
+FROM system.tables
+WHERE (database || '.' || name IN {fact_tables:Array(String)} AND partition_key = '')
+   OR (database = 'marts' AND name IN ('Dim_Product', 'Dim_Customer', 'Dim_Country') AND engine != 'ReplacingMergeTree')
+ORDER BY database, name
+"""
+
+def incremental_ddl(ddl: str, is_fact: bool) -> str:
+    """改寫 SHOW CREATE TABLE：fact 加上 invoice_date 與月份分區，dimension 加上 updated_at 並改為 ReplacingMergeTree"""
+    if is_fact:
+        ddl = re.sub(r"(`invoice_no` String,)", r"\1\n    `invoice_date` Date,", ddl, count=1)
+        return re.sub(r"(ENGINE = MergeTree\S*)", r"\1\nPARTITION BY toYYYYMM(invoice_date)", ddl, count=1)
+    return re.sub(r"\n\)\s*ENGINE = MergeTree(\(\))?", ",\n    `updated_at` DateTime64(0, 'UTC')\n)\nENGINE = ReplacingMergeTree(updated_at)", ddl, count=1)
+
+@task
+def migrate_mart_table(database: str, table: str, is_fact: bool) -> None:
+    """以增量結構建立空表，並以 EXCHANGE TABLES 原子替換；舊表保留為 <table>__full_rebuild，下一次 marts 建置時自動全量重建"""
+    logger = get_run_logger()
+    logger.info(f"Migrating {database}.{table} to incremental layout...")
+
+    client = ch.get_client('heavy')
+    # command() 回傳 TSV 跳脫後的字串 (換行為 \n)，以 query 取得原始 DDL
+    ddl = client.query(f"SHOW CREATE TABLE {database}.{table}").result_rows[0][0]
+    ddl = ddl.replace(f"CREATE TABLE {database}.{table}", f"CREATE TABLE {database}.{table}__incremental", 1)
+
+    client.command(f"DROP TABLE IF EXISTS {database}.{table}__incremental")
+    client.command(incremental_ddl(ddl, is_fact))
+    client.command(f"EXCHANGE TABLES {database}.{table} AND {database}.{table}__incremental")
+    client.command(f"DROP TABLE IF EXISTS {database}.{table}__full_rebuild")
+    client.command(f"RENAME TABLE {database}.{table}__incremental TO {database}.{table}__full_rebuild")
+    forget_builds(client, [f"{database}.{table}"])
+
+    logger.info(f"{database}.{table} migrated, previous table kept as {database}.{table}__full_rebuild.")
+
+@flow(name="Migrate Marts to Incremental Builds")
+def migrate_incremental_marts_flow():
+    """一次性將既有 marts 表改為增量結構 (fact 依月份分區、dimension 以 key upsert)"""
+    logger = get_run_logger()
+    client = ch.get_client('heavy')
+    tables = client.query(LEGACY_MARTS_SQL, parameters={'fact_tables': FACT_TABLES}).result_rows
+    if not tables:
+        logger.info("All marts tables already use the incremental layout.")
+        return
+
+    for database, table, is_fact in tables:
+        migrate_mart_table(database, table, bool(is_fact))
+
+if __name__ == "__main__":
+    migrate_incremental_marts_flow()
@@ -0,0 +1,75 @@
+from prefect import flow, get_run_logger
+import utilx.clickhouse_client as ch
+
+DATA_QUALITY_ENGINE_SQL = "SELECT engine FROM system.tables WHERE database = 'quality' AND name = 'data_quality'"
+
+# 原本 data_quality 表的每日指標轉為 rule_results 的規則結果 (checked_at 取當天 00:00)
+BACKFILL_SQL = """
+INSERT INTO quality.rule_results (check_date, checked_at, rule, kind, source, value, failed, total, partitions)
+SELECT check_date, toDateTime64(check_date, 0, 'UTC'), metric.1, metric.2, 'fact_lines', metric.3, toUInt64(metric.4), 0, []
+FROM quality.data_quality__table FINAL
+ARRAY JOIN [
+    ('missing_customer_id_ratio', 'null_ratio', missing_customer_id_ratio, 0),
+    ('anomaly_unit_price_count', 'threshold_count', toFloat64(anomaly_unit_price_count), anomaly_unit_price_count),
+    ('anomaly_quantity_count', 'threshold_count', toFloat64(anomaly_quantity_count), anomaly_quantity_count)
+] AS metric
+"""
+
+# 與 ddl/init.sql 相同；data_quality 只取全量檢查 (partitions 為空)，部分月份的檢查在 data_quality_batches
+DATA_QUALITY_VIEW_SQL = """
+CREATE OR REPLACE VIEW quality.data_quality AS
+SELECT
+    check_date,
+    argMaxIf(value, checked_at, rule = 'missing_customer_id_ratio') AS missing_customer_id_ratio,
+    toUInt64(argMaxIf(failed, checked_at, rule = 'anomaly_unit_price_count')) AS anomaly_unit_price_count,
+    toUInt64(argMaxIf(failed, checked_at, rule = 'anomaly_quantity_count')) AS anomaly_quantity_count
+FROM quality.rule_results
+WHERE empty(partitions)
+GROUP BY check_date
+"""
+
+DATA_QUALITY_BATCHES_VIEW_SQL = """
+CREATE OR REPLACE VIEW quality.data_quality_batches AS
+SELECT
+    checked_at,
+    partitions,
+    anyIf(value, rule = 'missing_customer_id_ratio') AS missing_customer_id_ratio,
+    toUInt64(anyIf(failed, rule = 'anomaly_unit_price_count')) AS anomaly_unit_price_count,
+    toUInt64(anyIf(failed, rule = 'anomaly_quantity_count')) AS anomaly_quantity_count
+FROM quality.rule_results
+WHERE notEmpty(partitions)
+GROUP BY checked_at, partitions
+"""
+
+@flow(name="Migrate Data Quality to Rule Results")
+def migrate_quality_rules_flow():
+    """
+    一次性將 quality.data_quality 表的歷史指標寫入 quality.rule_results，並以同名 view 取代；舊表保留為 data_quality__table
+
+    已是 view 時更新其定義；並建立 (或更新) 部分月份檢查結果的 data_quality_batches view
+    """
+    logger = get_run_logger()
+    client = ch.get_client('heavy')
+    engine = client.command(DATA_QUALITY_ENGINE_SQL)
+    client.command(DATA_QUALITY_BATCHES_VIEW_SQL)
+    if engine == 'View':
+        # 更新既有 view 的定義 (排除只檢查部分月份的結果)
+        client.command(DATA_QUALITY_VIEW_SQL)
+        logger.info("quality.data_quality view over quality.rule_results updated.")
+        return
+
+    if not engine:
+        client.command(DATA_QUALITY_VIEW_SQL)
+        logger.info("quality.data_quality created as a view over quality.rule_results.")
+        return
+
+    client.command("DROP TABLE IF EXISTS quality.data_quality__table")
+    client.command("RENAME TABLE quality.data_quality TO quality.data_quality__table")
+    client.command(BACKFILL_SQL)
+    client.command(DATA_QUALITY_VIEW_SQL)
+
+    days = client.command("SELECT count() FROM quality.data_quality")
+    logger.info(f"quality.data_quality migrated: {days} days backfilled, previous table kept as quality.data_quality__table.")
+
+if __name__ == "__main__":
+    migrate_quality_rules_flow()
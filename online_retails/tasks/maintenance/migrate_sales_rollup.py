@@ -0,0 +1,41 @@
+from prefect import flow, get_run_logger
+import utilx.clickhouse_client as ch
+
+SALES_SUMMARY_ENGINE_SQL = "SELECT engine FROM system.tables WHERE database = 'quality' AND name = 'sales_summary'"
+
+SALES_SUMMARY_VIEW_SQL = """
+CREATE VIEW quality.sales_summary AS
+SELECT
+    r.date AS sales_date,
+    toFloat64(min(r.min_total_amount)) AS min_total_amount,
+    toFloat64(max(r.max_total_amount)) AS max_total_amount,
+    toFloat64(quantileTDigestMerge(0.5)(r.total_amount_quantiles)) AS median_total_amount,
+    toFloat64(sum(r.volume)) / sum(r.lines) AS avg_total_amount,
+    toFloat64(sum(r.volume)) AS volume
+FROM marts.Sales_Daily_Rollup AS r
+GROUP BY r.date
+"""
+
+@flow(name="Migrate Sales Summary to Daily Rollup")
+def migrate_sales_rollup_flow():
+    """
+    一次性將 quality.sales_summary 表以 marts.Sales_Daily_Rollup 的同名 view 取代；舊表保留為 sales_summary__table
+
+    rollup 沒有建置紀錄 (marts.build_log) 時下一次 flow 自動由 Fact_Sales 全量重建，歷史日期不需另外回填
+    """
+    logger = get_run_logger()
+    client = ch.get_client('heavy')
+    engine = client.command(SALES_SUMMARY_ENGINE_SQL)
+    if engine == 'View':
+        logger.info("quality.sales_summary is already a view over marts.Sales_Daily_Rollup.")
+        return
+
+    if engine:
+        client.command("DROP TABLE IF EXISTS quality.sales_summary__table")
+        client.command("RENAME TABLE quality.sales_summary TO quality.sales_summary__table")
+    client.command(SALES_SUMMARY_VIEW_SQL)
+
+    logger.info("quality.sales_summary replaced by a view over marts.Sales_Daily_Rollup.")
+
+if __name__ == "__main__":
+    migrate_sales_rollup_flow()
@@ -0,0 +1,39 @@
+from typing import List, Optional
+from prefect import flow, task, get_run_logger
+import utilx.clickhouse_client as ch
+from utilx.publish import rollback
+
+# 以 utilx.publish 發佈、保留上一個版本的資料表
+PUBLISHED_TABLES = [
+    'marts.Fact_Sales',
+    'marts.Fact_Sale_Returns',
+    'marts.Dim_Product',
+    'marts.Dim_Customer',
+    'marts.Dim_Time',
+    'marts.Dim_Country',
+    'marts.Sales_Wide',
+    'marts.Sales_Daily_Rollup',
+    'quality.anomaly_customer_invoioces',
+    'quality.anomaly_invoice',
+]
+
+@task
+def rollback_table(table: str) -> None:
+    """將線上表換回 <table>__previous"""
+    logger = get_run_logger()
+    rollback(ch.get_client('heavy'), table)
+    logger.info(f"{table} rolled back to its previous published version.")
+
+@flow(name="Rollback Published Tables")
+def rollback_published_tables_flow(tables: Optional[List[str]] = None):
+    """將 marts / quality 表換回上一次發佈的版本 (預設為全部)；再執行一次即恢復"""
+    tables = tables or PUBLISHED_TABLES
+    unknown = [table for table in tables if table not in PUBLISHED_TABLES]
+    if unknown:
+        raise ValueError(f"{unknown} are not published tables, expected any of {PUBLISHED_TABLES}")
+
+    for table in tables:
+        rollback_table(table)
+
+if __name__ == "__main__":
+    rollback_published_tables_flow()
@@ -1,93 +1,110 @@
 from prefect import task, get_run_logger
+from tasks.mart.incremental import upsert_dimension
+from utilx.publish import publishing
 import utilx.clickhouse_client as ch
+from utilx.instrumentation import instrumented
+
+# 只重寫本次 PSA batch 出現的 key ({full:Bool} 為 true 時寫入全部)
+BATCH_KEYS_SQL = "select {column} from raw.psa_online_retails where LOAD_DATETIME = {{load_datetime:DateTime64(0, 'UTC')}}"
 
 @task
-def dim_product():
-    """從 Data Vault 載入所有 product 維度"""
+@instrumented
+def dim_product(full_refresh: bool = False):
+    """從 Data Vault 更新 product 維度"""
     logger = get_run_logger()
     logger.info(f"Building dim_product...")
 
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE marts.Dim_Product")
-    client.command("""
-    INSERT INTO marts.Dim_Product
+    client = ch.get_client('heavy')
+    batch = upsert_dimension(client, 'marts.Dim_Product', f"""
     with
-        hub_product as (select hub_product_hash_key, StockCode from vault.hub_product),
-        sat_product as (select hub_product_hash_key, Description from vault.sat_product)
+        batch_keys as ({BATCH_KEYS_SQL.format(column='hub_product_hash_key')}),
+        hub_product as (select hub_product_hash_key, StockCode from vault.hub_product where {{full:Bool}} or hub_product_hash_key in (select * from batch_keys)),
+        sat_product as (select hub_product_hash_key, Description from vault.sat_product_current where {{full:Bool}} or hub_product_hash_key in (select * from batch_keys))
     SELECT
        p.hub_product_hash_key as product_key,
        p.StockCode as stock_code,
-       s.Description as description
+       s.Description as description,
+       {{updated_at:DateTime64(0, 'UTC')}} as updated_at
     FROM hub_product p
     JOIN sat_product s ON p.hub_product_hash_key = s.hub_product_hash_key
-    """)
+    """, full_refresh)
 
-    logger.info(f"dim_product builded.")
+    logger.info(f"dim_product builded ({'batch ' + str(batch) if batch else 'full'}).")
 
 @task
-def dim_customer():
-    """從 Data Vault 載入所有 customer 維度"""
+@instrumented
+def dim_customer(full_refresh: bool = False):
+    """從 Data Vault 更新 customer 維度"""
     logger = get_run_logger()
     logger.info(f"Building dim_customer...")
 
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE marts.Dim_Customer")
-    client.command("""
-    INSERT INTO marts.Dim_Customer
+    client = ch.get_client('heavy')
+    batch = upsert_dimension(client, 'marts.Dim_Customer', f"""
     with
-        hub_customer as (select hub_customer_hash_key, CustomerID from vault.hub_customer where CustomerID <> 0),
-        link_customer_country as (select hub_customer_hash_key, hub_country_hash_key from vault.link_customer_country)
+        batch_keys as ({BATCH_KEYS_SQL.format(column='hub_customer_hash_key')}),
+        hub_customer as (select hub_customer_hash_key, CustomerID from vault.hub_customer where CustomerID <> 0 and ({{full:Bool}} or hub_customer_hash_key in (select * from batch_keys))),
+        link_customer_country as (select hub_customer_hash_key, hub_country_hash_key from vault.link_customer_country where {{full:Bool}} or hub_customer_hash_key in (select * from batch_keys))
     SELECT
          c.hub_customer_hash_key as customer_key,
          c.CustomerID as customer_id,
-         lcc.hub_country_hash_key as country_key
+         lcc.hub_country_hash_key as country_key,
+         {{updated_at:DateTime64(0, 'UTC')}} as updated_at
     FROM hub_customer c
     JOIN link_customer_country lcc ON c.hub_customer_hash_key = lcc.hub_customer_hash_key
-    """)
+    """, full_refresh)
+
+    logger.info(f"dim_customer builded ({'batch ' + str(batch) if batch else 'full'}).")
 
-    logger.info(f"dim_customer builded.")
+# vault.hub_invoice 的日期範圍內每天一列 (沒有發票時不產生任何列)
+CALENDAR_SQL = """
+    with
+        bounds as (select toDate(min(InvoiceDate)) as first_date, toDate(max(InvoiceDate)) as last_date, count() as invoices from vault.hub_invoice having invoices > 0),
+        calendar as (select arrayJoin(arrayMap(offset -> first_date + offset, range(toUInt32(last_date - first_date) + 1))) as date from bounds)
+    SELECT
+        toYYYYMMDD(date) as date_key,
+        date,
+        toYear(date) as year,
+        toQuarter(date) as quarter,
+        toMonth(date) as month,
+        toDayOfMonth(date) as day_of_month,
+        toISOWeek(date) as week_of_year,
+        toDayOfWeek(date) as day_of_week,
+        toDayOfWeek(date) >= 6 as is_weekend
+    FROM calendar
+"""
 
 @task
+@instrumented
 def dim_time():
-    """從 Data Vault 載入所有 time 維度"""
+    """依發票日期範圍重新產生日粒度的 time 維度 (日曆)"""
     logger = get_run_logger()
     logger.info(f"Building dim_time...")
 
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE marts.Dim_Time")
-    client.command("""
-    INSERT INTO marts.Dim_Time
-    with
-        hub_time as (select hub_time_hash_key from vault.hub_time),
-        sat_time as (select hub_time_hash_key, date, year, month, day_of_week from vault.sat_time)
-    SELECT
-        t.hub_time_hash_key as time_key,
-        s.date as date,
-        s.year as year,
-        s.month as month,
-        s.day_of_week as day_of_week
-    FROM hub_time t
-    JOIN sat_time s ON t.hub_time_hash_key = s.hub_time_hash_key
-    """)
+    client = ch.get_client('heavy')
+    # 日曆只有數百列，每次在空的影子表整表產生，不需增量
+    with publishing(client, 'marts.Dim_Time') as shadow:
+        client.command(f"INSERT INTO {shadow} {CALENDAR_SQL}")
+    days = client.command("SELECT count() FROM marts.Dim_Time")
 
-    logger.info(f"dim_time builded.")
+    logger.info(f"dim_time builded: {days} days.")
 
 @task
-def dim_country():
-    """從 Data Vault 載入所有 country 維度"""
+@instrumented
+def dim_country(full_refresh: bool = False):
+    """從 Data Vault 更新 country 維度"""
     logger = get_run_logger()
     logger.info(f"Building dim_country...")
 
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE marts.Dim_Country")
-    client.command("""
-    INSERT INTO marts.Dim_Country
+    client = ch.get_client('heavy')
+    batch = upsert_dimension(client, 'marts.Dim_Country', f"""
     with
-        hub_country as (select hub_country_hash_key, Country from vault.hub_country)
+        batch_keys as ({BATCH_KEYS_SQL.format(column='hub_country_hash_key')}),
+        hub_country as (select hub_country_hash_key, Country from vault.hub_country where {{full:Bool}} or hub_country_hash_key in (select * from batch_keys))
     SELECT
         c.hub_country_hash_key as country_key,
-        c.Country as country_name
+        c.Country as country_name,
+        {{updated_at:DateTime64(0, 'UTC')}} as updated_at
     FROM hub_country c
-    """)
+    """, full_refresh)
 
-    logger.info(f"dim_country builded.")
+    logger.info(f"dim_country builded ({'batch ' + str(batch) if batch else 'full'}).")
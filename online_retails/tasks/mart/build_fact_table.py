@@ -1,76 +1,53 @@
 from prefect import task, get_run_logger
+from tasks.mart.incremental import build_fact_partitions
 import utilx.clickhouse_client as ch
+from utilx.instrumentation import instrumented
 
-@task
-def fact_sales():
-    """從 Data Vault 載入所有 Sales Fact"""
-    logger = get_run_logger()
-    logger.info(f"Building fact_sales...")
-
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE marts.Fact_Sales")
-    client.command("""
-    INSERT INTO marts.Fact_Sales
+# 受影響發票月份 ({months:Array(UInt32)}) 的發票明細，只 join 一次；return_status / missing_customer 供分流使用，
+# missing_customer 以 vault.dict_customer 查詢 (tasks.vault.dictionaries)；date_key 直接由 InvoiceDate 計算，對應日曆維度 Dim_Time
+FACT_LINES_SQL = """
     with
-        hub_invoice as (select hub_invoice_hash_key, InvoiceNo from vault.hub_invoice),
-        sat_invoice as (select hub_invoice_hash_key, Quantity, UnitPrice, TotalAmount from vault.sat_invoice where ReturnStatus='Normal'),
-        link_invoice_product as (select hub_invoice_hash_key, hub_product_hash_key from vault.link_invoice_product),
-        link_invoice_customer as (select hub_invoice_hash_key, hub_customer_hash_key from vault.link_invoice_customer where hub_customer_hash_key not in (select hub_customer_hash_key from vault.hub_customer where CustomerID=0) ),
-        link_invoice_time as (select hub_invoice_hash_key, hub_time_hash_key from vault.link_invoice_time),
-        link_invoice_country as (select hub_invoice_hash_key, hub_country_hash_key from vault.link_invoice_country)
+        hub_invoice as (select hub_invoice_hash_key, InvoiceNo, InvoiceDate from vault.hub_invoice where toYYYYMM(InvoiceDate) in {months:Array(UInt32)}),
+        sat_invoice as (select hub_invoice_hash_key, Quantity, UnitPrice, TotalAmount, ReturnStatus from vault.sat_invoice_current where hub_invoice_hash_key in (select hub_invoice_hash_key from hub_invoice)),
+        link_invoice_product as (select hub_invoice_hash_key, hub_product_hash_key from vault.link_invoice_product where hub_invoice_hash_key in (select hub_invoice_hash_key from hub_invoice)),
+        link_invoice_customer as (select hub_invoice_hash_key, hub_customer_hash_key from vault.link_invoice_customer where hub_invoice_hash_key in (select hub_invoice_hash_key from hub_invoice)),
+        link_invoice_country as (select hub_invoice_hash_key, hub_country_hash_key from vault.link_invoice_country where hub_invoice_hash_key in (select hub_invoice_hash_key from hub_invoice))
     SELECT
         i.hub_invoice_hash_key AS sale_id,
         i.InvoiceNo as invoice_no,
+        toDate(i.InvoiceDate) as invoice_date,
         p.hub_product_hash_key as product_key,
         c.hub_customer_hash_key as customer_key,
-        t.hub_time_hash_key as time_key,
-        co.hub_country_hash_key as country_key,       
+        toYYYYMMDD(i.InvoiceDate) as date_key,
+        co.hub_country_hash_key as country_key,
         s.Quantity as quantity,
         s.UnitPrice as unit_price,
-        s.TotalAmount as total_amount
+        s.TotalAmount as total_amount,
+        s.ReturnStatus as return_status,
+        -- 不在 dictionary 中的 key 視為有客戶 ID (預設 1)，與原本 IN (CustomerID=0 的 key) 的判斷相同
+        dictGetOrDefault('vault.dict_customer', 'CustomerID', tuple(c.hub_customer_hash_key), toUInt64(1)) = 0 as missing_customer
     FROM hub_invoice i
     JOIN sat_invoice s ON i.hub_invoice_hash_key = s.hub_invoice_hash_key
     JOIN link_invoice_product p ON i.hub_invoice_hash_key = p.hub_invoice_hash_key
     JOIN link_invoice_customer c ON i.hub_invoice_hash_key = c.hub_invoice_hash_key
-    JOIN link_invoice_time t ON i.hub_invoice_hash_key = t.hub_invoice_hash_key
     JOIN link_invoice_country co ON i.hub_invoice_hash_key = co.hub_invoice_hash_key
-    """)
+"""
 
-    logger.info(f"fact_sales builded.")
+# 目標表與分流條件：沒有客戶 ID 的明細不進 fact，改記錄為品質異常
+FACT_ROUTES = {
+    'marts.Fact_Sales': "return_status = 'Normal' and not missing_customer",
+    'marts.Fact_Sale_Returns': "return_status = 'Return' and not missing_customer",
+    'quality.anomaly_customer_invoioces': "missing_customer",
+}
 
 @task
-def fact_sale_returns():
-    """從 Data Vault 載入所有 Sale Returns Fact"""
+@instrumented
+def build_facts(full_refresh: bool = False):
+    """從 Data Vault 重算本次載入涉及月份的 Sales / Sale Returns Fact 與缺少客戶 ID 的異常明細"""
     logger = get_run_logger()
-    logger.info(f"Building fact_sale_returns...")
+    logger.info(f"Building {', '.join(FACT_ROUTES)}...")
 
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE marts.Fact_Sale_Returns")
-    client.command("""
-    INSERT INTO marts.Fact_Sale_Returns
-    with
-        hub_invoice as (select hub_invoice_hash_key, InvoiceNo from vault.hub_invoice),
-        sat_invoice as (select hub_invoice_hash_key, Quantity, UnitPrice, TotalAmount from vault.sat_invoice where ReturnStatus='Return'),
-        link_invoice_product as (select hub_invoice_hash_key, hub_product_hash_key from vault.link_invoice_product),
-        link_invoice_customer as (select hub_invoice_hash_key, hub_customer_hash_key from vault.link_invoice_customer where hub_customer_hash_key not in (select hub_customer_hash_key from vault.hub_customer where CustomerID=0)),
-        link_invoice_time as (select hub_invoice_hash_key, hub_time_hash_key from vault.link_invoice_time),
-        link_invoice_country as (select hub_invoice_hash_key, hub_country_hash_key from vault.link_invoice_country)
-    SELECT
-        i.hub_invoice_hash_key AS sale_id,
-        i.InvoiceNo as invoice_no,
-        p.hub_product_hash_key as product_key,
-        c.hub_customer_hash_key as customer_key,
-        t.hub_time_hash_key as time_key,
-        co.hub_country_hash_key as country_key,       
-        s.Quantity as quantity,
-        s.UnitPrice as unit_price,
-        s.TotalAmount as total_amount
-    FROM hub_invoice i
-    JOIN sat_invoice s ON i.hub_invoice_hash_key = s.hub_invoice_hash_key
-    JOIN link_invoice_product p ON i.hub_invoice_hash_key = p.hub_invoice_hash_key
-    JOIN link_invoice_customer c ON i.hub_invoice_hash_key = c.hub_invoice_hash_key
-    JOIN link_invoice_time t ON i.hub_invoice_hash_key = t.hub_invoice_hash_key
-    JOIN link_invoice_country co ON i.hub_invoice_hash_key = co.hub_invoice_hash_key
-    """)
+    client = ch.get_client('heavy')
+    months = build_fact_partitions(client, FACT_LINES_SQL, FACT_ROUTES, full_refresh)
 
-    logger.info(f"fact_sale_returns builded.")
\ No newline at end of file
+    logger.info(f"facts builded: {len(months)} monthly partitions recomputed {months}.")
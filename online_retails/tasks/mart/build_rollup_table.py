@@ -0,0 +1,37 @@
+from prefect import task, get_run_logger
+from tasks.mart.incremental import build_fact_partitions
+import utilx.clickhouse_client as ch
+from utilx.instrumentation import instrumented
+
+# 受影響發票月份的 Fact_Sales 依 (日期, 國家, 商品) 預先聚合；中位數以可合併的 t-digest 狀態保存，
+# 查詢時以 quantileTDigestMerge 合併任意天數 / 國家 / 商品的狀態，不需回到明細
+SALES_DAILY_ROLLUP_SQL = """
+    SELECT
+        invoice_date as date,
+        country_key,
+        product_key,
+        count() as lines,
+        sum(quantity) as quantity,
+        sum(total_amount) as volume,
+        min(total_amount) as min_total_amount,
+        max(total_amount) as max_total_amount,
+        quantileTDigestState(toFloat64(total_amount)) as total_amount_quantiles
+    FROM marts.Fact_Sales
+    WHERE toYYYYMM(invoice_date) in {months:Array(UInt32)}
+    GROUP BY date, country_key, product_key
+"""
+
+@task
+@instrumented
+def sales_daily_rollup(full_refresh: bool = False):
+    """以 Fact_Sales 重算本次載入涉及月份的 marts.Sales_Daily_Rollup (quality.sales_summary 為其每日彙總的 view)"""
+    logger = get_run_logger()
+    logger.info(f"Building marts.Sales_Daily_Rollup...")
+
+    client = ch.get_client('heavy')
+    # Fact_Sales 以月份分區整批替換，rollup 同樣替換受影響月份的分區，而非把新狀態合併進舊狀態 (否則重算的明細會重複計入)
+    months = build_fact_partitions(
+        client, SALES_DAILY_ROLLUP_SQL, {'marts.Sales_Daily_Rollup': '1'}, full_refresh,
+        route_columns=(), build_table='marts.sales_daily_rollup__build')
+
+    logger.info(f"Sales_Daily_Rollup builded: {len(months)} monthly partitions recomputed {months}.")
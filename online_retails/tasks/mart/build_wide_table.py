@@ -0,0 +1,40 @@
+from prefect import task, get_run_logger
+from tasks.mart.incremental import build_fact_partitions
+import utilx.clickhouse_client as ch
+from utilx.instrumentation import instrumented
+
+# 受影響發票月份的 Fact_Sales 攤平 country / product 維度屬性；日期欄位直接由 invoice_date 計算 (即 Dim_Time 的 date / year / month)
+SALES_WIDE_SQL = """
+    with
+        fact_sales as (select sale_id, invoice_no, invoice_date, product_key, country_key, quantity, unit_price, total_amount from marts.Fact_Sales where toYYYYMM(invoice_date) in {months:Array(UInt32)}),
+        dim_country as (select country_key, country_name from marts.Dim_Country FINAL),
+        dim_product as (select product_key, stock_code, description from marts.Dim_Product FINAL)
+    SELECT
+        f.invoice_date as date,
+        toUInt16(toYear(f.invoice_date)) as year,
+        toUInt8(toMonth(f.invoice_date)) as month,
+        co.country_name as country_name,
+        p.stock_code as stock_code,
+        p.description as description,
+        f.sale_id as sale_id,
+        f.invoice_no as invoice_no,
+        f.quantity as quantity,
+        f.unit_price as unit_price,
+        f.total_amount as total_amount
+    FROM fact_sales f
+    ANY LEFT JOIN dim_country co ON f.country_key = co.country_key
+    ANY LEFT JOIN dim_product p ON f.product_key = p.product_key
+"""
+
+@task
+@instrumented
+def sales_wide(full_refresh: bool = False):
+    """以 Fact_Sales 與 country / product 維度重算本次載入涉及月份的 marts.Sales_Wide，供 dashboard 單表查詢"""
+    logger = get_run_logger()
+    logger.info(f"Building marts.Sales_Wide...")
+
+    client = ch.get_client('heavy')
+    months = build_fact_partitions(
+        client, SALES_WIDE_SQL, {'marts.Sales_Wide': '1'}, full_refresh, route_columns=(), build_table='marts.sales_wide__build')
+
+    logger.info(f"Sales_Wide builded: {len(months)} monthly partitions recomputed {months}.")
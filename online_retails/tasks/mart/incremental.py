@@ -0,0 +1,103 @@
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Set
+from utilx.publish import partition_ids, publishing
+from tasks.vault.loader import latest_psa_batch
+
+# 本次 PSA batch 涉及的發票月份；marts 的 fact 以 toYYYYMM(invoice_date) 分區
+BATCH_MONTHS_SQL = """
+SELECT DISTINCT toYYYYMM(InvoiceDate) FROM raw.psa_online_retails
+WHERE LOAD_DATETIME = {load_datetime:DateTime64(0, 'UTC')}
+"""
+ALL_MONTHS_SQL = "SELECT DISTINCT toYYYYMM(InvoiceDate) FROM vault.hub_invoice"
+
+# fact 建置的中間表：受影響月份的發票明細只 join 一次，再分流到各目標表
+FACT_LINES_TABLE = 'marts.fact_lines__build'
+# 中間表中只用來分流、不寫入目標表的欄位
+ROUTE_COLUMNS = ('return_status', 'missing_customer')
+
+# build_fact_partitions 發佈過的表；沒有紀錄的表須全量重算
+BUILD_LOG_TABLE = 'marts.build_log'
+BUILT_TABLES_SQL = f"SELECT DISTINCT table_name FROM {BUILD_LOG_TABLE} WHERE table_name IN {{tables:Array(String)}}"
+
+def is_empty(client, table: str) -> bool:
+    return int(client.command(f"SELECT count() FROM {table}")) == 0
+
+def built_tables(client, tables: Sequence[str]) -> Set[str]:
+    """tables 中曾由 build_fact_partitions 發佈過的表"""
+    return {table for table, in client.query(BUILT_TABLES_SQL, parameters={'tables': list(tables)}).result_rows}
+
+def log_builds(client, tables: Sequence[str], full_refresh: bool, months: List[int]) -> None:
+    built_at = datetime.utcnow().replace(microsecond=0)
+    client.insert(BUILD_LOG_TABLE, [[table, built_at, full_refresh, months] for table in tables],
+                  column_names=['table_name', 'built_at', 'full_refresh', 'months'])
+
+def forget_builds(client, tables: Sequence[str]) -> None:
+    """移除 tables 的建置紀錄 (結構遷移換成空表後)，下一次建置時全量重算"""
+    client.command(f"ALTER TABLE {BUILD_LOG_TABLE} DELETE WHERE table_name IN {{tables:Array(String)}} SETTINGS mutations_sync = 2",
+                   parameters={'tables': list(tables)})
+
+def touched_months(client, full_refresh: bool = False) -> List[int]:
+    """
+    需要重算的發票月份 (YYYYMM)
+
+    預設為最近一次 PSA batch 中出現的月份；full_refresh 或沒有 PSA 載入紀錄時為 vault 中的所有月份
+    """
+    load_datetime = None if full_refresh else latest_psa_batch(client)
+    if load_datetime is None:
+        rows = client.query(ALL_MONTHS_SQL).result_rows
+    else:
+        rows = client.query(BATCH_MONTHS_SQL, parameters={'load_datetime': load_datetime}).result_rows
+    return sorted(int(month) for month, in rows)
+
+def build_fact_partitions(client, select_sql: str, routes: Dict[str, str], full_refresh: bool = False,
+                          route_columns: Sequence[str] = ROUTE_COLUMNS, build_table: str = FACT_LINES_TABLE) -> List[int]:
+    """
+    以 select_sql 重算受影響的發票月份，並依 routes ({table: where}) 分流寫入各表，回傳重算的月份
+
+    select_sql 以 {months:Array(UInt32)} 篩選發票月份，只執行一次並寫入中間表 build_table (可能同時執行的建置須各自指定)；
+    各表以 SELECT * EXCEPT (route_columns) ... WHERE <where> 取得自己的資料列 (route_columns 為空時 SELECT *)。
+    每張表在影子表複製線上資料後，移除受影響月份的分區再寫入，最後整表交換發佈 (utilx.publish) 並記錄於 BUILD_LOG_TABLE；
+    full_refresh 或任一目標表沒有建置紀錄時在空的影子表重算所有月份 (vault 中已不存在的月份自然移除)。
+    目標表是否為空不影響判斷 (部分分流表可能正常地為空)
+    """
+    full_refresh = full_refresh or built_tables(client, list(routes)) != set(routes)
+    months = touched_months(client, full_refresh)
+    client.command(f"DROP TABLE IF EXISTS {build_table}")
+    client.command(
+        f"CREATE TABLE {build_table} ENGINE = MergeTree ORDER BY tuple() AS {select_sql}",
+        parameters={'months': months},
+    )
+    columns = f"* EXCEPT ({', '.join(route_columns)})" if route_columns else '*'
+    try:
+        with ExitStack() as stack:
+            for table, where in routes.items():
+                shadow = stack.enter_context(publishing(client, table, copy_live=not full_refresh))
+                if not full_refresh:
+                    copied = partition_ids(client, shadow)
+                    for partition_id in sorted({str(month) for month in months} & copied):
+                        client.command(f"ALTER TABLE {shadow} DROP PARTITION ID '{partition_id}'")
+                client.command(
+                    f"INSERT INTO {shadow} SELECT {columns} FROM {build_table} WHERE {where}")
+        log_builds(client, list(routes), full_refresh, months)
+    finally:
+        client.command(f"DROP TABLE IF EXISTS {build_table}")
+    return months
+
+def upsert_dimension(client, table: str, select_sql: str, full_refresh: bool = False) -> Optional[datetime]:
+    """
+    以 select_sql 更新 ReplacingMergeTree(updated_at) 的維度表，回傳本次的 PSA batch (全量重建時為 None)
+
+    select_sql 以 {full:Bool} OR key IN (PSA batch 的 key) 篩選，只重寫本次 batch 出現的 key；
+    寫入複製了線上資料的影子表後 OPTIMIZE FINAL 合併同一個 key 的舊版本 (維度表小，成本低)，再交換發佈。
+    full_refresh、目標表為空或沒有 PSA 載入紀錄時在空的影子表全量寫入
+    """
+    load_datetime = None if full_refresh or is_empty(client, table) else latest_psa_batch(client)
+    with publishing(client, table, copy_live=load_datetime is not None) as shadow:
+        client.command(f"INSERT INTO {shadow} {select_sql}", parameters={
+            'full': load_datetime is None,
+            'load_datetime': load_datetime or datetime(1970, 1, 1),
+            'updated_at': datetime.utcnow().replace(microsecond=0),
+        })
+        client.command(f"OPTIMIZE TABLE {shadow} FINAL")
+    return load_datetime
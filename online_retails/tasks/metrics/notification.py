@@ -1,140 +1,91 @@
+from typing import Dict, List, NamedTuple
 from prefect import task, get_run_logger
-from utilx import push_to_prometheus
-import pandas as pd
+from utilx import instrumentation, push_to_prometheus
 import utilx.clickhouse_client as ch
+from utilx.instrumentation import instrumented
+
+class MetricSource(NamedTuple):
+    """指標來源表，取依 order_by 最新的一列"""
+    table: str
+    order_by: str
+
+class MetricSpec(NamedTuple):
+    """
+    推送到 Prometheus 的 gauge：MetricSource 最新一列的 column
+
+    Pushgateway 的 job 沿用指標名稱 (與原本逐一推送時相同)，既有的 series、dashboard 與 alert 不受影響
+    """
+    name: str
+    source: str          # METRIC_SOURCES 的名稱
+    column: str
+    documentation: str
+
+METRIC_SOURCES = {
+    'data_quality': MetricSource('quality.data_quality', 'check_date'),
+    'sales_summary': MetricSource('quality.sales_summary', 'sales_date'),
+}
+
+METRICS = [
+    MetricSpec('anomaly_unit_price_count', 'data_quality', 'anomaly_unit_price_count', 'Count of anomalies in unit price'),
+    MetricSpec('anomaly_quantity_count', 'data_quality', 'anomaly_quantity_count', 'Count of anomalies in quantity'),
+    MetricSpec('missing_customer_id_ratio', 'data_quality', 'missing_customer_id_ratio', 'Ratio of missing customer IDs'),
+    MetricSpec('latest_min_total_amount', 'sales_summary', 'min_total_amount', 'Latest minimum total amount in sales'),
+    MetricSpec('latest_max_total_amount', 'sales_summary', 'max_total_amount', 'Latest maximum total amount in sales'),
+    MetricSpec('latest_median_total_amount', 'sales_summary', 'median_total_amount', 'Latest median total amount in sales'),
+    MetricSpec('latest_avg_total_amount', 'sales_summary', 'avg_total_amount', 'Latest average total amount in sales'),
+    MetricSpec('latest_sales_volume', 'sales_summary', 'volume', 'Latest sales volume'),
+]
+
+def latest_values_sql(metrics: List[MetricSpec]) -> str:
+    """
+    所有指標最新值的單一查詢
+
+    每個來源以一個純量子查詢取最新一列的所有指標欄位 (Float64 陣列，來源沒有資料時為空陣列)，
+    回傳一列、每個來源一欄，欄位順序同 METRIC_SOURCES
+    """
+    columns = []
+    for source_name, source in METRIC_SOURCES.items():
+        values = ', '.join(f'toFloat64({metric.column})' for metric in metrics if metric.source == source_name)
+        columns.append(
+            f"(SELECT groupArray([{values}]) FROM (SELECT * FROM {source.table} ORDER BY {source.order_by} DESC LIMIT 1)) AS {source_name}")
+    return 'SELECT\n    ' + ',\n    '.join(columns)
+
+def latest_values(client, metrics: List[MetricSpec]) -> Dict[str, float]:
+    """{指標名稱: 最新值}，來源沒有資料的指標不列入"""
+    row = client.query(latest_values_sql(metrics)).first_row
+    values = {}
+    for source_name, latest in zip(METRIC_SOURCES, row):
+        if not latest:
+            continue
+        source_metrics = [metric for metric in metrics if metric.source == source_name]
+        values.update({metric.name: value for metric, value in zip(source_metrics, latest[0])})
+    return values
 
 @task
-def anomaly_unit_price_count():
-    """Count of anomalies in unit price"""
+@instrumented
+def publish_metrics():
+    """以一次查詢讀取 METRICS 的最新值，每個指標推送到各自的 Pushgateway job (job 名稱即指標名稱)"""
     logger = get_run_logger()
-    logger.info(f"Counting anomaly_unit_price_count...")
+    logger.info(f"Publishing {len(METRICS)} metrics...")
 
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT anomaly_unit_price_count FROM quality.data_quality order by check_date desc limit 1
-    """)
-    
-    count = metrics_df.iloc[0]['anomaly_unit_price_count']
+    client = ch.get_client('metrics')
+    values = latest_values(client, METRICS)
+    missing = [metric.name for metric in METRICS if metric.name not in values]
+    if missing:
+        logger.warning(f"No data for {missing}, skipped.")
 
-    push_to_prometheus.guage('anomaly_unit_price_count', count)
+    # 每個 job 的 PUT 只取代該指標，沒有資料的指標保留先前推送的值
+    for metric in METRICS:
+        if metric.name in values:
+            push_to_prometheus.push_gauges(metric.name, [(metric.name, metric.documentation, {}, values[metric.name])])
 
-    logger.info(f"anomaly_unit_price_count: {count}")
+    logger.info(f"Metrics published: {values}")
 
 @task
-def anomaly_quantity_count():
-    """Count of anomalies in quantity"""
+def publish_pipeline_stats():
+    """將本次 flow run 各 task 的耗時與 ClickHouse 查詢統計 (utilx.instrumentation) 一次推送到 Prometheus Pushgateway"""
     logger = get_run_logger()
-    logger.info(f"Counting anomaly_quantity_count...")
-
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT anomaly_quantity_count FROM quality.data_quality order by check_date desc limit 1
-    """)
-    
-    count = metrics_df.iloc[0]['anomaly_quantity_count']
-
-    push_to_prometheus.guage('anomaly_quantity_count', count)
-
-    logger.info(f"anomaly_quantity_count: {count}")    
-
-@task
-def missing_customer_id_ratio():
-    """Ratio of missing customer IDs"""
-    logger = get_run_logger()
-    logger.info(f"Calculating missing_customer_id_ratio...")
-
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT missing_customer_id_ratio FROM quality.data_quality order by check_date desc limit 1
-    """)
-    
-    ratio = metrics_df.iloc[0]['missing_customer_id_ratio']
-
-    push_to_prometheus.guage('missing_customer_id_ratio', ratio)
-
-    logger.info(f"missing_customer_id_ratio: {ratio}")
-
-@task
-def latest_min_total_amount():
-    """Latest minimum total amount in sales"""
-    logger = get_run_logger()
-    logger.info(f"Calculating latest_min_total_amount...")
-
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT min_total_amount as min_total_amount FROM quality.sales_summary order by sales_date desc limit 1
-    """)
-    
-    min_total_amount = metrics_df.iloc[0]['min_total_amount']
-
-    push_to_prometheus.guage('latest_min_total_amount', min_total_amount)
-
-    logger.info(f"latest_min_total_amount: {min_total_amount}")
-
-@task
-def latest_max_total_amount():
-    """Latest maximum total amount in sales"""
-    logger = get_run_logger()
-    logger.info(f"Calculating latest_max_total_amount...")
-
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT max_total_amount as max_total_amount FROM quality.sales_summary order by sales_date desc limit 1
-    """)
-    
-    max_total_amount = metrics_df.iloc[0]['max_total_amount']
-
-    push_to_prometheus.guage('latest_max_total_amount', max_total_amount)
-
-    logger.info(f"latest_max_total_amount: {max_total_amount}")
-
-@task
-def latest_median_total_amount():
-    """Latest median total amount in sales"""
-    logger = get_run_logger()
-    logger.info(f"Calculating latest_median_total_amount...")
-
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT median_total_amount as median_total_amount FROM quality.sales_summary order by sales_date desc limit 1
-    """)
-    
-    median_total_amount = metrics_df.iloc[0]['median_total_amount']
-
-    push_to_prometheus.guage('latest_median_total_amount', median_total_amount)
-
-    logger.info(f"latest_median_total_amount: {median_total_amount}")
-
-@task
-def latest_avg_total_amount():
-    """Latest average total amount in sales"""
-    logger = get_run_logger()
-    logger.info(f"Calculating latest_avg_total_amount...")
-
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT avg_total_amount as avg_total_amount FROM quality.sales_summary order by sales_date desc limit 1
-    """)
-    
-    avg_total_amount = metrics_df.iloc[0]['avg_total_amount']
-
-    push_to_prometheus.guage('latest_avg_total_amount', avg_total_amount)
-
-    logger.info(f"latest_avg_total_amount: {avg_total_amount}")
-
-@task
-def latest_sales_volume():
-    """Latest sales volume"""
-    logger = get_run_logger()
-    logger.info(f"Calculating latest_sales_volume...")
-
-    client = ch.get_client()
-    metrics_df : pd.DataFrame = client.query_df("""
-        SELECT DISTINCT volume as volume FROM quality.sales_summary order by sales_date desc limit 1
-    """)
-    
-    volume = metrics_df.iloc[0]['volume']
-
-    push_to_prometheus.guage('latest_sales_volume', volume)
-
-    logger.info(f"latest_sales_volume: {volume}")
+    stats = instrumentation.push_task_stats()
+    slowest = sorted(stats, key=lambda task: task.wall_seconds, reverse=True)[:5]
+    logger.info(f"Pipeline stats published for {len(stats)} tasks, slowest: "
+                + ', '.join(f"{task.task} {task.wall_seconds:.1f}s" for task in slowest))
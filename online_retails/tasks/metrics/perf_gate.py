@@ -0,0 +1,144 @@
+from datetime import datetime
+from typing import List, NamedTuple
+from prefect import task, get_run_logger
+from utilx import instrumentation
+import utilx.clickhouse_client as ch
+
+PERF_TABLE = 'quality.pipeline_perf'
+
+# off: 不記錄；flag: 記錄並以 warning 標記退化；fail: 記錄，退化時讓 flow 失敗
+PERF_GATE_MODES = ('off', 'flag', 'fail')
+
+# 比較的指標，以及 baseline 低於此值時不判斷退化 (避免小查詢的雜訊)
+PERF_METRICS = {
+    'read_rows': 100_000,
+    'read_bytes': 10_000_000,
+    'memory_usage': 100_000_000,
+    'query_duration_ms': 1_000,
+}
+
+# 依 query_id 的 task 前綴 (online_retails:<task>:) 彙總本次執行的查詢
+RECORD_SQL = """
+INSERT INTO {table} (suite, flow_run, run_at, task, queries, read_rows, read_bytes, memory_usage, query_duration_ms)
+SELECT
+    {{suite:String}}, {{flow_run:String}}, {{run_at:DateTime64(0, 'UTC')}},
+    splitByChar(':', query_id)[2] AS task,
+    count(), sum(read_rows), sum(read_bytes), max(memory_usage), sum(query_duration_ms)
+FROM system.query_log
+WHERE type = 'QueryFinish' AND event_date >= yesterday() AND query_id IN {{query_ids:Array(String)}}
+GROUP BY task
+"""
+
+# 本次執行與同一 suite 先前 {window} 次執行 (每個 task) 的中位數
+BASELINE_SQL = """
+SELECT task, runs, {this_run}, {baseline}
+FROM (SELECT * FROM {table} WHERE suite = {{suite:String}} AND flow_run = {{flow_run:String}}) AS this_run
+JOIN (
+    SELECT task, count() AS runs, {medians}
+    FROM (
+        SELECT * FROM {table}
+        WHERE suite = {{suite:String}} AND flow_run != {{flow_run:String}} AND run_at < {{run_at:DateTime64(0, 'UTC')}}
+        ORDER BY run_at DESC
+        LIMIT {{window:UInt32}} BY task
+    )
+    GROUP BY task
+) AS baseline USING (task)
+ORDER BY task
+"""
+
+class PerfRegression(NamedTuple):
+    task: str
+    metric: str
+    current: float
+    baseline: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline
+
+    def __str__(self) -> str:
+        return f"{self.task}.{self.metric}: {self.current:,.0f} vs baseline {self.baseline:,.0f} ({self.ratio:.2f}x)"
+
+class PerfRegressionError(RuntimeError):
+    """pipeline 查詢統計超過 baseline 的容許範圍"""
+
+def record_run(client, query_ids: List[str], flow_run: str, suite: str = 'nightly',
+               run_at: datetime = None, table: str = PERF_TABLE) -> datetime:
+    """將 query_ids 在 system.query_log 的統計依 task 彙總寫入 table，回傳 run_at"""
+    run_at = run_at or datetime.utcnow().replace(microsecond=0)
+    instrumentation.flush_query_log(client)
+    client.command(RECORD_SQL.format(table=table), parameters={
+        'suite': suite, 'flow_run': flow_run, 'run_at': run_at, 'query_ids': query_ids,
+    })
+    return run_at
+
+def find_regressions(
+    client,
+    flow_run: str,
+    run_at: datetime,
+    suite: str = 'nightly',
+    threshold: float = 0.5,
+    window: int = 7,
+    min_runs: int = 3,
+    table: str = PERF_TABLE,
+) -> List[PerfRegression]:
+    """
+    本次執行中超過 baseline (同一 suite 先前 window 次的中位數) * (1 + threshold) 的 task 指標
+
+    baseline 少於 min_runs 次或低於 PERF_METRICS 下限的指標不判斷
+    """
+    sql = BASELINE_SQL.format(
+        table=table,
+        this_run=', '.join(f'this_run.{metric}' for metric in PERF_METRICS),
+        baseline=', '.join(f'baseline.{metric}' for metric in PERF_METRICS),
+        medians=', '.join(f'median({metric}) AS {metric}' for metric in PERF_METRICS),
+    )
+    rows = client.query(sql, parameters={
+        'suite': suite, 'flow_run': flow_run, 'run_at': run_at, 'window': window,
+    }).result_rows
+    regressions = []
+    for task_name, runs, *values in rows:
+        if runs < min_runs:
+            continue
+        current, baseline = values[:len(PERF_METRICS)], values[len(PERF_METRICS):]
+        for (metric, floor), now, before in zip(PERF_METRICS.items(), current, baseline):
+            if before >= floor and now > before * (1 + threshold):
+                regressions.append(PerfRegression(task_name, metric, float(now), float(before)))
+    return regressions
+
+def check_run(
+    client,
+    query_ids: List[str],
+    flow_run: str,
+    suite: str = 'nightly',
+    mode: str = 'flag',
+    threshold: float = 0.5,
+    window: int = 7,
+    logger=None,
+) -> List[PerfRegression]:
+    """記錄本次執行並與 baseline 比較；mode 為 fail 且有退化時 raise PerfRegressionError"""
+    if mode not in PERF_GATE_MODES:
+        raise ValueError(f"mode must be one of {PERF_GATE_MODES}, got {mode!r}")
+    if mode == 'off':
+        return []
+    run_at = record_run(client, query_ids, flow_run, suite)
+    regressions = find_regressions(client, flow_run, run_at, suite, threshold, window)
+    if regressions:
+        message = f"{len(regressions)} performance regressions beyond {threshold:.0%}: " + '; '.join(map(str, regressions))
+        if mode == 'fail':
+            raise PerfRegressionError(message)
+        if logger:
+            logger.warning(message)
+    elif logger:
+        logger.info(f"No performance regressions beyond {threshold:.0%} for flow run {flow_run}.")
+    return regressions
+
+@task
+def perf_gate(mode: str = 'flag', threshold: float = 0.5, window: int = 7):
+    """將本次 flow run 各 task 的 query_log 統計寫入 quality.pipeline_perf，並與先前執行的 baseline 比較"""
+    logger = get_run_logger()
+    flow_run = instrumentation.current_flow_run()
+    query_ids = [query_id for stats in instrumentation.task_stats(flow_run) for query_id in stats.query_ids]
+    logger.info(f"Checking {len(query_ids)} queries of flow run {flow_run} against the performance baseline...")
+
+    check_run(ch.get_client('metrics'), query_ids, flow_run, mode=mode, threshold=threshold, window=window, logger=logger)
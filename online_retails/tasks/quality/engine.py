@@ -0,0 +1,124 @@
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+RULE_RESULTS_TABLE = 'quality.rule_results'
+
+# null_ratio: expression 為 NULL 或等於 null_value 的比例
+# range_check: expression 不在 [low, high] 之間的列數 (low / high 可省略其一)
+# threshold_count: expression <op> threshold 的列數
+# referential: expression 不存在於 reference (<table>.<column>) 的列數
+RULE_KINDS = ('null_ratio', 'range_check', 'threshold_count', 'referential')
+
+class QualitySource(NamedTuple):
+    """規則的資料來源，同一個來源的所有規則在一次掃描中計算"""
+    table: str        # FROM 子句 (資料表或 table function)
+    partition: str    # 分區運算式 (toYYYYMM)，只檢查本次載入的分區時以此篩選
+
+class QualityRule(NamedTuple):
+    """宣告式資料品質規則，結果寫入 quality.rule_results 的一列"""
+    name: str
+    source: str                        # QUALITY_SOURCES 的名稱
+    kind: str                          # RULE_KINDS
+    expression: str                    # 檢查的欄位或 SQL 運算式
+    null_value: Optional[str] = None   # null_ratio：視為缺值的值 (例如預設值 0)
+    low: Optional[str] = None          # range_check：下限 (SQL 運算式)
+    high: Optional[str] = None         # range_check：上限 (SQL 運算式)
+    op: str = '>'                      # threshold_count：比較運算子
+    threshold: Optional[str] = None    # threshold_count：門檻 (SQL 運算式)
+    reference: Optional[str] = None    # referential：<table>.<column>
+    scope: Optional[str] = None        # 只檢查符合此條件的列，total 亦只計算這些列
+    total_scope: Optional[str] = None  # total (null_ratio 的分母) 只計算符合此條件的列，failed 不受影響
+
+    def failed_condition(self) -> str:
+        if self.kind == 'null_ratio':
+            missing = f'isNull({self.expression})'
+            return missing if self.null_value is None else f'({missing} OR {self.expression} = {self.null_value})'
+        if self.kind == 'range_check':
+            bounds = [f'{self.expression} < {self.low}' if self.low is not None else None,
+                      f'{self.expression} > {self.high}' if self.high is not None else None]
+            return '(' + ' OR '.join(bound for bound in bounds if bound) + ')'
+        if self.kind == 'threshold_count':
+            return f'({self.expression} {self.op} {self.threshold})'
+        table, column = self.reference.rsplit('.', 1)
+        return f'{self.expression} NOT IN (SELECT {column} FROM {table})'
+
+    def aggregates(self) -> str:
+        """(name, kind, value, failed, total) 的 tuple，failed / total 以 countIf 在來源的同一次掃描中計算"""
+        failed = f'countIf({self.failed_condition()} AND {self.scope})' if self.scope else f'countIf({self.failed_condition()})'
+        counted = ' AND '.join(condition for condition in (self.scope, self.total_scope) if condition)
+        total = f'countIf({counted})' if counted else 'count()'
+        value = f'if({total} = 0, 0, {failed} / {total})' if self.kind == 'null_ratio' else failed
+        return f"tuple('{self.name}', '{self.kind}', toFloat64({value}), toUInt64({failed}), toUInt64({total}))"
+
+def validate_rules(rules: List[QualityRule], sources: Dict[str, QualitySource]) -> None:
+    names = [rule.name for rule in rules]
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"quality rule names must be unique, got duplicates {duplicated}")
+    for rule in rules:
+        if rule.kind not in RULE_KINDS:
+            raise ValueError(f"{rule.name}: kind must be one of {RULE_KINDS}, got {rule.kind!r}")
+        if rule.source not in sources:
+            raise ValueError(f"{rule.name}: unknown source {rule.source!r}, expected any of {list(sources)}")
+        missing = {
+            'range_check': rule.low is None and rule.high is None,
+            'threshold_count': rule.threshold is None,
+            'referential': rule.reference is None or '.' not in rule.reference,
+        }.get(rule.kind, False)
+        if missing:
+            raise ValueError(f"{rule.name}: {rule.kind} rule is missing its bound, threshold or reference")
+
+def rules_insert_sql(rules: List[QualityRule], sources: Dict[str, QualitySource], partitioned: bool = False) -> str:
+    """
+    所有規則寫入 RULE_RESULTS_TABLE 的單一 INSERT ... SELECT
+
+    每個來源只掃描一次：該來源所有規則的 countIf 組成一個 tuple 陣列，再以 ARRAY JOIN 展開為每條規則一列；
+    不同來源以 UNION ALL 合併。新增規則只增加同一次掃描中的聚合，不增加掃描次數。
+    partitioned 時只讀取 {months:Array(UInt32)} 的分區，否則檢查全部資料 (需傳入 checked_at / months parameters)
+    """
+    validate_rules(rules, sources)
+    selects = []
+    for source_name, source in sources.items():
+        source_rules = [rule for rule in rules if rule.source == source_name]
+        if not source_rules:
+            continue
+        where = f'WHERE {source.partition} IN {{months:Array(UInt32)}}' if partitioned else ''
+        results = ',\n                '.join(rule.aggregates() for rule in source_rules)
+        selects.append(f"""
+        SELECT '{source_name}' AS source, result
+        FROM (
+            SELECT [
+                {results}
+            ] AS results
+            FROM {source.table}
+            {where}
+        )
+        ARRAY JOIN results AS result""")
+    return f"""
+    INSERT INTO {RULE_RESULTS_TABLE} (check_date, checked_at, rule, kind, source, value, failed, total, partitions)
+    SELECT
+        toDate({{checked_at:DateTime64(0, 'UTC')}}) AS check_date,
+        {{checked_at:DateTime64(0, 'UTC')}} AS checked_at,
+        result.1 AS rule,
+        result.2 AS kind,
+        source,
+        result.3 AS value,
+        result.4 AS failed,
+        result.5 AS total,
+        {{months:Array(UInt32)}} AS partitions
+    FROM ({' UNION ALL '.join(selects)}
+    )
+    """
+
+def evaluate_rules(client, rules: List[QualityRule], sources: Dict[str, QualitySource], months: Optional[List[int]] = None) -> datetime:
+    """
+    以一次 INSERT 計算所有規則，回傳本次結果的 checked_at
+
+    指定 months 時只檢查這些分區 (YYYYMM)，partitions 欄位記錄檢查的分區；未指定時檢查全部資料，partitions 為空陣列
+    """
+    checked_at = datetime.utcnow().replace(microsecond=0)
+    client.command(rules_insert_sql(rules, sources, partitioned=months is not None), parameters={
+        'checked_at': checked_at,
+        'months': months or [],
+    })
+    return checked_at
@@ -1,55 +1,45 @@
 from prefect import task, get_run_logger
+from tasks.mart.incremental import touched_months
+from tasks.quality.engine import QualityRule, QualitySource, evaluate_rules
 import utilx.clickhouse_client as ch
+from utilx.publish import publishing
+from utilx.instrumentation import instrumented
 
-@task
-def anomaly_customer_invoioces():
-    """從 Vault 找出異常的客戶"""
-    logger = get_run_logger()
-    logger.info(f"mark anomaly_customer_invoioces...")
+# fact 建置產生的三張表結構相同，以 merge() 視為一個來源，一次掃描；_table 區分來源表
+QUALITY_SOURCES = {
+    'fact_lines': QualitySource(
+        "merge(REGEXP('^(marts|quality)$'), '^(Fact_Sales|Fact_Sale_Returns|anomaly_customer_invoioces)$')",
+        'toYYYYMM(invoice_date)',
+    ),
+}
 
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE quality.anomaly_customer_invoioces")
-    client.command("""
-    INSERT INTO quality.anomaly_customer_invoioces
-    WITH
-        hub_customer AS (SELECT hub_customer_hash_key, CustomerID FROM vault.hub_customer WHERE CustomerID = 0),
-        link_invoice_customer AS (SELECT hub_invoice_hash_key, hub_customer_hash_key FROM vault.link_invoice_customer),
-        link_invoice_product AS (SELECT hub_invoice_hash_key, hub_product_hash_key FROM vault.link_invoice_product),
-        link_invoice_time AS (SELECT hub_invoice_hash_key, hub_time_hash_key FROM vault.link_invoice_time),
-        link_invoice_country AS (SELECT hub_invoice_hash_key, hub_country_hash_key FROM vault.link_invoice_country),
-        hub_invoice AS (SELECT hub_invoice_hash_key, InvoiceNo FROM vault.hub_invoice),
-        sat_invoice AS (SELECT hub_invoice_hash_key, Quantity, UnitPrice, TotalAmount FROM vault.sat_invoice)
-    SELECT
-        i.hub_invoice_hash_key AS sale_id,
-        i.InvoiceNo as invoice_no,
-        p.hub_product_hash_key as product_key,
-        c.hub_customer_hash_key as customer_key,
-        t.hub_time_hash_key as time_key,
-        co.hub_country_hash_key as country_key,       
-        s.Quantity as quantity,
-        s.UnitPrice as unit_price,
-        s.TotalAmount as total_amount
-    FROM hub_invoice i
-    JOIN sat_invoice s ON i.hub_invoice_hash_key = s.hub_invoice_hash_key
-    JOIN link_invoice_customer lic ON i.hub_invoice_hash_key = lic.hub_invoice_hash_key
-    JOIN hub_customer c ON lic.hub_customer_hash_key = c.hub_customer_hash_key
-    JOIN link_invoice_product p ON i.hub_invoice_hash_key = p.hub_invoice_hash_key
-    JOIN link_invoice_time t ON i.hub_invoice_hash_key = t.hub_invoice_hash_key
-    JOIN link_invoice_country co ON i.hub_invoice_hash_key = co.hub_invoice_hash_key
-    """)
+_FACT_SALES = "_table = 'Fact_Sales'"
+_FACTS = "_table IN ('Fact_Sales', 'Fact_Sale_Returns')"
 
-    logger.info(f"anomaly_customer_invoioces marked.")
+QUALITY_RULES = [
+    # 缺少客戶 ID (CustomerID = 0，分流至 anomaly_customer_invoioces) 的明細數 / (Fact_Sales + Fact_Sale_Returns) 的明細數
+    QualityRule('missing_customer_id_ratio', 'fact_lines', 'null_ratio',
+                "dictGetOrDefault('vault.dict_customer', 'CustomerID', tuple(customer_key), toUInt64(1))", null_value='0',
+                total_scope=_FACTS),
+    QualityRule('anomaly_unit_price_count', 'fact_lines', 'threshold_count', 'unit_price', op='<=', threshold='0', scope=_FACT_SALES),
+    QualityRule('anomaly_quantity_count', 'fact_lines', 'threshold_count', 'quantity', op='>', threshold='1000', scope=_FACT_SALES),
+    QualityRule('future_invoice_date_count', 'fact_lines', 'range_check', 'invoice_date', high='today()'),
+    QualityRule('orphan_product_key_count', 'fact_lines', 'referential', 'product_key', reference='vault.hub_product.hub_product_hash_key'),
+    QualityRule('orphan_country_key_count', 'fact_lines', 'referential', 'country_key', reference='vault.hub_country.hub_country_hash_key'),
+]
 
 @task
+@instrumented
 def anomaly_invoice():
     """從 Vault 找出異常的發票"""
     logger = get_run_logger()
     logger.info(f"mark anomaly_invoice...")
 
-    client = ch.get_client()
-    client.command("TRUNCATE TABLE quality.anomaly_invoice")
-    client.command("""
-    INSERT INTO quality.anomaly_invoice
+    client = ch.get_client('heavy')
+    # 在影子表重建後原子交換，讀取端不會看到清空或寫入中的表
+    with publishing(client, 'quality.anomaly_invoice') as shadow:
+        client.command(f"""
+    INSERT INTO {shadow}
     WITH
         fact_sales as (select * from marts.Fact_Sales where unit_price <= 0 or quantity > 1000)
     SELECT
@@ -57,7 +47,7 @@ def anomaly_invoice():
         invoice_no,
         product_key,
         customer_key,
-        time_key,
+        date_key,
         country_key,
         quantity,
         unit_price,
@@ -68,53 +58,21 @@ def anomaly_invoice():
     logger.info(f"anomaly_invoice marked.")
 
 @task
-def data_quality():
-    """從 Marts 檢查資料品質"""
+@instrumented
+def data_quality(partitioned: bool = False):
+    """以 QUALITY_RULES 檢查 Marts 資料品質，所有規則一次寫入 quality.rule_results (quality.data_quality 為其 view)"""
     logger = get_run_logger()
     logger.info(f"mark data_quality...")
 
-    client = ch.get_client()
-    client.command("""
-    INSERT INTO quality.data_quality
-    WITH
-        anomaly_customer_invoioces as (select sale_id from quality.anomaly_customer_invoioces),
-        fact_sales as (select sale_id from marts.Fact_Sales),
-        fact_sale_returns as (select sale_id from marts.Fact_Sale_Returns),
-        anomaly_invoice as (select sale_id, quantity, unit_price from quality.anomaly_invoice)
-    SELECT
-        today() as check_date,
-        (SELECT COUNT(sale_id) from anomaly_customer_invoioces) / ((SELECT COUNT(sale_id) from fact_sales) + (SELECT COUNT(sale_id) from fact_sale_returns)) as missing_customer_id_ratio,
-        (SELECT COUNT(sale_id) from anomaly_invoice where unit_price <= 0) as anomaly_unit_price_count,
-        (SELECT COUNT(sale_id) from anomaly_invoice where quantity > 1000) as anomaly_quantity_count
-    """)
-
-    logger.info(f"data_quality marked.")
-
-@task
-def sales_summary():
-    """從 Marts 計算每日銷售總額"""
-    logger = get_run_logger()
-    logger.info(f"Calculating sales_summary...")
-
-    client = ch.get_client()
-    client.command("""
-    INSERT INTO quality.sales_summary
-    WITH
-        fact_sales as (select * from marts.Fact_Sales),
-        link_invoice_time as (select hub_invoice_hash_key, hub_time_hash_key from vault.link_invoice_time),
-        sat_time as (select hub_time_hash_key, date from vault.sat_time)
-    SELECT
-        t.date as sale_date,
-        MIN(s.total_amount) as min_total_amount,
-        MAX(s.total_amount) as max_total_amount,
-        median(s.total_amount) as median_total_amount,
-        AVG(s.total_amount) as avg_total_amount,
-        SUM(s.total_amount) as volume
-    FROM fact_sales s
-    JOIN link_invoice_time lit ON s.sale_id = lit.hub_invoice_hash_key
-    JOIN sat_time t ON lit.hub_time_hash_key = t.hub_time_hash_key
-    GROUP BY t.date
-    ORDER BY t.date
-    """)
+    client = ch.get_client('heavy')
+    # partitioned 時只檢查本次 PSA batch 涉及的發票月份，結果只代表這些月份 (quality.data_quality_batches)，
+    # 不列入 quality.data_quality 的每日指標
+    months = touched_months(client) if partitioned else None
+    if months == []:
+        # 空的 partitions 代表全量檢查，沒有涉及的月份時不寫入結果
+        logger.info("No invoice months touched by the latest PSA batch, data_quality skipped.")
+        return
+    checked_at = evaluate_rules(client, QUALITY_RULES, QUALITY_SOURCES, months)
 
-    logger.info(f"sales_summary calculated.")
+    scope = f"{len(months)} monthly partitions" if months is not None else "all partitions"
+    logger.info(f"data_quality marked: {len(QUALITY_RULES)} rules over {scope} at {checked_at}.")
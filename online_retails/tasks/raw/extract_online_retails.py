@@ -1,154 +1,569 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from pandera import Column, DataFrameSchema, Check
 from prefect import task, get_run_logger
-from utilx.hashx import generate_hash_key
-import io
+from tasks.vault import loader as vault_loader
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlparse
+from utilx import downloader, readers, staging_cache
+from utilx.hashx import generate_hash_keys
+from utilx.instrumentation import instrumented
+from utilx.keyindex import DEFAULT_FPR
+from utilx.resource_usage import peak_rss_mb
+import numpy as np
 import os
 import pandas as pd
 import pandera.pandas as pa
-import requests
+import pyarrow
+import tempfile
+import time
 import utilx.clickhouse_client as ch
 import zipfile
 
+# PSA 的 Hash Key 定義 (依序計算，Link 直接引用前面算出的 Hub Key)
+PSA_HASH_KEYS = {
+    'hub_invoice_hash_key': ['InvoiceNo', 'StockCode', 'InvoiceDate'],
+    'hub_product_hash_key': ['StockCode'],
+    'hub_customer_hash_key': ['CustomerID'],
+    'hub_time_hash_key': ['InvoiceDate'],
+    'hub_country_hash_key': ['Country'],
+    'link_invoice_product_hash_key': ['hub_invoice_hash_key', 'hub_product_hash_key'],
+    'link_invoice_customer_hash_key': ['hub_invoice_hash_key', 'hub_customer_hash_key'],
+    'link_invoice_time_hash_key': ['hub_invoice_hash_key', 'hub_time_hash_key'],
+    'link_invoice_country_hash_key': ['hub_invoice_hash_key', 'hub_country_hash_key'],
+    'link_customer_country_hash_key': ['hub_customer_hash_key', 'hub_country_hash_key'],
+}
+
+# raw.online_retails 的欄位與型態
+RAW_SCHEMA = DataFrameSchema({
+    "InvoiceNo": Column(str, nullable=True),
+    "StockCode": Column(str, nullable=True),
+    "Description": Column(str, nullable=True),
+    "Quantity": Column(int, nullable=True),
+    "InvoiceDate": Column(str, nullable=True),
+    "UnitPrice": Column(float, nullable=True),
+    "CustomerID": Column("Int64", nullable=True),  # 或使用 Int64 (pandas nullable integer)
+    "Country": Column(str, nullable=True),
+    "TotalAmount": Column(float, nullable=True)
+}, strict=True, coerce=True)  # coerce=True 自動轉型
+
+RAW_RENAME = {
+    'Invoice': 'InvoiceNo',
+    'StockCode': 'StockCode',
+    'Description': 'Description',
+    'Quantity': 'Quantity',
+    'InvoiceDate': 'InvoiceDate',
+    'Price': 'UnitPrice',
+    'Customer ID': 'CustomerID',
+    'Country': 'Country'
+}
+
+RAW_COLUMNS = ['InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice', 'CustomerID', 'Country', 'TotalAmount']
+
+# raw.online_retails 快取 (Parquet) 的欄位型態
+RAW_ARROW_SCHEMA = pyarrow.schema([
+    ('InvoiceNo', pyarrow.string()),
+    ('StockCode', pyarrow.string()),
+    ('Description', pyarrow.string()),
+    ('Quantity', pyarrow.int64()),
+    ('InvoiceDate', pyarrow.string()),
+    ('UnitPrice', pyarrow.float64()),
+    ('CustomerID', pyarrow.int64()),
+    ('Country', pyarrow.string()),
+    ('TotalAmount', pyarrow.float64()),
+])
+
+# 解析或轉換邏輯 (RAW_RENAME / RAW_SCHEMA) 改變時遞增，讓舊的 staging 快取失效
+RAW_CACHE_VERSION = '1'
+
+# raw 列的指紋 (NULL 與空字串視為相同)，增量載入以此判斷 raw 列是否已寫入 PSA
+RAW_FINGERPRINT_SQL = """
+cityHash64(
+    ifNull(InvoiceNo, ''), ifNull(StockCode, ''), ifNull(Description, ''), ifNull(toString(Quantity), ''),
+    ifNull(InvoiceDate, ''), ifNull(toString(UnitPrice), ''), ifNull(toString(CustomerID), ''), ifNull(Country, '')
+)
+"""
+
+# 增量模式：只取 InvoiceDate >= since 且指紋不在 PSA 同一時間範圍內的 raw 列 (清理時會丟棄的列不計入)
+PSA_DELTA_SQL = f"""
+SELECT * FROM (
+    SELECT *, {RAW_FINGERPRINT_SQL} AS RAW_FINGERPRINT
+    FROM raw.online_retails
+    WHERE parseDateTime64BestEffortOrNull(InvoiceDate, 0, 'UTC') >= {{since:DateTime64(0, 'UTC')}}
+        AND StockCode IS NOT NULL
+)
+WHERE RAW_FINGERPRINT NOT IN (
+    SELECT RAW_FINGERPRINT FROM raw.psa_online_retails
+    WHERE InvoiceDate >= {{since:DateTime64(0, 'UTC')}}
+)
+"""
+
+PSA_FULL_SQL = f"SELECT *, {RAW_FINGERPRINT_SQL} AS RAW_FINGERPRINT FROM raw.online_retails"
+
+# PSA 的 Decimal 欄位 (precision, scale)，兩種 engine 都四捨五入到 scale 位
+PSA_DECIMAL_COLUMNS = {'UnitPrice': (10, 4), 'TotalAmount': (10, 4)}
+
+# pandas engine 以 category 存放的低基數字串欄位
+PSA_CATEGORICAL_COLUMNS = ['StockCode', 'Country']
+
+# pandas engine 每列 PSA 資料的估計記憶體 (raw 字串欄位、10 個 uuid.UUID key 與轉換時的暫存)，
+# 用於將 memory_budget_mb 換算為每批列數
+PSA_ROW_BYTES = 2048
+
+# PSA 的轉換引擎 (見 prepare_psa_online_retails)
+PSA_ENGINES = ('pandas', 'clickhouse')
+
+PSA_RECORD_SOURCE = 'UCI Online Retail II'
+
+PSA_COLUMNS = [
+    'hub_invoice_hash_key', 'hub_product_hash_key', 'hub_customer_hash_key', 'hub_time_hash_key',
+    'hub_country_hash_key', 'link_invoice_product_hash_key', 'link_invoice_customer_hash_key',
+    'link_invoice_time_hash_key', 'link_invoice_country_hash_key', 'link_customer_country_hash_key',
+    'InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice',
+    'TotalAmount', 'CustomerID', 'Country', 'ReturnStatus', 'LOAD_DATETIME', 'RECORD_SOURCE', 'RAW_FINGERPRINT'
+]
+
+class RawSource(NamedTuple):
+    """壓縮檔中的一個工作表 (CSV/Parquet 的 sheet 為 None)"""
+    path: str
+    sheet: Optional[str]
+    reader: str
+    cache_file: Optional[str]
+
 @task(retries=3, retry_delay_seconds=10)
-def loading_online_retails(url) -> pd.DataFrame:
-    """下載、解壓縮、轉換資料並載入到 raw.online_retails"""
-    
+@instrumented
+def loading_online_retails(
+    url,
+    streaming: bool = False,
+    chunk_size: int = 50_000,
+    parse_workers: int = 2,
+    excel_reader: str = 'openpyxl',
+    cache_dir: Optional[str] = None,
+    download_dir: Optional[str] = None,
+    download_segments: int = 1,
+) -> Optional[pd.DataFrame]:
+    """
+    下載、解壓縮、轉換資料並載入到 raw.online_retails
+
+    壓縮檔中的每個檔案、活頁簿中的每個工作表 (Online Retail II 有 Year 2009-2010 與 Year 2010-2011)
+    都會被讀取，並以 parse_workers 個 process 平行解析後寫入。
+    Excel 以 excel_reader (openpyxl / calamine) 解析，CSV 與 Parquet 依副檔名選擇 reader。
+    streaming=True 時各工作表每 chunk_size 列轉換、驗證並直接寫入，
+    記憶體用量不隨檔案大小成長 (此模式不回傳 DataFrame)。
+    指定 cache_dir 時，轉換後的資料以來源檔內容 hash 為 key 存成 Parquet，來源未變時跳過解析。
+    指定 download_dir 時下載檔會保留下來：失敗重試時從中斷處續傳，下次執行以條件式請求確認來源，
+    來源未變更且已載入過時直接跳過整個 extract。
+    """
     logger = get_run_logger()
-    logger.info(f"Downloading data from {url}...")
-    response = requests.get(url)
-    response.raise_for_status()
+    started = time.perf_counter()
+    client = ch.get_client()
 
-    with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-        # 假設 zip 中只有一個 csv 檔
-        csv_filename = z.namelist()[0]
-        with z.open(csv_filename) as f:
-            # 讀取 Excel 格式的 CSV
-            df = pd.read_excel(f)
+    with tempfile.TemporaryDirectory(prefix='online_retails_') as workdir:
+        archive = os.path.join(download_dir or workdir, _archive_name(url))
+        logger.info(f"Downloading data from {url} to {archive}...")
+        download = downloader.download(url, archive, segments=download_segments, conditional=bool(download_dir))
+        logger.info(
+            f"Downloaded {download.bytes_downloaded} bytes in {download.seconds:.1f}s "
+            f"({download.throughput_mb_s:.1f} MB/s, sha256 {download.sha256})."
+        )
+        if download.not_modified and _loaded_sha256(archive) == download.sha256:
+            logger.info("Source not modified since the last load, skipping extract.")
+            return None
 
-    logger.info("Data downloaded and read into DataFrame.")
+        sources = _discover_sources(archive, workdir, excel_reader, cache_dir)
+        if not sources:
+            raise ValueError(f"No readable sheet found in {url}")
+        logger.info(f"Found {len(sources)} sheet(s): {[_source_name(s) for s in sources]}")
 
+        client.command('TRUNCATE TABLE raw.online_retails')
+        tables = []
+        rows = 0
+        with ProcessPoolExecutor(max_workers=max(1, min(parse_workers, len(sources)))) as executor:
+            futures = {executor.submit(_load_source, source, streaming, chunk_size): source for source in sources}
+            for future in as_completed(futures):
+                result, cache_hit = future.result()
+                if streaming:
+                    # 串流模式由 worker 直接寫入，回傳列數
+                    count = result
+                else:
+                    ch.insert_arrow(client, 'raw.online_retails', result)
+                    tables.append(result)
+                    count = result.num_rows
+                rows += count
+                logger.info(
+                    f"{_source_name(futures[future])}: {count} rows inserted into raw.online_retails"
+                    f"{' (staging cache hit)' if cache_hit else ''}."
+                )
 
-    schema = DataFrameSchema({
-        "InvoiceNo": Column(str, nullable=True),
-        "StockCode": Column(str, nullable=True),
-        "Description": Column(str, nullable=True),
-        "Quantity": Column(int, nullable=True),
-        "InvoiceDate": Column(str, nullable=True),
-        "UnitPrice": Column(float, nullable=True),
-        "CustomerID": Column("Int64", nullable=True),  # 或使用 Int64 (pandas nullable integer)
-        "Country": Column(str, nullable=True),
-        "TotalAmount": Column(float, nullable=True)
-    }, strict=True, coerce=True)  # coerce=True 自動轉型
-    
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"{rows} rows inserted into raw.online_retails in {elapsed:.1f}s "
+        f"({rows / elapsed if elapsed else 0:.0f} rows/sec, peak RSS "
+        f"{_format_mb(peak_rss_mb())} / parse workers {_format_mb(peak_rss_mb(children=True))})."
+    )
+
+    if download_dir:
+        _mark_loaded(archive, download.sha256)
+
+    return None if streaming else pyarrow.concat_tables(tables).to_pandas()
+
+def _archive_name(url: str) -> str:
+    return os.path.basename(urlparse(url).path) or 'source.zip'
+
+def _loaded_sha256(archive: str) -> Optional[str]:
+    """最後一次成功載入 raw.online_retails 的來源檔 SHA256"""
+    try:
+        with open(f"{archive}.loaded") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _mark_loaded(archive: str, sha256: str) -> None:
+    with open(f"{archive}.loaded", 'w') as f:
+        f.write(sha256)
+
+def _to_raw_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """欄位更名、計算 TotalAmount 並以 RAW_SCHEMA 驗證"""
     # 基本轉換
-    df.rename(
-        columns={
-            'Invoice': 'InvoiceNo', 
-            'StockCode': 'StockCode',
-            'Description': 'Description', 
-            'Quantity': 'Quantity',
-            'InvoiceDate': 'InvoiceDate', 
-            'Price': 'UnitPrice',
-            'Customer ID': 'CustomerID',
-            'Country': 'Country'
-        }, 
-        inplace=True
-)
+    df = df.rename(columns=RAW_RENAME)
     df['TotalAmount'] = df['Quantity'] * df['UnitPrice']
 
     # 確保欄位存在
-    required_cols = ['InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice', 'CustomerID', 'Country', 'TotalAmount']
-    df = df[required_cols]
-    df_validated  = schema.validate(df)
+    df = df[RAW_COLUMNS]
+    return RAW_SCHEMA.validate(df)
+
+def _discover_sources(archive: str, workdir: str, excel_reader: str, cache_dir: Optional[str]) -> List[RawSource]:
+    """解壓縮所有可讀取的檔案並列出其中的工作表"""
+    sources = []
+    with zipfile.ZipFile(archive) as z:
+        for member in z.namelist():
+            reader = None if member.endswith('/') else readers.reader_for(member, excel_reader)
+            if reader is None:
+                continue
+            # 解壓到磁碟讓 reader 可以隨機讀取，也讓各 process 各自開檔
+            path = z.extract(member, path=workdir)
+            digest = staging_cache.file_digest(path) if cache_dir else None
+            for sheet in readers.list_sheets(path, reader):
+                cache_file = staging_cache.cache_path(cache_dir, digest, sheet, RAW_CACHE_VERSION) if cache_dir else None
+                sources.append(RawSource(path, sheet, reader, cache_file))
+    return sources
+
+def _format_mb(value: Optional[float]) -> str:
+    return 'n/a' if value is None else f'{value:.0f} MB'
+
+def _source_name(source: RawSource) -> str:
+    name = os.path.basename(source.path)
+    return name if source.sheet is None else f"{name}[{source.sheet}]"
+
+def _to_raw_table(df: pd.DataFrame) -> pyarrow.Table:
+    return pyarrow.Table.from_pandas(df, schema=RAW_ARROW_SCHEMA, preserve_index=False)
+
+def _load_source(source: RawSource, streaming: bool, chunk_size: int) -> Tuple[Union[int, pyarrow.Table], bool]:
+    """
+    在 worker process 中解析單一工作表，回傳 (結果, 是否命中快取)。
+    一般模式的結果為驗證後的 pyarrow.Table (快取命中時直接讀取 Parquet，不經過 pandas)；
+    串流模式逐 chunk 以 Arrow 寫入 raw.online_retails，結果為列數。
+    """
+    cache_hit = source.cache_file is not None and os.path.exists(source.cache_file)
+    if not streaming:
+        if cache_hit:
+            return staging_cache.read_table(source.cache_file), True
+        table = _to_raw_table(_to_raw_frame(readers.read_frame(source.path, source.sheet, source.reader)))
+        if source.cache_file:
+            staging_cache.write(source.cache_file, table, RAW_ARROW_SCHEMA)
+        return table, False
 
-    # 寫入 ClickHouse raw table
-    logger.info("Writing to raw.online_retails...")
     client = ch.get_client()
-    client.command('TRUNCATE TABLE raw.online_retails')
-    client.insert_df('raw.online_retails', df_validated)
-    logger.info(f"{len(df_validated)} rows inserted into raw.online_retails.")
+    if cache_hit:
+        chunks = (pyarrow.Table.from_batches([batch]) for batch in staging_cache.iter_batches(source.cache_file, chunk_size))
+        writer = None
+    else:
+        chunks = (
+            _to_raw_table(_to_raw_frame(chunk))
+            for chunk in readers.iter_frames(source.path, source.sheet, source.reader, chunk_size)
+        )
+        writer = staging_cache.ChunkWriter(source.cache_file, RAW_ARROW_SCHEMA) if source.cache_file else None
 
-    
-    return df
+    rows = 0
+    try:
+        for chunk in chunks:
+            ch.insert_arrow(client, 'raw.online_retails', chunk)
+            if writer is not None:
+                writer.write(chunk)
+            rows += chunk.num_rows
+    except BaseException:
+        if writer is not None:
+            writer.close(commit=False)
+        raise
+    if writer is not None:
+        writer.close(commit=True)
+    return rows, cache_hit
 
 
 @task
-def prepare_psa_online_retails() -> None:
-    """從 raw table 清理資料、產生 Hash Keys 並載入 PSA"""
+@instrumented
+def prepare_psa_online_retails(
+    hash_workers: int = 1,
+    key_format: str = 'uuid',
+    full_refresh: bool = False,
+    lookback_days: int = 7,
+    engine: str = 'pandas',
+    memory_budget_mb: Optional[int] = None,
+    key_index_dir: Optional[str] = None,
+    key_index_fpr: float = DEFAULT_FPR,
+) -> None:
+    """
+    從 raw table 清理資料、產生 Hash Keys 並載入 PSA
+
+    - 預設為增量模式：以 PSA 的 max(InvoiceDate) 往前 lookback_days 天為 watermark，
+      只處理 watermark 之後、RAW_FINGERPRINT 尚未出現在 PSA 的 raw 列並 append 到 PSA
+    - full_refresh=True 時 TRUNCATE PSA 並重建 (修復資料用)
+    - engine='pandas' 在 Python 端清理與計算 Hash Key；engine='clickhouse' 以單一 INSERT ... SELECT
+      在 ClickHouse 內完成，資料不經過 Python，產生的 Hash Key 與 pandas 相同
+    - pandas engine 以 Arrow 格式讀取與寫入，只在清理、Hash Key 與 Pandera 驗證時轉為 DataFrame
+    - pandas engine 指定 memory_budget_mb 時，以 query_arrow_stream 分批讀取 raw 列，
+      每批依預算大小轉換後立即寫入，記錄每批耗時與 peak RSS
+    - pandas engine 指定 key_index_dir 時，以各 hub / link 的磁碟 key 索引標記 KEY_CANDIDATES，
+      vault 載入時略過 key 確定已存在的列 (索引不存在或與 vault 表不一致時先重建)
+    """
+    if engine not in PSA_ENGINES:
+        raise ValueError(f"engine must be one of {PSA_ENGINES}, got {engine!r}")
     logger = get_run_logger()
     logger.info("Preparing data for PSA...")
-    client = ch.get_client()
-    df = client.query_df('SELECT * FROM raw.online_retails')
+    client = ch.get_client('heavy')
+    discarded = _discard_unlogged_rows(client)
+    if discarded:
+        logger.warning(f"Discarded {discarded} PSA rows of an unfinished load (not in raw.psa_load_log), reloading them.")
+    raw_rows = int(client.command('SELECT count() FROM raw.online_retails'))
+    psa_rows, watermark = client.query('SELECT count(), max(InvoiceDate) FROM raw.psa_online_retails').first_row
+    if full_refresh or psa_rows == 0:
+        mode, since, source_sql, parameters = 'full', None, PSA_FULL_SQL, {}
+    else:
+        mode, since = 'incremental', pd.Timestamp(watermark).tz_localize(None) - pd.Timedelta(days=lookback_days)
+        source_sql, parameters = PSA_DELTA_SQL, {'since': since.to_pydatetime()}
+    now = datetime.utcnow()
+    indexes = None
+    if key_index_dir and engine == 'pandas':
+        indexes = vault_loader.open_key_indexes(client, key_index_dir, key_index_fpr)
+    skipped = Counter()
+
+    if engine == 'clickhouse':
+        logger.info(f"PSA {mode} load in ClickHouse: watermark={since}, {raw_rows} raw rows.")
+        if mode == 'full':
+            client.command('TRUNCATE TABLE raw.psa_online_retails')
+            psa_rows = 0
+        client.command(psa_insert_select_sql(source_sql), parameters={**parameters, 'load_datetime': now})
+        total_rows = int(client.command('SELECT count() FROM raw.psa_online_retails'))
+        delta_rows = total_rows - psa_rows
+    elif memory_budget_mb:
+        slice_rows = max(1, memory_budget_mb * 1024 * 1024 // PSA_ROW_BYTES)
+        logger.info(
+            f"PSA {mode} load: watermark={since}, {raw_rows} raw rows, "
+            f"streaming slices of {slice_rows} rows for a {memory_budget_mb} MB budget."
+        )
+        delta_rows = 0
+        if mode == 'full':
+            client.command('TRUNCATE TABLE raw.psa_online_retails')
+            psa_rows = 0
+        slices = _iter_raw_slices(client, source_sql, parameters, slice_rows)
+        for number, (df, read_seconds) in enumerate(slices, start=1):
+            started = time.perf_counter()
+            df_psa = transform_psa(df, now, hash_workers, key_format)
+            if indexes:
+                skipped.update(vault_loader.tag_key_candidates(df_psa, indexes))
+            transform_seconds = time.perf_counter() - started
+            frame_mb = df_psa.memory_usage(deep=True).sum() / 1024 / 1024
+            started = time.perf_counter()
+            ch.insert_frame_arrow(client, 'raw.psa_online_retails', df_psa, decimals=PSA_DECIMAL_COLUMNS)
+            insert_seconds = time.perf_counter() - started
+            delta_rows += len(df_psa)
+            logger.info(
+                f"PSA slice {number}: {len(df_psa)} rows ({frame_mb:.1f} MB), read {read_seconds:.2f}s, "
+                f"transform {transform_seconds:.2f}s, insert {insert_seconds:.2f}s, "
+                f"peak RSS {_format_mb(peak_rss_mb())}."
+            )
+            del df, df_psa
+        total_rows = psa_rows + delta_rows
+    else:
+        df = ch.arrow_to_frame(ch.query_arrow(client, source_sql, parameters))
+        logger.info(f"PSA {mode} load: watermark={since}, {len(df)} of {raw_rows} raw rows to process.")
+        if df.empty:
+            logger.info("No new or changed raw rows, PSA is up to date.")
+            _log_psa_load(client, now, mode, since, raw_rows, 0, psa_rows)
+            return
+        df_psa = transform_psa(df, now, hash_workers, key_format)
+        if indexes:
+            skipped.update(vault_loader.tag_key_candidates(df_psa, indexes))
 
+        # 寫入 PSA
+        logger.info("Writing to raw.psa_online_retails...")
+        if mode == 'full':
+            client.command('TRUNCATE TABLE raw.psa_online_retails')
+            psa_rows = 0
+        ch.insert_frame_arrow(client, 'raw.psa_online_retails', df_psa, decimals=PSA_DECIMAL_COLUMNS)
+        delta_rows = len(df_psa)
+        total_rows = psa_rows + delta_rows
+
+    logger.info(
+        f"{delta_rows} rows inserted into raw.psa_online_retails "
+        f"(delta {delta_rows / max(total_rows, 1):.1%} of {total_rows} PSA rows), "
+        f"peak RSS {_format_mb(peak_rss_mb())}."
+    )
+    if indexes:
+        logger.info("Rows skipped for vault loading by key index: " + ', '.join(
+            f"{table} {rows}/{delta_rows}" for table, rows in skipped.items()
+        ))
+    _log_psa_load(client, now, mode, since, raw_rows, delta_rows, total_rows)
+
+def transform_psa(df: pd.DataFrame, load_datetime: datetime, hash_workers: int = 1, key_format: str = 'uuid') -> pd.DataFrame:
+    """
+    pandas engine：清理 raw 資料並產生 Hash Keys，回傳 PSA_COLUMNS 欄位的 DataFrame
+
+    會直接修改並沿用傳入的 df (不另外複製)；低基數字串欄位轉為 category 以節省記憶體
+    """
     # --- 資料清理與品質保證 ---
     # Pandera schema for PSA cleaning, matching ClickHouse table
+    key_dtype = pd.ArrowDtype(pyarrow.binary(16)) if key_format == 'arrow' else object
     psa_schema = DataFrameSchema({
-        # Hash Keys
-        "hub_invoice_hash_key": Column(str),
-        "hub_product_hash_key": Column(str),
-        "hub_customer_hash_key": Column(str),
-        "hub_time_hash_key": Column(str),
-        "hub_country_hash_key": Column(str),
-        "link_invoice_product_hash_key": Column(str),
-        "link_invoice_customer_hash_key": Column(str),
-        "link_invoice_time_hash_key": Column(str),
-        "link_invoice_country_hash_key": Column(str),
-        "link_customer_country_hash_key": Column(str),
+        # Hash Keys (uuid.UUID、16 bytes binary 或 Arrow fixed_size_binary(16)，見 utilx.hashx.KEY_FORMATS)
+        "hub_invoice_hash_key": Column(key_dtype),
+        "hub_product_hash_key": Column(key_dtype),
+        "hub_customer_hash_key": Column(key_dtype),
+        "hub_time_hash_key": Column(key_dtype),
+        "hub_country_hash_key": Column(key_dtype),
+        "link_invoice_product_hash_key": Column(key_dtype),
+        "link_invoice_customer_hash_key": Column(key_dtype),
+        "link_invoice_time_hash_key": Column(key_dtype),
+        "link_invoice_country_hash_key": Column(key_dtype),
+        "link_customer_country_hash_key": Column(key_dtype),
         # Business Keys & Attributes
         "InvoiceNo": Column(str),
-        "StockCode": Column(str),
+        "StockCode": Column("category"),
         "Description": Column(str, nullable=True),
         "Quantity": Column(int),
         "InvoiceDate": Column(pd.Timestamp),
         "UnitPrice": Column(float),
         "TotalAmount": Column(float),
         "CustomerID": Column("UInt64"),
-        "Country": Column(str),
-        "ReturnStatus": Column(str),
+        "Country": Column("category"),
+        "ReturnStatus": Column("category"),
         # DV2.0 Standard Columns
         "LOAD_DATETIME": Column(pd.Timestamp),
-        "RECORD_SOURCE": Column(str)
+        "RECORD_SOURCE": Column("category"),
+        "RAW_FINGERPRINT": Column("uint64")
     }, strict=True, coerce=True)
 
     # Drop NA and type conversions
     df.dropna(subset=['StockCode', 'InvoiceDate'], inplace=True)
     # 將 CustomerID 的空值填充為 0，代表未知客戶
     df['CustomerID'] = df['CustomerID'].fillna(0)
+    for column in PSA_CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype('category')
 
     # 負值與退貨處理
-    df['ReturnStatus'] = 'Normal'
-    df.loc[(df['InvoiceNo'].str.startswith('C', na=False)) | (df['Quantity'] < 0), 'ReturnStatus'] = 'Return'
+    is_return = df['InvoiceNo'].str.startswith('C', na=False) | (df['Quantity'] < 0)
+    df['ReturnStatus'] = pd.Categorical(np.where(is_return.fillna(False), 'Return', 'Normal'))
     df['InvoiceNo'] = df['InvoiceNo'].str.replace('C', '', regex=False)
 
     # 產生 Hash Keys
-    now = datetime.utcnow()
-    df['LOAD_DATETIME'] = now
-    df['RECORD_SOURCE'] = 'UCI Online Retail II'
-    df['hub_invoice_hash_key'] = generate_hash_key(df, ['InvoiceNo', 'StockCode', 'InvoiceDate'])
-    df['hub_product_hash_key'] = generate_hash_key(df, ['StockCode'])
-    df['hub_customer_hash_key'] = generate_hash_key(df, ['CustomerID'])
-    df['hub_time_hash_key'] = generate_hash_key(df, ['InvoiceDate'])
-    df['hub_country_hash_key'] = generate_hash_key(df, ['Country'])
-    df['link_invoice_product_hash_key'] = generate_hash_key(df, ['hub_invoice_hash_key', 'hub_product_hash_key'])
-    df['link_invoice_customer_hash_key'] = generate_hash_key(df, ['hub_invoice_hash_key', 'hub_customer_hash_key'])
-    df['link_invoice_time_hash_key'] = generate_hash_key(df, ['hub_invoice_hash_key', 'hub_time_hash_key'])
-    df['link_invoice_country_hash_key'] = generate_hash_key(df, ['hub_invoice_hash_key', 'hub_country_hash_key'])
-    df['link_customer_country_hash_key'] = generate_hash_key(df, ['hub_customer_hash_key', 'hub_country_hash_key'])
-
-    psa_cols = [
-        'hub_invoice_hash_key', 'hub_product_hash_key', 'hub_customer_hash_key', 'hub_time_hash_key',
-        'hub_country_hash_key', 'link_invoice_product_hash_key', 'link_invoice_customer_hash_key',
-        'link_invoice_time_hash_key', 'link_invoice_country_hash_key', 'link_customer_country_hash_key',
-        'InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice', 
-        'TotalAmount', 'CustomerID', 'Country', 'ReturnStatus', 'LOAD_DATETIME', 'RECORD_SOURCE'
-    ]
-    df_psa = df[psa_cols]
-    # Validate with pandera
-    df = psa_schema.validate(df_psa)
-
-    # 寫入 PSA
-    logger.info("Writing to raw.psa_online_retails...")
-    client.command('TRUNCATE TABLE raw.psa_online_retails')
-    client.insert_df('raw.psa_online_retails', df_psa)
-    logger.info(f"{len(df_psa)} rows inserted into raw.psa_online_retails.")
+    df['LOAD_DATETIME'] = load_datetime
+    df['RECORD_SOURCE'] = pd.Series(PSA_RECORD_SOURCE, index=df.index, dtype='category')
+    hash_keys = generate_hash_keys(df, PSA_HASH_KEYS, workers=hash_workers, key_format=key_format)
+    for key in PSA_HASH_KEYS:
+        df[key] = hash_keys.pop(key)
+
+    # Validate with pandera (就地轉型，寫入時依欄位名稱對應，順序不影響)
+    psa_schema.validate(df, inplace=True)
+    return df
+
+def _iter_raw_slices(client, sql: str, parameters: dict, slice_rows: int) -> Iterator[Tuple[pd.DataFrame, float]]:
+    """以 query_arrow_stream 讀取 raw 列，合併為 slice_rows 列一批，回傳 (DataFrame, 讀取秒數)"""
+    pending, pending_rows = [], 0
+    started = time.perf_counter()
+    with ch.query_arrow_stream(client, sql, parameters, settings={'max_block_size': slice_rows}) as stream:
+        for batch in stream:
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= slice_rows:
+                yield ch.arrow_to_frame(pyarrow.Table.from_batches(pending)), time.perf_counter() - started
+                pending, pending_rows = [], 0
+                started = time.perf_counter()
+    if pending:
+        yield ch.arrow_to_frame(pyarrow.Table.from_batches(pending)), time.perf_counter() - started
+
+def psa_insert_select_sql(source_sql: str, target: str = 'raw.psa_online_retails') -> str:
+    """
+    clickhouse engine：產生與 transform_psa 相同清理規則的 INSERT ... SELECT
+
+    Hash Key 依 PSA_HASH_KEYS 組出 SHA256 前 16 bytes 的 UUID，組合字串與 pandas 的 astype(str) 相同：
+    InvoiceDate 使用 raw 的原始字串，CustomerID 空值為 0，Link Key 串接 Hub Key 的 UUID 字串
+    """
+    key_text = {
+        'InvoiceNo': 'InvoiceNo',
+        'StockCode': 'StockCode',
+        'InvoiceDate': 'raw_InvoiceDate',
+        'CustomerID': 'toString(CustomerID)',
+        'Country': 'Country',
+    }
+    hash_keys = []
+    for key, columns in PSA_HASH_KEYS.items():
+        parts = [f'toString({c})' if c in PSA_HASH_KEYS else key_text[c] for c in columns]
+        composite = parts[0] if len(parts) == 1 else f"concat({', '.join(parts)})"
+        hash_keys.append(f"toUUID(UUIDNumToString(toFixedString(substring(SHA256({composite}), 1, 16), 16))) AS {key}")
+    hash_keys_sql = ',\n        '.join(hash_keys)
+    return f"""
+INSERT INTO {target} ({', '.join(PSA_COLUMNS)})
+SELECT {', '.join(PSA_COLUMNS)}
+FROM (
+    SELECT
+        ifNull(replaceAll(raw_InvoiceNo, 'C', ''), '') AS InvoiceNo,
+        assumeNotNull(raw_StockCode) AS StockCode,
+        raw_Description AS Description,
+        ifNull(raw_Quantity, 0) AS Quantity,
+        parseDateTime64BestEffort(assumeNotNull(raw_InvoiceDate), 0, 'UTC') AS InvoiceDate,
+        toDecimal64(toString(round(ifNull(raw_UnitPrice, 0), 4)), 4) AS UnitPrice,
+        toDecimal64(toString(round(ifNull(raw_TotalAmount, 0), 4)), 4) AS TotalAmount,
+        ifNull(raw_CustomerID, 0) AS CustomerID,
+        ifNull(raw_Country, '') AS Country,
+        if(startsWith(raw_InvoiceNo, 'C') OR raw_Quantity < 0, 'Return', 'Normal') AS ReturnStatus,
+        {{load_datetime:DateTime64(0, 'UTC')}} AS LOAD_DATETIME,
+        '{PSA_RECORD_SOURCE}' AS RECORD_SOURCE,
+        raw_RAW_FINGERPRINT AS RAW_FINGERPRINT,
+        {hash_keys_sql}
+    FROM (
+        SELECT
+            InvoiceNo AS raw_InvoiceNo, StockCode AS raw_StockCode, Description AS raw_Description,
+            Quantity AS raw_Quantity, InvoiceDate AS raw_InvoiceDate, UnitPrice AS raw_UnitPrice,
+            TotalAmount AS raw_TotalAmount, CustomerID AS raw_CustomerID, Country AS raw_Country,
+            RAW_FINGERPRINT AS raw_RAW_FINGERPRINT
+        FROM ({source_sql})
+        WHERE StockCode IS NOT NULL AND InvoiceDate IS NOT NULL
+    )
+)
+"""
+
+def _discard_unlogged_rows(client) -> int:
+    """
+    刪除 LOAD_DATETIME 晚於 raw.psa_load_log 最近一次紀錄的 PSA 列 (上次載入中途失敗、尚未記錄的批次)，回傳刪除列數
+
+    PSA 先寫入再記錄批次；未記錄的列若保留，增量載入會因 RAW_FINGERPRINT 已存在而略過，vault 依批次載入時也不會讀到
+    """
+    load_datetime = vault_loader.latest_psa_batch(client)
+    if load_datetime is None:
+        return 0  # 沒有紀錄時 vault 會掃描整個 PSA
+    parameters = {'load_datetime': load_datetime}
+    where = "LOAD_DATETIME > {load_datetime:DateTime64(0, 'UTC')}"
+    rows = int(client.command(f'SELECT count() FROM raw.psa_online_retails WHERE {where}', parameters=parameters))
+    if rows:
+        client.command(f'ALTER TABLE raw.psa_online_retails DELETE WHERE {where} SETTINGS mutations_sync = 2',
+                       parameters=parameters)
+    return rows
+
+def _log_psa_load(client, load_datetime, mode: str, watermark, raw_rows: int, delta_rows: int, psa_rows: int) -> None:
+    """記錄每次 PSA 載入的模式、watermark 與增量大小到 raw.psa_load_log"""
+    client.insert(
+        'raw.psa_load_log',
+        [[load_datetime, mode, watermark, raw_rows, delta_rows, psa_rows]],
+        column_names=['LOAD_DATETIME', 'mode', 'watermark', 'raw_rows', 'delta_rows', 'psa_rows'],
+    )
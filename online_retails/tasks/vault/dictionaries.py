@@ -0,0 +1,60 @@
+import os
+from typing import Dict, NamedTuple
+from prefect import task, get_run_logger
+import utilx.clickhouse_client as ch
+from utilx.instrumentation import instrumented
+
+# dictionary 來源查詢使用的唯讀帳號 (只有 ddl/init.sql 的 vault_reader role)，密碼為 CLICKHOUSE_DICTIONARY_PASSWORD；
+# 由 tasks/maintenance/create_dictionary_user.py 建立，dictionary 定義中不需要 pipeline 的帳號密碼
+DICTIONARY_USER = 'dictionary_reader'
+DICTIONARY_ROLE = 'vault_reader'
+
+class DictionarySpec(NamedTuple):
+    """以 vault 表為來源、hash key 查詢屬性的 ClickHouse dictionary"""
+    source: str                  # 來源表 (與 dictionary 在同一個 database)
+    key: str                     # hash key (UUID，使用 complex key layout)
+    attributes: Dict[str, str]   # 屬性欄位與型別
+
+# fact 建置以 dictGet 查詢的小基數屬性，取代對 hub / sat 的 join 與 IN 子查詢
+DICTIONARIES = {
+    # 判斷缺少客戶 ID 的明細 (CustomerID = 0)
+    'dict_customer': DictionarySpec('hub_customer', 'hub_customer_hash_key', {'CustomerID': 'UInt64'}),
+}
+
+def sql_string(value: str) -> str:
+    """ClickHouse 字串常值 (跳脫反斜線與單引號)"""
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def dictionary_ddl(name: str, database: str = 'vault', user: str = DICTIONARY_USER, password: str = None) -> str:
+    """
+    CREATE OR REPLACE DICTIONARY 語法
+
+    來源為同一台 ClickHouse 的本地查詢 (不指定 HOST)，預設以唯讀的 DICTIONARY_USER 讀取 (定義中只有此帳號的密碼，
+    沒有 pipeline 的帳號密碼)；password 預設為 CLICKHOUSE_DICTIONARY_PASSWORD。
+    LIFETIME(0) 不自動重新載入，由 refresh_dictionaries 在 vault 載入後 SYSTEM RELOAD
+    """
+    spec = DICTIONARIES[name]
+    if password is None:
+        password = os.getenv('CLICKHOUSE_DICTIONARY_PASSWORD', '')
+    columns = ',\n        '.join([f'{spec.key} UUID', *(f'{column} {type_}' for column, type_ in spec.attributes.items())])
+    return f"""
+    CREATE OR REPLACE DICTIONARY {database}.{name} (
+        {columns}
+    )
+    PRIMARY KEY {spec.key}
+    SOURCE(CLICKHOUSE(DB '{database}' TABLE '{spec.source}' USER {sql_string(user)} PASSWORD {sql_string(password)}))
+    LAYOUT(COMPLEX_KEY_HASHED())
+    LIFETIME(0)
+    """
+
+@task
+@instrumented
+def refresh_dictionaries():
+    """建立 (或更新定義) 並重新載入所有 vault dictionary"""
+    logger = get_run_logger()
+    client = ch.get_client('heavy')
+    for name in DICTIONARIES:
+        client.command(dictionary_ddl(name))
+        client.command(f"SYSTEM RELOAD DICTIONARY vault.{name}")
+        rows = client.command(f"SELECT element_count FROM system.dictionaries WHERE database = 'vault' AND name = '{name}'")
+        logger.info(f"vault.{name} reloaded: {rows} keys.")
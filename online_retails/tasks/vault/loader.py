@@ -0,0 +1,232 @@
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional
+import numpy as np
+import pandas as pd
+from prefect import task, get_run_logger
+from prefect.cache_policies import NO_CACHE
+from utilx.instrumentation import instrumented
+from utilx.keyindex import DEFAULT_FPR, KeyIndex, to_key_array
+import utilx.clickhouse_client as ch
+
+PSA_TABLE = 'raw.psa_online_retails'
+
+# anti_join: 只讀本次 PSA batch，以 key 去重後 LEFT ANTI JOIN 目標表中同一批 key (走 primary index)
+# not_in: 舊作法，全量掃描 PSA 並以 NOT IN 比對目標表所有 key (保留作為比較與回溯用)
+VAULT_STRATEGIES = ('anti_join', 'not_in')
+
+class VaultSpec(NamedTuple):
+    """hub / link / satellite 的載入定義"""
+    table: str                                # vault.<table>
+    key: str                                  # hash key，去重與判斷是否已載入的依據
+    columns: List[str]                        # key 以外的業務鍵 / hub hash key / 描述屬性
+    expressions: Optional[Dict[str, str]] = None  # 不直接取自 PSA 同名欄位時的 SQL 運算式
+    hashdiff: Optional[str] = None            # satellite 的 PSA Hash Diff 欄位，寫入 HASHDIFF；有值時依屬性變動載入新版本
+
+    def source_columns(self) -> List[str]:
+        """寫入欄位 (含 DV2.0 標準欄位)"""
+        hashdiff = ['HASHDIFF'] if self.hashdiff else []
+        return [self.key, *self.columns, *hashdiff, 'LOAD_DATETIME', 'RECORD_SOURCE']
+
+    def select_list(self) -> str:
+        expressions = {**(self.expressions or {}), **({'HASHDIFF': self.hashdiff} if self.hashdiff else {})}
+        return ', '.join(
+            f'{expressions[column]} AS {column}' if column in expressions else column
+            for column in self.source_columns()
+        )
+
+_EFFECTIVE_FROM = {'EFFECTIVE_FROM': 'LOAD_DATETIME'}
+
+VAULT_SPECS = {spec.table: spec for spec in (
+    # --- Hubs ---
+    VaultSpec('hub_invoice', 'hub_invoice_hash_key', ['InvoiceNo', 'InvoiceDate']),
+    VaultSpec('hub_product', 'hub_product_hash_key', ['StockCode']),
+    VaultSpec('hub_customer', 'hub_customer_hash_key', ['CustomerID']),
+    VaultSpec('hub_time', 'hub_time_hash_key', ['InvoiceDate']),
+    VaultSpec('hub_country', 'hub_country_hash_key', ['Country']),
+    # --- Links ---
+    VaultSpec('link_invoice_product', 'link_invoice_product_hash_key', ['hub_invoice_hash_key', 'hub_product_hash_key']),
+    VaultSpec('link_invoice_customer', 'link_invoice_customer_hash_key', ['hub_invoice_hash_key', 'hub_customer_hash_key']),
+    VaultSpec('link_invoice_time', 'link_invoice_time_hash_key', ['hub_invoice_hash_key', 'hub_time_hash_key']),
+    VaultSpec('link_invoice_country', 'link_invoice_country_hash_key', ['hub_invoice_hash_key', 'hub_country_hash_key']),
+    VaultSpec('link_customer_country', 'link_customer_country_hash_key', ['hub_customer_hash_key', 'hub_country_hash_key']),
+    # --- Satellites ---
+    VaultSpec('sat_invoice', 'hub_invoice_hash_key',
+              ['Quantity', 'UnitPrice', 'TotalAmount', 'ReturnStatus', 'EFFECTIVE_FROM'], _EFFECTIVE_FROM,
+              hashdiff='sat_invoice_hashdiff'),
+    VaultSpec('sat_product', 'hub_product_hash_key', ['Description', 'EFFECTIVE_FROM'], _EFFECTIVE_FROM,
+              hashdiff='sat_product_hashdiff'),
+    # sat_time 的屬性完全由 InvoiceDate (hash key) 決定，不會變動，只需載入新 key
+    VaultSpec('sat_time', 'hub_time_hash_key', ['date', 'year', 'month', 'day_of_week', 'EFFECTIVE_FROM'], {
+        'date': 'toDate(InvoiceDate)',
+        'year': 'toYear(InvoiceDate)',
+        'month': 'toMonth(InvoiceDate)',
+        'day_of_week': 'toDayOfWeek(InvoiceDate)',
+        **_EFFECTIVE_FROM,
+    }),
+)}
+
+# 維護磁碟 key 索引 (utilx.keyindex) 的 hub / link，順序即 PSA KEY_CANDIDATES 的 bit 位置。
+# PSA 以索引確認 key 已載入時清除該 bit，vault 載入 batch 時只讀該 bit 為 1 的列；
+# 未標記的列 (clickhouse engine 或未設定索引) 維持 DDL 預設的全部為 1
+KEY_INDEX_TABLES = [
+    'hub_invoice', 'hub_product', 'hub_customer', 'hub_time', 'hub_country',
+    'link_invoice_product', 'link_invoice_customer', 'link_invoice_time', 'link_invoice_country', 'link_customer_country',
+]
+ALL_KEY_CANDIDATES = 0xFFFF
+
+def vault_insert_sql(
+    spec: VaultSpec,
+    strategy: str = 'anti_join',
+    full_scan: bool = False,
+    source: str = PSA_TABLE,
+    target: str = None,
+) -> str:
+    """
+    產生 spec 的 INSERT ... SELECT
+
+    anti_join 時 full_scan=False 只讀 LOAD_DATETIME = {load_datetime} 的 PSA 列 (需傳入 parameters)；
+    目標表只讀 key IN (本批 key) 的 granule，記憶體與讀取量隨 batch 大小而非 vault 大小成長。
+    KEY_INDEX_TABLES 的表另外略過 PSA 已標記為確定載入 (KEY_CANDIDATES bit 為 0) 的列。
+    有 hashdiff 的 satellite 以 argMax 取每個 key 最新版本的 HASHDIFF，只寫入新 key 或 Hash Diff 不同的列。
+    """
+    if strategy not in VAULT_STRATEGIES:
+        raise ValueError(f"strategy must be one of {VAULT_STRATEGIES}, got {strategy!r}")
+    target = target or f'vault.{spec.table}'
+    columns = ', '.join(spec.source_columns())
+
+    if strategy == 'not_in':
+        return f"""
+        INSERT INTO {target} ({columns})
+        SELECT DISTINCT {spec.select_list()}
+        FROM {source}
+        WHERE {spec.key} NOT IN (SELECT {spec.key} FROM {target})
+        """
+
+    where = '' if full_scan else "WHERE LOAD_DATETIME = {load_datetime:DateTime64(0, 'UTC')}"
+    if not full_scan and spec.table in KEY_INDEX_TABLES:
+        where += f' AND bitTest(KEY_CANDIDATES, {KEY_INDEX_TABLES.index(spec.table)})'
+    # 同一 key 有多列時固定取最新 LOAD_DATETIME、再取最大 Hash Diff，重跑同一 batch 不會誤判為變動
+    order = f'ORDER BY {spec.key}, LOAD_DATETIME DESC, HASHDIFF DESC' if spec.hashdiff else ''
+    if spec.hashdiff:
+        loaded = f"SELECT {spec.key}, argMax(HASHDIFF, EFFECTIVE_FROM) AS HASHDIFF FROM {target}"
+        group_by, using = f'GROUP BY {spec.key}', f'{spec.key}, HASHDIFF'
+    else:
+        loaded = f"SELECT {spec.key} FROM {target}"
+        group_by, using = '', spec.key
+    return f"""
+    INSERT INTO {target} ({columns})
+    WITH batch AS (
+        SELECT {spec.select_list()}
+        FROM {source}
+        {where}
+        {order}
+        LIMIT 1 BY {spec.key}
+    )
+    SELECT {columns}
+    FROM batch
+    LEFT ANTI JOIN (
+        {loaded}
+        WHERE {spec.key} IN (SELECT {spec.key} FROM batch)
+        {group_by}
+    ) AS loaded USING ({using})
+    """
+
+def latest_psa_batch(client) -> Optional[datetime]:
+    """raw.psa_load_log 最近一次 PSA 載入的 LOAD_DATETIME，沒有紀錄時為 None"""
+    loads, load_datetime = client.query('SELECT count(), max(LOAD_DATETIME) FROM raw.psa_load_log').first_row
+    return load_datetime if loads else None
+
+def load_vault_table(spec: VaultSpec, full_scan: bool = False, strategy: str = 'anti_join', key_index_dir: str = None):
+    """依 spec 載入一張 vault 表，回傳寫入列數；指定 key_index_dir 時把本批 key 加入該表的 key 索引"""
+    logger = get_run_logger()
+    logger.info(f"Loading {spec.table}...")
+
+    client = ch.get_client('heavy')
+    parameters = None
+    if strategy == 'anti_join' and not full_scan:
+        load_datetime = latest_psa_batch(client)
+        if load_datetime is None:
+            logger.info("raw.psa_load_log is empty, scanning the whole PSA.")
+            full_scan = True
+        else:
+            parameters = {'load_datetime': load_datetime}
+    index = None
+    if key_index_dir and spec.table in KEY_INDEX_TABLES and parameters:
+        index = KeyIndex(key_index_dir, spec.table)
+        # 索引與目前的表不一致時不更新，交由下次 PSA 重建
+        if not index.exists or index.source_rows != _table_rows(client, spec.table):
+            index = None
+
+    start = time.perf_counter()
+    summary = client.command(vault_insert_sql(spec, strategy, full_scan), parameters=parameters)
+    written = getattr(summary, 'written_rows', None)
+    scope = 'full PSA' if full_scan or strategy == 'not_in' else f"batch {parameters['load_datetime']}"
+    logger.info(f"{spec.table} loaded: {written} new rows from {scope} in {time.perf_counter() - start:.2f}s.")
+
+    if index is not None:
+        batch_keys = list(_iter_keys(
+            client, PSA_TABLE, spec.key,
+            where=f"LOAD_DATETIME = {{load_datetime:DateTime64(0, 'UTC')}} "
+                  f"AND bitTest(KEY_CANDIDATES, {KEY_INDEX_TABLES.index(spec.table)})",
+            parameters=parameters,
+        ))
+        if batch_keys:
+            added = index.add(np.concatenate(batch_keys), _table_rows(client, spec.table))
+            logger.info(f"{spec.table} key index: {added} keys added, {len(index)} keys in total.")
+    return written
+
+def open_key_indexes(client, directory: str, fpr: float = DEFAULT_FPR) -> Dict[str, KeyIndex]:
+    """
+    開啟 KEY_INDEX_TABLES 的 key 索引
+
+    索引不存在、或記錄的列數與目前 vault 表不同 (例如表被重建或以 full scan 載入) 時，由表的所有 key 重建
+    """
+    logger = get_run_logger()
+    indexes = {}
+    for table in KEY_INDEX_TABLES:
+        index = KeyIndex(directory, table, fpr)
+        rows = _table_rows(client, table)
+        if index.source_rows != rows:
+            start = time.perf_counter()
+            index.rebuild(_iter_keys(client, f'vault.{table}', VAULT_SPECS[table].key), rows)
+            logger.info(f"Rebuilt key index {table}: {len(index)} keys in {time.perf_counter() - start:.2f}s.")
+        indexes[table] = index
+    return indexes
+
+def tag_key_candidates(df: pd.DataFrame, indexes: Dict[str, KeyIndex]) -> Dict[str, int]:
+    """
+    以 key 索引設定 PSA 的 KEY_CANDIDATES 欄位 (就地修改 df)
+
+    索引確認已載入的 key 清除對應 bit，回傳各表因此略過的列數
+    """
+    candidates = np.full(len(df), ALL_KEY_CANDIDATES, dtype=np.uint16)
+    skipped = {}
+    for bit, table in enumerate(KEY_INDEX_TABLES):
+        loaded = indexes[table].contains(to_key_array(df[VAULT_SPECS[table].key]))
+        candidates[loaded] &= np.uint16(ALL_KEY_CANDIDATES ^ (1 << bit))
+        skipped[table] = int(loaded.sum())
+    df['KEY_CANDIDATES'] = candidates
+    return skipped
+
+def _table_rows(client, table: str) -> int:
+    return int(client.command(f'SELECT count() FROM vault.{table}'))
+
+def _iter_keys(client, table: str, key: str, where: str = None, parameters: dict = None) -> Iterator[np.ndarray]:
+    """以 RFC 位元組順序 (與 uuid.UUID.bytes 相同) 逐 block 讀取 key"""
+    query = f"SELECT UUIDStringToNum(toString({key})) FROM {table}" + (f" WHERE {where}" if where else '')
+    with ch.query_arrow_stream(client, query, parameters) as stream:
+        for batch in stream:
+            yield to_key_array(batch.column(0))
+
+def vault_task(table: str):
+    """以 VAULT_SPECS[table] 產生 Prefect task (task 名稱即表名)"""
+    spec = VAULT_SPECS[table]
+
+    def load(full_scan: bool = False, strategy: str = 'anti_join', key_index_dir: str = None):
+        return load_vault_table(spec, full_scan=full_scan, strategy=strategy, key_index_dir=key_index_dir)
+
+    load.__name__ = load.__qualname__ = table
+    load.__doc__ = f"從 PSA 載入 vault.{table}"
+    # 各表共用同一段原始碼與相同參數，關閉快取避免不同表算出同一個 cache key
+    return task(instrumented(load, name=table), name=table, cache_policy=NO_CACHE)
@@ -0,0 +1,25 @@
+import os
+import re
+import sys
+from typing import List
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INIT_SQL = os.path.join(ROOT, 'online_retails', 'ddl', 'init.sql')
+
+# pipeline 的 tasks 套件位於 online_retails/ (與 flow.py 的執行目錄相同)
+sys.path.insert(0, os.path.join(ROOT, 'online_retails'))
+
+def init_sql_statements() -> List[str]:
+    """ddl/init.sql 依序的 SQL 語句 (去除 -- 註解)"""
+    with open(INIT_SQL, encoding='utf-8') as f:
+        sql = re.sub(r'--[^\n]*', '', f.read())
+    return [statement.strip() for statement in sql.split(';') if statement.strip()]
+
+@pytest.fixture
+def chdb_session():
+    """嵌入式 ClickHouse (chdb) 的獨立 session；未安裝 chdb 時略過"""
+    session_module = pytest.importorskip('chdb.session')
+    session = session_module.Session()
+    yield session
+    session.close()
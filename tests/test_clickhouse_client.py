@@ -0,0 +1,64 @@
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+import pytest
+import utilx.clickhouse_client as ch
+from utilx.hashx import KEY_FORMATS, generate_hash_key, generate_hash_keys
+
+HASH_KEYS = {
+    'hub_invoice_hash_key': ['InvoiceNo', 'StockCode'],
+    'link_invoice_country_hash_key': ['hub_invoice_hash_key', 'Country'],
+}
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'InvoiceNo': ['489434', '489434', '489435'],
+        'StockCode': ['85048', '79323P', '22041'],
+        'Country': pd.Categorical(['United Kingdom', 'France', 'United Kingdom']),
+        'UnitPrice': [6.95, 17.99, 2.1],
+    })
+
+def expected_keys(frame: pd.DataFrame) -> dict:
+    invoice = generate_hash_key(frame, ['InvoiceNo', 'StockCode'])
+    link = generate_hash_key(frame.assign(hub_invoice_hash_key=invoice.astype(str)), ['hub_invoice_hash_key', 'Country'])
+    return {'hub_invoice_hash_key': list(invoice), 'link_invoice_country_hash_key': list(link)}
+
+@pytest.mark.parametrize('key_format', KEY_FORMATS)
+def test_frame_to_arrow_writes_keys_as_fixed_size_binary(frame, key_format):
+    df = pd.concat([frame, generate_hash_keys(frame, HASH_KEYS, key_format=key_format)], axis=1)
+    table = ch.frame_to_arrow(df, decimals={'UnitPrice': (18, 4)})
+
+    assert table.column_names == list(df.columns)
+    assert pa.types.is_dictionary(table.schema.field('Country').type)
+    assert table.schema.field('UnitPrice').type == pa.decimal128(18, 4)
+    for key, uuids in expected_keys(frame).items():
+        assert table.schema.field(key).type == pa.binary(16)
+        assert table.column(key).to_pylist() == [u.bytes for u in uuids]
+
+def test_frame_to_arrow_keeps_nulls_in_key_columns():
+    key = uuid.uuid4()
+    table = ch.frame_to_arrow(pd.DataFrame({'key': [None, key]}))
+    assert table.schema.field('key').type == pa.binary(16)
+    assert table.column('key').to_pylist() == [None, key.bytes]
+
+def test_frame_to_arrow_leaves_other_bytes_columns_alone():
+    table = ch.frame_to_arrow(pd.DataFrame({'payload': [b'short', b'x' * 20]}))
+    assert table.schema.field('payload').type == pa.binary()
+
+@pytest.mark.parametrize('key_format', KEY_FORMATS)
+def test_keys_parse_as_clickhouse_uuid(tmp_path, frame, key_format):
+    """以 ClickHouse 的 Arrow input format 讀入 UUID 欄位 (與 insert_arrow 寫入時相同)，值與 uuid.UUID 一致"""
+    chdb = pytest.importorskip('chdb')
+    df = generate_hash_keys(frame, HASH_KEYS, key_format=key_format)
+    path = str(tmp_path / 'keys.arrow')
+    table = ch.frame_to_arrow(df)
+    with pa.ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+
+    structure = ', '.join(f'{key} UUID' for key in HASH_KEYS)
+    result = chdb.query(f"SELECT * FROM file('{path}', 'Arrow', '{structure}')", 'CSV').bytes().decode()
+    rows = [line.replace('"', '').split(',') for line in result.splitlines()]
+    expected = expected_keys(frame)
+    assert rows == [[str(expected[key][i]) for key in HASH_KEYS] for i in range(len(frame))]
@@ -0,0 +1,32 @@
+import pytest
+from tasks.vault import dictionaries
+
+PASSWORDS = ['plain', "it's", 'back\\slash', "trailing\\", "\\'mixed\\\\'"]
+
+@pytest.fixture
+def session():
+    chdb = pytest.importorskip('chdb.session')
+    session = chdb.Session()
+    yield session
+    session.close()
+
+@pytest.mark.parametrize('value', PASSWORDS)
+def test_sql_string_round_trips(session, value):
+    result = session.query(f"SELECT hex({dictionaries.sql_string(value)})", 'CSV').bytes().decode().strip().strip('"')
+    assert bytes.fromhex(result).decode() == value
+
+def test_dictionary_ddl_uses_the_dictionary_reader(monkeypatch):
+    monkeypatch.setenv('CLICKHOUSE_DICTIONARY_PASSWORD', 'back\\slash')
+    monkeypatch.setenv('CLICKHOUSE_PASSWORD', 'pipeline-secret')
+    ddl = dictionaries.dictionary_ddl('dict_customer')
+    assert "USER 'dictionary_reader' PASSWORD 'back\\\\slash'" in ddl
+    assert 'pipeline-secret' not in ddl
+
+@pytest.mark.parametrize('password', PASSWORDS)
+def test_dictionary_ddl_parses(session, password):
+    session.query("CREATE DATABASE IF NOT EXISTS vault")
+    session.query("CREATE TABLE IF NOT EXISTS vault.hub_customer (hub_customer_hash_key UUID, CustomerID UInt64) "
+                  "ENGINE = MergeTree ORDER BY hub_customer_hash_key")
+    session.query(dictionaries.dictionary_ddl('dict_customer', password=password))
+    names = session.query("SELECT name FROM system.dictionaries WHERE database = 'vault'", 'CSV').bytes().decode()
+    assert 'dict_customer' in names
@@ -0,0 +1,73 @@
+import os
+import pytest
+import requests
+from utilx import downloader
+
+DATA = bytes(range(256)) * 4096
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: bytes = b''):
+        self.status_code = status_code
+        self.reason = 'fake'
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+class FakeSession:
+    """依序回應 statuses 中的狀態，之後以 206 回傳 Range 指定的區段"""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = 0
+
+    def get(self, url, headers, stream, timeout):
+        self.requests += 1
+        if self.statuses:
+            return FakeResponse(self.statuses.pop(0))
+        start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+        return FakeResponse(206, DATA[start:end + 1])
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader.time, 'sleep', lambda seconds: None)
+
+def download_ranges(tmp_path, session, retries=3):
+    part = str(tmp_path / 'data.part')
+    downloaded = downloader._download_ranges(session, 'http://example', part, len(DATA), '"etag"', 1, 1, retries)
+    return part, downloaded
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_transient_status_is_retried(tmp_path, status):
+    session = FakeSession([status, status])
+    part, downloaded = download_ranges(tmp_path, session)
+    assert downloaded == len(DATA)
+    assert open(part, 'rb').read() == DATA
+    assert session.requests == 3
+
+def test_transient_status_gives_up_after_retries(tmp_path):
+    session = FakeSession([503] * 3)
+    with pytest.raises(downloader.TransientHTTPError):
+        download_ranges(tmp_path, session, retries=2)
+    assert session.requests == 3
+
+@pytest.mark.parametrize('status', [404, 200])
+def test_client_error_or_ignored_range_fails_immediately(tmp_path, status):
+    session = FakeSession([status])
+    with pytest.raises(requests.HTTPError):
+        download_ranges(tmp_path, session)
+    assert session.requests == 1
+
+def test_progress_only_covers_checkpointed_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, 'CHECKPOINT_BYTES', 2 * downloader.CHUNK_BYTES)
+    part, _ = download_ranges(tmp_path, FakeSession())
+    progress = downloader._read_json(downloader._progress_path(part))
+    assert progress['segments'] == [[0, len(DATA) - 1, len(DATA)]]
+    assert os.path.getsize(part) == len(DATA)
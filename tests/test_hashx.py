@@ -0,0 +1,67 @@
+import uuid
+import numpy as np
+import pandas as pd
+import pytest
+from utilx.hashx import KEY_FORMATS, generate_hash_key, generate_hash_keys
+
+# 與 PSA_HASH_KEYS 相同的組成方式：hub key 由原始欄位組成 (含 NaN 與數值欄位)，link key 由先前的 hub key 組成
+HASH_KEYS = {
+    'hub_invoice_hash_key': ['InvoiceNo', 'StockCode', 'InvoiceDate'],
+    'hub_customer_hash_key': ['CustomerID'],
+    'hub_country_hash_key': ['Country'],
+    'link_invoice_customer_hash_key': ['hub_invoice_hash_key', 'hub_customer_hash_key'],
+    'link_customer_country_hash_key': ['hub_customer_hash_key', 'hub_country_hash_key'],
+    'mixed_hash_key': ['hub_country_hash_key', 'Country'],
+}
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'InvoiceNo': ['489434', '489434', '489435', '581587', 'C489449'],
+        'StockCode': ['85048', '79323P', '22041', '23256', '22087'],
+        'InvoiceDate': ['2009-12-01 07:45:00', '2009-12-01 07:45:00', '2009-12-01 07:46:00',
+                        '2011-12-09 12:50:00', '2009-12-01 10:33:00'],
+        'CustomerID': [13085, 13085, 0, 12680, 16321],
+        'Country': ['United Kingdom', 'United Kingdom', 'EIRE', 'France', 'Australia'],
+    })
+
+def legacy_keys(frame: pd.DataFrame) -> pd.DataFrame:
+    """逐列以 generate_hash_key 計算，link key 引用 hub key 的 UUID 字串 (原本 PSA 的作法)"""
+    df = frame.copy()
+    for key, columns in HASH_KEYS.items():
+        df[key] = generate_hash_key(df, columns)
+        df[key] = df[key].astype(str)
+    return df[list(HASH_KEYS)].apply(lambda column: column.map(uuid.UUID))
+
+def as_uuids(keys: pd.DataFrame) -> pd.DataFrame:
+    return keys.apply(lambda column: column.map(lambda value: uuid.UUID(bytes=bytes(value))
+                                                if not isinstance(value, uuid.UUID) else value))
+
+@pytest.mark.parametrize('key_format', KEY_FORMATS)
+def test_keys_match_legacy_generate_hash_key(frame, key_format):
+    keys = generate_hash_keys(frame, HASH_KEYS, key_format=key_format)
+    pd.testing.assert_frame_equal(as_uuids(keys).astype(object), legacy_keys(frame).astype(object))
+
+@pytest.mark.parametrize('key_format', KEY_FORMATS)
+def test_blocks_and_workers_do_not_change_keys(frame, key_format):
+    frame = pd.concat([frame] * 7, ignore_index=True)
+    expected = as_uuids(generate_hash_keys(frame, HASH_KEYS, key_format=key_format))
+    for block_size, workers in ((2, 1), (3, 2)):
+        keys = generate_hash_keys(frame, HASH_KEYS, workers=workers, block_size=block_size, key_format=key_format)
+        pd.testing.assert_frame_equal(as_uuids(keys), expected)
+
+def test_formats_carry_the_same_bytes(frame):
+    keys = {key_format: generate_hash_keys(frame, HASH_KEYS, key_format=key_format) for key_format in KEY_FORMATS}
+    for key in HASH_KEYS:
+        raw = [value.bytes for value in keys['uuid'][key]]
+        assert list(keys['binary'][key]) == raw
+        assert [bytes(value) for value in keys['arrow'][key]] == raw
+
+def test_keeps_index(frame):
+    frame.index = np.arange(10, 10 + len(frame))
+    keys = generate_hash_keys(frame, HASH_KEYS, key_format='arrow')
+    assert list(keys.index) == list(frame.index)
+
+def test_rejects_unknown_format(frame):
+    with pytest.raises(ValueError):
+        generate_hash_keys(frame, HASH_KEYS, key_format='hex')
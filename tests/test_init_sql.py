@@ -0,0 +1,70 @@
+import re
+import pytest
+from tests.conftest import init_sql_statements
+from tasks.maintenance import migrate_quality_rules, migrate_sales_rollup
+from tasks.mart.build_rollup_table import SALES_DAILY_ROLLUP_SQL
+
+# 嵌入式 ClickHouse 沒有 access management，帳號 / role / 權限的語句只在 ClickHouse Server 上執行
+ACCESS_STATEMENT = re.compile(r'^(CREATE (USER|ROLE)|GRANT)\b', re.IGNORECASE)
+
+FACT_SALES_SQL = """
+INSERT INTO marts.Fact_Sales
+SELECT
+    generateUUIDv4(), toString(number), toDate('2024-01-30') + number % 5,
+    toUUID('00000000-0000-0000-0000-00000000000' || toString(number % 3)),
+    generateUUIDv4(), toYYYYMMDD(toDate('2024-01-30') + number % 5),
+    toUUID('00000000-0000-0000-0000-0000000000a' || toString(number % 2)),
+    toInt32(number % 7 + 1), toDecimal64((number % 13) / 4, 4), toDecimal64((number % 7 + 1) * (number % 13) / 4, 4)
+FROM numbers(1000)
+"""
+
+def rows(session, sql):
+    return [line.split('\t') for line in session.query(sql, 'TSV').bytes().decode().splitlines()]
+
+@pytest.fixture
+def initialized(chdb_session):
+    """依序執行 init.sql 的所有語句 (access management 除外)"""
+    for statement in init_sql_statements():
+        if not ACCESS_STATEMENT.match(statement):
+            chdb_session.query(statement)
+    return chdb_session
+
+def test_only_access_statements_are_skipped():
+    skipped = [statement for statement in init_sql_statements() if ACCESS_STATEMENT.match(statement)]
+    assert skipped == ['CREATE ROLE IF NOT EXISTS vault_reader', 'GRANT SELECT ON vault.* TO vault_reader']
+
+def test_init_sql_runs_twice(initialized):
+    for statement in init_sql_statements():
+        if not ACCESS_STATEMENT.match(statement):
+            initialized.query(statement)
+    tables = rows(initialized, "SELECT database || '.' || name FROM system.tables "
+                               "WHERE database IN ('raw', 'vault', 'marts', 'quality') ORDER BY 1")
+    for table in ('raw.psa_load_log', 'marts.build_log', 'marts.Sales_Daily_Rollup',
+                  'quality.sales_summary', 'quality.data_quality', 'quality.pipeline_perf'):
+        assert [table] in tables
+
+def test_sales_summary_matches_fact_sales(initialized):
+    initialized.query(FACT_SALES_SQL)
+    initialized.query("INSERT INTO marts.Sales_Daily_Rollup "
+                      + SALES_DAILY_ROLLUP_SQL.replace('{months:Array(UInt32)}', '[202401, 202402]'))
+    summary = rows(initialized, """
+        SELECT sales_date, min_total_amount, max_total_amount, round(avg_total_amount, 6), volume
+        FROM quality.sales_summary ORDER BY sales_date""")
+    expected = rows(initialized, """
+        SELECT invoice_date, toFloat64(min(total_amount)), toFloat64(max(total_amount)),
+               round(toFloat64(sum(total_amount)) / count(), 6), toFloat64(sum(total_amount))
+        FROM marts.Fact_Sales GROUP BY invoice_date ORDER BY invoice_date""")
+    assert len(summary) == 5
+    assert summary == expected
+
+@pytest.mark.parametrize('view_sql', [
+    migrate_sales_rollup.SALES_SUMMARY_VIEW_SQL,
+    migrate_quality_rules.DATA_QUALITY_VIEW_SQL,
+    migrate_quality_rules.DATA_QUALITY_BATCHES_VIEW_SQL,
+])
+def test_migration_views_match_init_sql(initialized, view_sql):
+    name = re.search(r'VIEW (\S+) AS', view_sql).group(1)
+    before = rows(initialized, f"SHOW CREATE TABLE {name}")
+    initialized.query(f"DROP VIEW {name}")
+    initialized.query(view_sql.replace('CREATE OR REPLACE VIEW', 'CREATE VIEW'))
+    assert rows(initialized, f"SHOW CREATE TABLE {name}") == before
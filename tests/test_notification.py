@@ -0,0 +1,46 @@
+import json
+import logging
+from types import SimpleNamespace
+import pytest
+from tasks.metrics import notification
+
+class ChdbClient:
+    """以 chdb session 回答 latest_values 的查詢 (只需要 first_row)"""
+    def __init__(self, session):
+        self.session = session
+
+    def query(self, sql):
+        result = self.session.query(f"SELECT * FROM ({sql}) FORMAT JSONCompact").bytes()
+        return SimpleNamespace(first_row=json.loads(result)['data'][0])
+
+@pytest.fixture
+def client(chdb_session):
+    chdb_session.query("CREATE DATABASE IF NOT EXISTS quality")
+    chdb_session.query("CREATE TABLE quality.data_quality (check_date DateTime, anomaly_unit_price_count UInt64, "
+                       "anomaly_quantity_count UInt64, missing_customer_id_ratio Float64) ENGINE = Memory")
+    chdb_session.query("INSERT INTO quality.data_quality VALUES ('2024-01-01 00:00:00', 9, 9, 0.9), "
+                       "('2024-01-02 00:00:00', 3, 4, 0.25)")
+    chdb_session.query("CREATE TABLE quality.sales_summary (sales_date Date, min_total_amount Float64, "
+                       "max_total_amount Float64, median_total_amount Float64, avg_total_amount Float64, "
+                       "volume Float64) ENGINE = Memory")
+    return ChdbClient(chdb_session)
+
+def test_latest_values_skips_sources_without_rows(client):
+    values = notification.latest_values(client, notification.METRICS)
+    assert values == {'anomaly_unit_price_count': 3, 'anomaly_quantity_count': 4, 'missing_customer_id_ratio': 0.25}
+
+def test_publish_metrics_pushes_one_job_per_metric(client, monkeypatch):
+    client.session.query("INSERT INTO quality.sales_summary VALUES ('2024-01-02', 1, 5, 2, 2.5, 100)")
+    pushed = []
+    monkeypatch.setattr(notification.ch, 'get_client', lambda name: client)
+    monkeypatch.setattr(notification, 'get_run_logger', lambda: logging.getLogger(__name__))
+    monkeypatch.setattr(notification.push_to_prometheus, 'push_gauges', lambda job, samples: pushed.append((job, samples)))
+    monkeypatch.setattr(notification.instrumentation, 'record', lambda stats: None)
+
+    notification.publish_metrics.fn()
+
+    # 與原本逐一推送相同：job 即指標名稱、沒有額外的 label
+    assert [job for job, _ in pushed] == [metric.name for metric in notification.METRICS]
+    for job, samples in pushed:
+        assert [(name, labels) for name, _, labels, _ in samples] == [(job, {})]
+    assert dict((job, samples[0][3]) for job, samples in pushed)['latest_sales_volume'] == 100
@@ -0,0 +1,24 @@
+from tests.conftest import init_sql_statements
+
+RESULTS_SQL = """
+INSERT INTO quality.rule_results VALUES
+    ('2024-01-02', '2024-01-02 01:00:00', 'missing_customer_id_ratio', 'null_ratio', 'fact_lines', 0.30, 30, 100, []),
+    ('2024-01-02', '2024-01-02 01:00:00', 'anomaly_unit_price_count', 'threshold_count', 'fact_lines', 5, 5, 100, []),
+    ('2024-01-02', '2024-01-02 01:00:00', 'anomaly_quantity_count', 'threshold_count', 'fact_lines', 2, 2, 100, []),
+    ('2024-01-02', '2024-01-02 02:00:00', 'missing_customer_id_ratio', 'null_ratio', 'fact_lines', 0.90, 9, 10, [202312]),
+    ('2024-01-02', '2024-01-02 02:00:00', 'anomaly_unit_price_count', 'threshold_count', 'fact_lines', 1, 1, 10, [202312]),
+    ('2024-01-02', '2024-01-02 02:00:00', 'anomaly_quantity_count', 'threshold_count', 'fact_lines', 0, 0, 10, [202312])
+"""
+
+def rows(session, sql):
+    return [line.split('\t') for line in session.query(sql, 'TSV').bytes().decode().splitlines()]
+
+def test_daily_metrics_only_use_full_checks(chdb_session):
+    for statement in init_sql_statements():
+        if statement.startswith('CREATE DATABASE IF NOT EXISTS quality') or 'quality.rule_results' in statement:
+            chdb_session.query(statement)
+    chdb_session.query(RESULTS_SQL)
+
+    assert rows(chdb_session, "SELECT * FROM quality.data_quality") == [['2024-01-02', '0.3', '5', '2']]
+    assert rows(chdb_session, "SELECT * FROM quality.data_quality_batches") == [
+        ['2024-01-02 02:00:00', '[202312]', '0.9', '1', '0']]
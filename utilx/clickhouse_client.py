@@ -1,16 +1,249 @@
 import clickhouse_connect
 import os
+import threading
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+from clickhouse_connect.driver.httputil import get_pool_manager
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dotenv import load_dotenv
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-def get_client():
+# 各 workload 的 ClickHouse settings，get_client(profile) 時套用為該 client 每個查詢的預設值。
+# 可用環境變數 CLICKHOUSE_<PROFILE>_<SETTING> 覆寫，例如 CLICKHOUSE_HEAVY_MAX_MEMORY_USAGE=8000000000
+SETTING_PROFILES = {
+    'default': {},
+    # PSA / vault / mart 的大量 INSERT ... SELECT
+    'heavy': {
+        'max_threads': 0,
+        'max_memory_usage': 10_000_000_000,
+        'max_insert_block_size': 1_048_576,
+        'min_insert_block_size_rows': 1_048_576,
+        'max_execution_time': 3600,
+    },
+    # 監控指標等小型讀取
+    'metrics': {
+        'max_threads': 2,
+        'max_memory_usage': 1_000_000_000,
+        'max_execution_time': 30,
+    },
+}
+
+# 距離上次健康檢查超過此秒數時，取得 client 前先 ping，失敗則重建 client
+HEALTH_CHECK_SECONDS = 30
+
+_lock = threading.Lock()
+_pid = None
+_pool = None
+_clients: Dict[str, object] = {}
+_checked_at: Dict[str, float] = {}
+
+def get_client(profile: str = 'default'):
     """
-    Create and return a ClickHouse client using environment variables for configuration.
+    取得指定 setting profile 的 ClickHouse client (連線設定來自環境變數)。
+
+    同一 process 內相同 profile 共用同一個 client，所有 client 共用一個 HTTP connection pool
+    (大小為 CLICKHOUSE_POOL_SIZE)，不使用 session，可在並行的 Prefect task 之間安全共用。
+    傳輸壓縮由 CLICKHOUSE_COMPRESSION 指定 (lz4 / zstd / none)。
+    fork 出的子 process (例如 ProcessPoolExecutor worker) 會建立自己的 pool。
+    在 tagged_queries 範圍內取得的 client 會為每個查詢加上 query_id 並記錄 (見 tagged_queries)。
     """
-    load_dotenv()
-    client = clickhouse_connect.get_client(
+    global _pid, _pool
+    if profile not in SETTING_PROFILES:
+        raise ValueError(f"profile must be one of {tuple(SETTING_PROFILES)}, got {profile!r}")
+    with _lock:
+        if _pid != os.getpid():
+            load_dotenv()
+            _pid = os.getpid()
+            _pool = get_pool_manager(maxsize=int(os.getenv('CLICKHOUSE_POOL_SIZE', 8)), block=True)
+            _clients.clear()
+            _checked_at.clear()
+
+        client = _clients.get(profile)
+        if client is not None and time.monotonic() - _checked_at[profile] >= HEALTH_CHECK_SECONDS:
+            if not health_check(client):
+                client.close_connections()
+                client = None
+            else:
+                _checked_at[profile] = time.monotonic()
+        if client is None:
+            client = _create_client(profile)
+            _clients[profile] = client
+            _checked_at[profile] = time.monotonic()
+    tag = _query_tag.get()
+    return client if tag is None else _TaggedClient(client, tag)
+
+def health_check(client) -> bool:
+    """以 ping 確認 ClickHouse 可連線"""
+    try:
+        return bool(client.ping())
+    except Exception:
+        return False
+
+def profile_settings(profile: str) -> dict:
+    """profile 的 settings，套用 CLICKHOUSE_<PROFILE>_<SETTING> 環境變數覆寫"""
+    settings = {}
+    for name, value in SETTING_PROFILES[profile].items():
+        override = os.getenv(f"CLICKHOUSE_{profile}_{name}".upper())
+        settings[name] = type(value)(override) if override else value
+    return settings
+
+def reset() -> None:
+    """關閉並清除此 process 的 client 與 connection pool"""
+    global _pid, _pool
+    with _lock:
+        for client in _clients.values():
+            client.close_connections()
+        _clients.clear()
+        _checked_at.clear()
+        _pid = _pool = None
+
+def _create_client(profile: str):
+    compression = os.getenv('CLICKHOUSE_COMPRESSION', 'lz4').lower()
+    return clickhouse_connect.get_client(
         host=os.getenv('CLICKHOUSE_HOST', 'localhost'),
         port=int(os.getenv('CLICKHOUSE_PORT', 8123)),
         user=os.getenv('CLICKHOUSE_USER', 'default'),
-        password=os.getenv('CLICKHOUSE_PASSWORD', '')
+        password=os.getenv('CLICKHOUSE_PASSWORD', ''),
+        compress=False if compression in ('', 'none', 'false') else compression,
+        settings=profile_settings(profile),
+        pool_mgr=_pool,
+        autogenerate_session_id=False,
     )
-    return client
+
+# --- 查詢標記 ---
+# 所有 pipeline 查詢的 query_id 為 <QUERY_ID_PREFIX>:<tag>:<uuid>，可依 tag (task) 前綴從 system.query_log 取回統計
+
+QUERY_ID_PREFIX = 'online_retails'
+
+# 會送出查詢、接受 settings 參數的 client 方法
+_TAGGED_METHODS = frozenset({
+    'command', 'query', 'query_df', 'query_arrow', 'query_arrow_stream', 'query_df_stream',
+    'insert', 'insert_df', 'insert_arrow', 'raw_query', 'raw_insert',
+})
+
+class TaggedQuery(NamedTuple):
+    query_id: str
+    summary: Optional[dict]   # X-ClickHouse-Summary (read_rows / written_rows ...)，串流查詢沒有
+
+_query_tag: ContextVar[Optional[Tuple[str, List[TaggedQuery]]]] = ContextVar('query_tag', default=None)
+
+def query_id_prefix(tag: str) -> str:
+    return f'{QUERY_ID_PREFIX}:{tag}:'
+
+@contextmanager
+def tagged_queries(tag: str) -> Iterator[List[TaggedQuery]]:
+    """
+    範圍內 (同一個 thread / context) 以 get_client 取得的 client，每個查詢的 query_id 以 query_id_prefix(tag) 開頭，
+    並記錄於 yield 的 list (query_id 與 ClickHouse 回傳的 summary)
+    """
+    queries: List[TaggedQuery] = []
+    token = _query_tag.set((tag, queries))
+    try:
+        yield queries
+    finally:
+        _query_tag.reset(token)
+
+class _TaggedClient:
+    """轉送到共用 client，查詢方法加上 query_id 並記錄 summary；其餘屬性直接取自共用 client"""
+
+    def __init__(self, client, tag: Tuple[str, List[TaggedQuery]]):
+        self._client = client
+        self._tag = tag
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in _TAGGED_METHODS:
+            return attribute
+
+        def tagged(*args, settings: dict = None, **kwargs):
+            tag, queries = self._tag
+            query_id = f'{query_id_prefix(tag)}{uuid.uuid4().hex}'
+            result = attribute(*args, settings={**(settings or {}), 'query_id': query_id}, **kwargs)
+            summary = getattr(result, 'summary', None)
+            queries.append(TaggedQuery(query_id, summary if isinstance(summary, dict) else None))
+            return result
+        return tagged
+
+# --- Arrow 傳輸 ---
+# 查詢與寫入都以 ClickHouse 的 Arrow / ArrowStream 格式傳送 (HTTP 傳輸壓縮)，
+# 欄位以 Arrow buffer 整批轉換，不經過 insert_df / query_df 的逐值 Python 物件轉換。
+
+_NULLABLE_INTEGER_DTYPES = {
+    pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(), pa.uint16(): pd.UInt16Dtype(), pa.uint32(): pd.UInt32Dtype(), pa.uint64(): pd.UInt64Dtype(),
+}
+
+def query_arrow(client, query: str, parameters: dict = None, settings: dict = None) -> pa.Table:
+    """查詢結果為 pyarrow.Table，字串欄位維持 Arrow string"""
+    return client.query_arrow(query, parameters=parameters, settings=settings, use_strings=True)
+
+def query_arrow_stream(client, query: str, parameters: dict = None, settings: dict = None):
+    """逐 block 回傳 pyarrow.RecordBatch 的 StreamContext (以 with 使用)"""
+    return client.query_arrow_stream(query, parameters=parameters, settings=settings, use_strings=True)
+
+def arrow_to_frame(table: pa.Table) -> pd.DataFrame:
+    """
+    Arrow 轉為 DataFrame (pandas 只用在需要 Pandera / pandas 運算的地方)
+
+    整數欄位轉為 pandas nullable 整數 (Int32 / UInt64 ...)，含 NULL 時不會變成 float64，
+    與 query_df 的 extended dtypes 相同
+    """
+    return table.to_pandas(types_mapper=_NULLABLE_INTEGER_DTYPES.get)
+
+def insert_arrow(client, table: str, data: pa.Table, settings: dict = None):
+    """以 Arrow 格式寫入，欄位依名稱對應，型態由 ClickHouse 轉換 (例如 int64 -> Nullable(Int32))"""
+    return client.insert_arrow(table, data, settings=settings)
+
+def frame_to_arrow(df: pd.DataFrame, schema: pa.Schema = None, decimals: Dict[str, Tuple[int, int]] = None) -> pa.Table:
+    """
+    DataFrame 轉為可寫入 ClickHouse 的 pyarrow.Table
+
+    category 欄位轉為 dictionary (對應 LowCardinality)，pd.ArrowDtype 欄位零複製沿用；
+    未指定 schema 時，uuid.UUID 或 16 bytes 的 bytes 物件欄位 (utilx.hashx 的 key_format='uuid' / 'binary')
+    轉為 fixed_size_binary(16) 寫入 UUID 欄位 (pyarrow 無法推斷 uuid.UUID，bytes 會被推斷為 String)；
+    Arrow extension 型態 (例如 arrow.uuid) 改用其 storage。
+    decimals 指定 {欄位: (precision, scale)} 的 float 欄位先在 Arrow 端四捨五入為 decimal128，
+    避免 ClickHouse 以 float 直接轉 Decimal 時的截斷誤差 (例如 17.99 -> 17.9899)
+    """
+    keys = {} if schema is not None else {
+        name: pa.array([getattr(value, 'bytes', value) for value in df[name]], type=pa.binary(16))
+        for name in df.columns if _is_key_column(df[name])
+    }
+    others = [name for name in df.columns if name not in keys]
+    if others or not keys:
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False, columns=others if keys else None)
+        for name, column in keys.items():
+            table = table.append_column(pa.field(name, column.type), column)
+    else:
+        table = pa.table(keys)
+    if keys:
+        table = table.select([str(name) for name in df.columns])
+    for i, field in enumerate(table.schema):
+        if decimals and field.name in decimals:
+            decimal_type = pa.decimal128(*decimals[field.name])
+            table = table.set_column(i, pa.field(field.name, decimal_type, field.nullable), table.column(i).cast(decimal_type))
+        elif isinstance(field.type, pa.ExtensionType):
+            column = pa.chunked_array([chunk.storage for chunk in table.column(i).chunks], type=field.type.storage_type)
+            table = table.set_column(i, pa.field(field.name, field.type.storage_type, field.nullable), column)
+    return table.replace_schema_metadata(None)
+
+def _is_key_column(series: pd.Series) -> bool:
+    """object 欄位的第一個非空值為 uuid.UUID 或 16 bytes 的 bytes"""
+    if series.dtype != object:
+        return False
+    value = next((value for value in series if value is not None and value == value), None)
+    return isinstance(value, uuid.UUID) or (isinstance(value, bytes) and len(value) == 16)
+
+def insert_frame_arrow(
+    client,
+    table: str,
+    df: pd.DataFrame,
+    schema: pa.Schema = None,
+    decimals: Dict[str, Tuple[int, int]] = None,
+    settings: dict = None,
+):
+    """DataFrame 經 frame_to_arrow 後以 Arrow 格式寫入"""
+    return insert_arrow(client, table, frame_to_arrow(df, schema, decimals), settings=settings)
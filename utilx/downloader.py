@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+import requests
+
+# 每次寫入磁碟的大小
+CHUNK_BYTES = 1024 * 1024
+# 續傳進度的檢查點間隔：每寫入此大小先 fsync 資料，再更新進度檔
+CHECKPOINT_BYTES = 16 * CHUNK_BYTES
+
+@dataclass
+class DownloadResult:
+    """下載結果；not_modified=True 表示來源未變更，沿用既有的 path"""
+    path: str
+    sha256: str
+    not_modified: bool
+    bytes_downloaded: int
+    seconds: float
+
+    @property
+    def throughput_mb_s(self) -> float:
+        return self.bytes_downloaded / 1e6 / self.seconds if self.seconds else 0.0
+
+class ChecksumMismatch(Exception):
+    pass
+
+class TransientHTTPError(requests.HTTPError):
+    """可重試的 HTTP 狀態 (429 / 5xx)，與連線錯誤同樣以指數退避重試"""
+
+# 連線錯誤與暫時性的 HTTP 狀態重試；其他 4xx 或伺服器忽略 Range 時立即失敗
+RETRIABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, TransientHTTPError)
+
+def _raise_for_transient_status(response: requests.Response) -> None:
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientHTTPError(f"{response.status_code} {response.reason}", response=response)
+
+def download(
+    url: str,
+    dest: str,
+    segments: int = 1,
+    timeout: float = 60,
+    retries: int = 3,
+    conditional: bool = True,
+    expected_sha256: Optional[str] = None,
+) -> DownloadResult:
+    """
+    串流下載 url 到 dest。
+
+    - 中斷時保留 <dest>.part 與進度檔，下次呼叫以 HTTP Range 從中斷處續傳 (ETag 改變時重新下載)
+    - 伺服器支援 Range 且 segments > 1 時，以多個連線平行下載不同區段
+    - conditional=True 且 dest 已存在時帶上 If-None-Match / If-Modified-Since，
+      伺服器回應 304 時不下載並回傳 not_modified=True
+    - 完成後計算 SHA256，若指定 expected_sha256 則比對，不符時拋出 ChecksumMismatch
+    """
+    started = time.perf_counter()
+    meta = _read_json(_meta_path(dest)) if os.path.exists(dest) else None
+    session = requests.Session()
+
+    headers = {}
+    if conditional and meta:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    head = session.head(url, headers=headers, timeout=timeout, allow_redirects=True)
+    if head.status_code == 304:
+        return DownloadResult(dest, meta['sha256'], True, 0, time.perf_counter() - started)
+    if head.ok:
+        etag = head.headers.get('ETag')
+        last_modified = head.headers.get('Last-Modified')
+        size = int(head.headers['Content-Length']) if 'Content-Length' in head.headers else None
+        ranged = head.headers.get('Accept-Ranges', '').lower() == 'bytes' and bool(size)
+    else:
+        # 不支援 HEAD 的伺服器：改用單一連線完整下載
+        etag = last_modified = size = None
+        ranged = False
+
+    part = f"{dest}.part"
+    os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+    if ranged:
+        downloaded = _download_ranges(session, url, part, size, etag, max(1, segments), timeout, retries)
+    else:
+        downloaded = _download_stream(session, url, part, timeout, retries, headers)
+        if downloaded is None:
+            # HEAD 失敗但 GET 回應 304
+            return DownloadResult(dest, meta['sha256'], True, 0, time.perf_counter() - started)
+
+    sha256 = file_sha256(part)
+    if expected_sha256 and sha256 != expected_sha256.lower():
+        os.remove(part)
+        raise ChecksumMismatch(f"{url}: expected sha256 {expected_sha256}, got {sha256}")
+
+    os.replace(part, dest)
+    _remove(_progress_path(part))
+    _write_json(_meta_path(dest), {
+        'url': url, 'etag': etag, 'last_modified': last_modified, 'size': os.path.getsize(dest), 'sha256': sha256,
+    })
+    return DownloadResult(dest, sha256, False, downloaded, time.perf_counter() - started)
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def _download_ranges(
+    session: requests.Session,
+    url: str,
+    part: str,
+    size: int,
+    etag: Optional[str],
+    segments: int,
+    timeout: float,
+    retries: int,
+) -> int:
+    """以 Range 分段下載到 part，進度記錄在 <part>.progress.json 供續傳使用，回傳本次下載的 bytes"""
+    progress_file = _progress_path(part)
+    progress = _read_json(progress_file) if os.path.exists(part) and os.path.exists(progress_file) else None
+    if not progress or progress.get('etag') != etag or progress.get('size') != size:
+        # 沒有可續傳的進度，或來源已變更：重新切分區段
+        step = -(-size // segments)
+        progress = {
+            'etag': etag,
+            'size': size,
+            'segments': [[start, min(start + step, size) - 1, start] for start in range(0, size, step)],
+        }
+        with open(part, 'wb') as f:
+            f.truncate(size)
+        _write_json(progress_file, progress)
+
+    lock = threading.Lock()
+    downloaded = [0]
+
+    def fetch(segment: List[int]) -> None:
+        _, end, _ = segment
+        for attempt in range(retries + 1):
+            if segment[2] > end:
+                return
+            range_headers = {'Range': f"bytes={segment[2]}-{end}"}
+            if etag:
+                range_headers['If-Range'] = etag
+            try:
+                with session.get(url, headers=range_headers, stream=True, timeout=timeout) as response:
+                    _raise_for_transient_status(response)
+                    if response.status_code != 206:
+                        raise requests.HTTPError(f"expected 206 Partial Content, got {response.status_code}", response=response)
+                    with open(part, 'r+b') as f:
+                        f.seek(segment[2])
+                        pending = 0
+
+                        def checkpoint() -> None:
+                            # 進度只記錄已 fsync 到磁碟的 bytes，process 被強制終止後續傳不會略過未寫入的資料
+                            nonlocal pending
+                            f.flush()
+                            os.fsync(f.fileno())
+                            with lock:
+                                segment[2] += pending
+                                downloaded[0] += pending
+                                _write_json(progress_file, progress)
+                            pending = 0
+
+                        for block in response.iter_content(chunk_size=CHUNK_BYTES):
+                            f.write(block)
+                            pending += len(block)
+                            if pending >= CHECKPOINT_BYTES:
+                                checkpoint()
+                        checkpoint()
+                return
+            except RETRIABLE_ERRORS:
+                if attempt == retries:
+                    raise
+                time.sleep(2 ** attempt)
+
+    with ThreadPoolExecutor(max_workers=len(progress['segments'])) as executor:
+        list(executor.map(fetch, progress['segments']))
+    return downloaded[0]
+
+def _download_stream(
+    session: requests.Session,
+    url: str,
+    part: str,
+    timeout: float,
+    retries: int,
+    headers: dict,
+) -> Optional[int]:
+    """不支援 Range 時的單一連線下載；回應 304 時回傳 None"""
+    for attempt in range(retries + 1):
+        downloaded = 0
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    return None
+                _raise_for_transient_status(response)
+                response.raise_for_status()
+                with open(part, 'wb') as f:
+                    for block in response.iter_content(chunk_size=CHUNK_BYTES):
+                        f.write(block)
+                        downloaded += len(block)
+            return downloaded
+        except RETRIABLE_ERRORS:
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+
+def _meta_path(dest: str) -> str:
+    return f"{dest}.meta.json"
+
+def _progress_path(part: str) -> str:
+    return f"{part}.progress.json"
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path: str, data: dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _remove(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,16 +1,125 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import hashlib
 import uuid
-from typing import List
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+# 每個 block 交給一次 _digest_block 處理的列數
+DEFAULT_BLOCK_SIZE = 100_000
+
+_HEX = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+# str(uuid.UUID) 的 36 字元版面 (8-4-4-4-12) 中，hex 字元所在的位置
+_UUID_HEX_POS = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+_UUID_TEXT_LEN = 36
+# Hash Key 在 Python 端的表示方式：uuid.UUID 物件、16 bytes 的 binary (ClickHouse UUID 的原始位元組)，
+# 或 Arrow fixed_size_binary(16) 欄位 (pd.ArrowDtype，直接沿用 digest buffer，不產生 Python 物件)
+KEY_FORMATS = ('uuid', 'binary', 'arrow')
 
 def generate_hash_key(df: pd.DataFrame, columns: List[str]) -> pd.Series:
     """從多個欄位產生 SHA256 Hash Key (UUID)"""
     # 確保所有欄位都是字串且無空值
     composite_key = df[columns].astype(str).fillna('').agg(''.join, axis=1)
-    
+
     def to_uuid(x):
         sha256_hash = hashlib.sha256(x.encode()).digest()
         return uuid.UUID(bytes=sha256_hash[:16])
 
     return composite_key.apply(to_uuid)
-    
\ No newline at end of file
+
+def generate_hash_keys(
+    df: pd.DataFrame,
+    key_columns: Dict[str, List[str]],
+    workers: int = 1,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    key_format: str = 'uuid',
+) -> pd.DataFrame:
+    """
+    批次產生多個 Hash Key，結果與 generate_hash_key 逐位元組相同。
+
+    key_columns 依序定義 {key 欄位: 組成欄位}，組成欄位可以引用同一批次中先前算出的 key，
+    此時直接由 digest 組出 UUID 字串，不再經過 uuid.UUID 物件。
+    composite key 不加分隔字元，以維持與既有 vault 資料相同的 key。
+    workers > 1 時以 process pool 平行計算各個 block。
+    key_format='binary' 時以 16 bytes 的 bytes 物件表示 key (與 uuid.UUID(...).bytes 相同)，
+    clickhouse-connect 可直接寫入 UUID 欄位，省去建立 uuid.UUID 物件的記憶體與時間。
+    key_format='arrow' 時欄位為 pd.ArrowDtype(fixed_size_binary(16))，可零複製轉為 Arrow 後以 insert_arrow 寫入。
+    """
+    if key_format not in KEY_FORMATS:
+        raise ValueError(f"key_format must be one of {KEY_FORMATS}, got {key_format!r}")
+    digests: Dict[str, np.ndarray] = {}
+    executor: Optional[Executor] = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for key, columns in key_columns.items():
+            digests[key] = _hash_composite(df, columns, digests, executor, block_size)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    convert = {'uuid': _to_uuid_objects, 'binary': _to_binary_objects, 'arrow': _to_arrow_array}[key_format]
+    return pd.DataFrame(
+        {key: convert(digest) for key, digest in digests.items()},
+        index=df.index,
+    )
+
+def _hash_composite(
+    df: pd.DataFrame,
+    columns: List[str],
+    digests: Dict[str, np.ndarray],
+    executor: Optional[Executor],
+    block_size: int,
+) -> np.ndarray:
+    """計算一組欄位的 digest，回傳 (n, 16) uint8 陣列"""
+    if all(c in digests for c in columns):
+        # 全部由先前的 key 組成：固定寬度，直接在同一個 buffer 上切片
+        width = _UUID_TEXT_LEN * len(columns)
+        buffer = np.hstack([_uuid_text(digests[c]) for c in columns]).tobytes()
+        blocks = [
+            [buffer[i:i + width] for i in range(start, min(start + block_size * width, len(buffer)), width)]
+            for start in range(0, len(buffer), block_size * width)
+        ]
+    else:
+        composite = None
+        for c in columns:
+            if c in digests:
+                part = _uuid_text(digests[c]).view(f'S{_UUID_TEXT_LEN}').ravel().astype(object)
+            else:
+                part = df[c].astype(str).str.encode('utf-8').to_numpy(dtype=object)
+            composite = part if composite is None else composite + part
+        values = composite.tolist() if composite is not None else []
+        blocks = [values[i:i + block_size] for i in range(0, len(values), block_size)]
+
+    if executor is None:
+        hashed = [_digest_block(b) for b in blocks]
+    else:
+        hashed = list(executor.map(_digest_block, blocks))
+    return np.frombuffer(b''.join(hashed), dtype=np.uint8).reshape(-1, 16)
+
+def _digest_block(values: List[bytes]) -> bytes:
+    """對一個 block 計算 SHA256，回傳各列前 16 bytes 串接後的 buffer"""
+    sha256 = hashlib.sha256
+    return b''.join([sha256(v).digest()[:16] for v in values])
+
+def _uuid_text(digest: np.ndarray) -> np.ndarray:
+    """將 (n, 16) digest 轉為與 str(uuid.UUID) 相同的 ASCII，回傳 (n, 36) uint8"""
+    text = np.full((len(digest), _UUID_TEXT_LEN), ord('-'), dtype=np.uint8)
+    text[:, _UUID_HEX_POS[0::2]] = _HEX[digest >> 4]
+    text[:, _UUID_HEX_POS[1::2]] = _HEX[digest & 0x0F]
+    return text
+
+def _to_uuid_objects(digest: np.ndarray) -> np.ndarray:
+    buffer = digest.tobytes()
+    return np.array([uuid.UUID(bytes=buffer[i:i + 16]) for i in range(0, len(buffer), 16)], dtype=object)
+
+def _to_binary_objects(digest: np.ndarray) -> np.ndarray:
+    buffer = digest.tobytes()
+    keys = np.empty(len(digest), dtype=object)
+    keys[:] = [buffer[i:i + 16] for i in range(0, len(buffer), 16)]
+    return keys
+
+def _to_arrow_array(digest: np.ndarray) -> pd.arrays.ArrowExtensionArray:
+    buffer = pa.py_buffer(np.ascontiguousarray(digest))
+    return pd.arrays.ArrowExtensionArray(
+        pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), len(digest), [None, buffer])
+    )
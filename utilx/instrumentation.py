@@ -0,0 +1,160 @@
+import functools
+import logging
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+from prometheus_client import CollectorRegistry, Gauge, Histogram
+import utilx.clickhouse_client as ch
+from utilx import push_to_prometheus
+from utilx.resource_usage import peak_rss_mb
+
+# 推送 task 統計的 Pushgateway job，grouping key 為 flow_run
+PIPELINE_METRICS_JOB = 'online_retail_pipeline'
+
+# task 內各查詢的統計 (query_id 以 query_id_prefix(task) 開頭)
+QUERY_LOG_SQL = """
+SELECT query_duration_ms, read_rows, read_bytes, written_rows, written_bytes, memory_usage
+FROM system.query_log
+WHERE type = 'QueryFinish' AND event_date >= yesterday() AND query_id IN {query_ids:Array(String)}
+"""
+
+QUERY_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, float('inf'))
+
+class TaskStats(NamedTuple):
+    """一次 task 執行的耗時與 ClickHouse 查詢統計"""
+    task: str
+    flow_run: str
+    wall_seconds: float
+    queries: int
+    read_rows: int
+    read_bytes: int
+    written_rows: int
+    written_bytes: int
+    clickhouse_peak_memory_bytes: int     # 單一查詢的最大 memory_usage (summary 時為 0)
+    process_peak_rss_bytes: int           # 截至 task 結束時本 process 的峰值 RSS
+    query_seconds: List[float]            # 各查詢的耗時 (query_log)
+    source: str                           # query_log / summary
+    query_ids: List[str]                  # task 內所有查詢的 query_id
+
+_lock = threading.Lock()
+_results: List[TaskStats] = []
+
+def current_flow_run() -> str:
+    """目前的 Prefect flow run id，不在 flow 中時為 'local'"""
+    try:
+        from prefect.runtime import flow_run
+        return str(flow_run.id or 'local')
+    except ImportError:
+        return 'local'
+
+def run_logger():
+    """Prefect run logger (在 task / flow 中時)，否則為本模組的 logger"""
+    try:
+        from prefect import get_run_logger
+        return get_run_logger()
+    except Exception:
+        return logging.getLogger(__name__)
+
+def instrumented(fn: Callable = None, *, name: str = None):
+    """
+    記錄函式 (Prefect task 的本體) 的耗時與期間所有 ClickHouse 查詢的統計，結果加入 task_stats()
+
+    以 @task 之下的 decorator 使用；task 名稱預設為函式名稱。統計失敗只記錄 warning，不影響 task 結果
+    """
+    if fn is None:
+        return functools.partial(instrumented, name=name)
+    task_name = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        with ch.tagged_queries(task_name) as queries:
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                wall_seconds = time.perf_counter() - start
+                try:
+                    record(collect_stats(task_name, wall_seconds, queries))
+                except Exception as error:
+                    run_logger().warning(f"Could not collect stats for {task_name}: {error}")
+    return wrapper
+
+def flush_query_log(client) -> None:
+    """query_log 為非同步寫入，讀取剛結束的查詢前先 FLUSH LOGS"""
+    try:
+        client.command("SYSTEM FLUSH LOGS")
+    except Exception:
+        pass  # 沒有 SYSTEM FLUSH LOGS 權限時，尚未寫入 query_log 的查詢會遺漏
+
+def collect_stats(task: str, wall_seconds: float, queries: List[ch.TaggedQuery]) -> TaskStats:
+    """以 system.query_log 彙總 task 的查詢；無法讀取 query_log 時改用查詢回傳的 summary (沒有記憶體與串流查詢)"""
+    rss = peak_rss_mb()
+    stats = dict(task=task, flow_run=current_flow_run(), wall_seconds=wall_seconds, queries=len(queries),
+                 process_peak_rss_bytes=int((rss or 0) * 1024 * 1024), query_ids=[q.query_id for q in queries])
+    rows = None
+    if queries:
+        with ch.tagged_queries('instrumentation'):
+            client = ch.get_client('metrics')
+            flush_query_log(client)
+            try:
+                rows = client.query(QUERY_LOG_SQL, parameters={'query_ids': stats['query_ids']}).result_rows
+            except Exception as error:
+                run_logger().info(f"system.query_log unavailable for {task}, using query summaries: {error}")
+    if rows is not None:
+        return TaskStats(
+            **stats,
+            read_rows=sum(row[1] for row in rows), read_bytes=sum(row[2] for row in rows),
+            written_rows=sum(row[3] for row in rows), written_bytes=sum(row[4] for row in rows),
+            clickhouse_peak_memory_bytes=max((row[5] for row in rows), default=0),
+            query_seconds=[row[0] / 1000 for row in rows], source='query_log',
+        )
+    summaries = [q.summary for q in queries if q.summary]
+    total = lambda key: sum(int(summary.get(key, 0)) for summary in summaries)
+    return TaskStats(
+        **stats,
+        read_rows=total('read_rows'), read_bytes=total('read_bytes'),
+        written_rows=total('written_rows'), written_bytes=total('written_bytes'),
+        clickhouse_peak_memory_bytes=0, query_seconds=[], source='summary',
+    )
+
+def record(stats: TaskStats) -> None:
+    with _lock:
+        _results.append(stats)
+    run_logger().info(
+        f"{stats.task}: {stats.wall_seconds:.2f}s, {stats.queries} queries, "
+        f"read {stats.read_rows:,} rows / {stats.read_bytes:,} bytes, "
+        f"written {stats.written_rows:,} rows / {stats.written_bytes:,} bytes, "
+        f"ClickHouse peak {stats.clickhouse_peak_memory_bytes:,} bytes ({stats.source})."
+    )
+
+def task_stats(flow_run: Optional[str] = None) -> List[TaskStats]:
+    """本 process 已記錄的 task 統計 (可依 flow_run 篩選)"""
+    with _lock:
+        return [stats for stats in _results if flow_run is None or stats.flow_run == flow_run]
+
+def stats_registry(stats: List[TaskStats]) -> CollectorRegistry:
+    """task 統計的 gauge 與查詢耗時 histogram，labels 為 task 與 flow_run"""
+    registry = CollectorRegistry()
+    labels = ['task', 'flow_run']
+    gauges = {
+        field: Gauge(f'pipeline_task_{field}', documentation=f'Pipeline task {field.replace("_", " ")}',
+                     labelnames=labels, registry=registry)
+        for field in ('wall_seconds', 'queries', 'read_rows', 'read_bytes', 'written_rows', 'written_bytes',
+                      'clickhouse_peak_memory_bytes', 'process_peak_rss_bytes')
+    }
+    query_seconds = Histogram('pipeline_task_query_seconds', documentation='ClickHouse query duration per pipeline task',
+                              labelnames=labels, buckets=QUERY_DURATION_BUCKETS, registry=registry)
+    for task in stats:
+        for field, gauge in gauges.items():
+            gauge.labels(task=task.task, flow_run=task.flow_run).set(getattr(task, field))
+        histogram = query_seconds.labels(task=task.task, flow_run=task.flow_run)
+        for seconds in task.query_seconds:
+            histogram.observe(seconds)
+    return registry
+
+def push_task_stats(flow_run: Optional[str] = None) -> List[TaskStats]:
+    """將本次 flow run 的 task 統計一次推送到 Pushgateway，回傳推送的統計"""
+    flow_run = flow_run or current_flow_run()
+    stats = task_stats(flow_run)
+    push_to_prometheus.push_registry(PIPELINE_METRICS_JOB, stats_registry(stats), grouping_key={'flow_run': flow_run})
+    return stats
@@ -0,0 +1,169 @@
+import json
+import math
+import os
+from typing import Iterable, Optional, Union
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# 16 bytes 的 key (ClickHouse UUID 的 RFC 位元組順序，與 uuid.UUID(...).bytes 相同)
+KEY_DTYPE = np.dtype('S16')
+DEFAULT_FPR = 0.01
+# Bloom filter 依 key 數的倍數預留容量，超過時重建
+BLOOM_HEADROOM = 2
+MIN_BLOOM_CAPACITY = 1024
+
+class KeyIndex:
+    """
+    磁碟上的 key 存在索引：排序後的 key 檔 + 前置的 Bloom filter，皆以 memmap 讀取。
+
+    <directory>/<name>.keys   排序、不重複的 16 bytes key
+    <directory>/<name>.bloom  Bloom filter bit array
+    <directory>/<name>.json   metadata (key 數、Bloom 參數、建立時來源表的列數)
+
+    contains() 先以 Bloom filter 排除一定不存在的 key，其餘在排序 key 檔上二分搜尋，
+    結果為精確的存在判斷 (無 false positive)，fpr 只影響需要二分搜尋的比例。
+    檔案以暫存檔 + rename 更新，metadata 最後寫入，與 key 檔大小不符時視為不存在。
+    """
+
+    def __init__(self, directory: str, name: str, fpr: float = DEFAULT_FPR):
+        if not 0 < fpr < 1:
+            raise ValueError(f"fpr must be between 0 and 1, got {fpr!r}")
+        self.directory = directory
+        self.name = name
+        self.fpr = fpr
+        self.meta: Optional[dict] = None
+        self.keys: Optional[np.ndarray] = None
+        self.bloom: Optional[np.ndarray] = None
+        self._load()
+
+    def _path(self, suffix: str) -> str:
+        return os.path.join(self.directory, f'{self.name}.{suffix}')
+
+    @property
+    def exists(self) -> bool:
+        return self.meta is not None
+
+    @property
+    def source_rows(self) -> Optional[int]:
+        """建立 / 更新索引時來源表的列數，用來判斷索引是否過期"""
+        return self.meta['source_rows'] if self.meta else None
+
+    def __len__(self) -> int:
+        return self.meta['keys'] if self.meta else 0
+
+    def _load(self) -> None:
+        try:
+            with open(self._path('json')) as f:
+                meta = json.load(f)
+            if os.path.getsize(self._path('keys')) != meta['keys'] * KEY_DTYPE.itemsize:
+                return
+        except (OSError, ValueError, KeyError):
+            return
+        self.meta = meta
+        self.keys = _memmap(self._path('keys'), KEY_DTYPE)
+        self.bloom = _memmap(self._path('bloom'), np.uint8)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """每個 key 是否已在索引中 (bool 陣列)"""
+        found = np.zeros(len(keys), dtype=bool)
+        if not self.exists or not len(keys) or not len(self):
+            return found
+        maybe = _bloom_test(self.bloom, self.meta['bloom_bits'], self.meta['hashes'], keys)
+        candidates = keys[maybe]
+        positions = np.minimum(np.searchsorted(self.keys, candidates), len(self.keys) - 1)
+        found[maybe] = self.keys[positions] == candidates
+        return found
+
+    def rebuild(self, batches: Iterable[np.ndarray], source_rows: int) -> None:
+        """以來源表的所有 key 重建索引 (batches 為 S16 陣列)"""
+        arrays = [np.asarray(batch, dtype=KEY_DTYPE) for batch in batches]
+        keys = np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=KEY_DTYPE)
+        self._write(keys, None, source_rows)
+
+    def add(self, keys: np.ndarray, source_rows: int) -> int:
+        """加入新 key 並記錄來源表目前的列數，回傳實際新增的 key 數"""
+        if not self.exists:
+            raise RuntimeError(f"key index {self.name} has not been built")
+        keys = np.unique(np.asarray(keys, dtype=KEY_DTYPE))
+        added = keys[~self.contains(keys)]
+        # 複製到記憶體，_write 取代檔案前須釋放所有指向舊檔的 memmap
+        merged = np.union1d(self.keys, added) if len(added) else np.array(self.keys)
+        bloom = None
+        if len(merged) <= self.meta['capacity']:
+            bloom = np.array(self.bloom)
+            _bloom_set(bloom, self.meta['bloom_bits'], self.meta['hashes'], added)
+        self._write(merged, bloom, source_rows)
+        return len(added)
+
+    def _write(self, keys: np.ndarray, bloom: Optional[np.ndarray], source_rows: int) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if bloom is None:
+            capacity = max(len(keys) * BLOOM_HEADROOM, MIN_BLOOM_CAPACITY)
+            fpr = self.meta['fpr'] if self.meta else self.fpr
+            bits = math.ceil(-capacity * math.log(fpr) / math.log(2) ** 2)
+            hashes = max(1, round(bits / capacity * math.log(2)))
+            bloom = np.zeros((bits + 7) // 8, dtype=np.uint8)
+            _bloom_set(bloom, bits, hashes, keys)
+            meta = {'capacity': capacity, 'bloom_bits': bits, 'hashes': hashes, 'fpr': fpr}
+        else:
+            meta = {k: self.meta[k] for k in ('capacity', 'bloom_bits', 'hashes', 'fpr')}
+        meta.update(keys=len(keys), source_rows=int(source_rows))
+
+        written = {}
+        for suffix, data in (('keys', keys), ('bloom', bloom)):
+            written[suffix] = f'{self._path(suffix)}.{os.getpid()}.tmp'
+            data.tofile(written[suffix])
+        # Windows 無法取代仍被 memmap 開啟的檔案：先釋放舊檔的 memmap，寫入完成後由 _load 重新開啟
+        self.meta = self.keys = self.bloom = None
+        for suffix, tmp in written.items():
+            os.replace(tmp, self._path(suffix))
+        tmp = f"{self._path('json')}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path('json'))
+        self._load()
+
+def to_key_array(values: Union[pd.Series, pa.Array, pa.ChunkedArray]) -> np.ndarray:
+    """
+    Hash Key 欄位轉為 S16 陣列
+
+    支援 utilx.hashx.KEY_FORMATS 的三種 DataFrame 欄位 (uuid.UUID / bytes / Arrow fixed_size_binary(16))，
+    以及 ClickHouse 回傳的 Arrow fixed_size_binary(16) 欄位 (例如 UUIDStringToNum(toString(key)))
+    """
+    if isinstance(values, pd.Series):
+        if isinstance(values.dtype, pd.ArrowDtype):
+            values = pa.array(values)
+        else:
+            return np.array([getattr(v, 'bytes', v) for v in values], dtype=KEY_DTYPE)
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if not pa.types.is_fixed_size_binary(values.type):
+        values = values.cast(pa.binary(KEY_DTYPE.itemsize))
+    data = np.frombuffer(values.buffers()[1], dtype=KEY_DTYPE)
+    return data[values.offset:values.offset + len(values)]
+
+def _memmap(path: str, dtype: np.dtype) -> np.ndarray:
+    # 空檔案無法 memmap
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+def _bloom_positions(bits: int, hashes: int, keys: np.ndarray) -> np.ndarray:
+    """double hashing：key 本身即為 SHA256 前 16 bytes，直接取前後 8 bytes 作為兩個 hash，回傳 (hashes, n) 的 bit 位置"""
+    halves = np.frombuffer(np.ascontiguousarray(keys).tobytes(), dtype=np.uint64).reshape(-1, 2)
+    h1, h2 = halves[:, 0], halves[:, 1] | np.uint64(1)
+    steps = np.arange(hashes, dtype=np.uint64)[:, None]
+    with np.errstate(over='ignore'):
+        return (h1 + steps * h2) % np.uint64(bits)
+
+def _bloom_set(bloom: np.ndarray, bits: int, hashes: int, keys: np.ndarray) -> None:
+    if not len(keys):
+        return
+    positions = _bloom_positions(bits, hashes, keys).ravel()
+    np.bitwise_or.at(bloom, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+
+def _bloom_test(bloom: np.ndarray, bits: int, hashes: int, keys: np.ndarray) -> np.ndarray:
+    positions = _bloom_positions(bits, hashes, keys)
+    hit = (bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+    return hit.all(axis=0).astype(bool)
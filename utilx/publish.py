@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+from typing import Iterator, Set
+
+# 建置中的影子表與上一個發佈版本 (供 rollback) 的後綴
+SHADOW_SUFFIX = '__shadow'
+PREVIOUS_SUFFIX = '__previous'
+
+PARTITIONS_SQL = """
+SELECT DISTINCT partition_id FROM system.parts
+WHERE active AND database = {database:String} AND table = {table:String}
+"""
+
+TABLE_EXISTS_SQL = "SELECT count() FROM system.tables WHERE database = {database:String} AND name = {table:String}"
+
+def partition_ids(client, table: str) -> Set[str]:
+    database, name = table.split('.')
+    return {pid for pid, in client.query(PARTITIONS_SQL, parameters={'database': database, 'table': name}).result_rows}
+
+def table_exists(client, table: str) -> bool:
+    database, name = table.split('.')
+    return int(client.command(TABLE_EXISTS_SQL, parameters={'database': database, 'table': name})) > 0
+
+@contextmanager
+def publishing(client, table: str, copy_live: bool = False) -> Iterator[str]:
+    """
+    在 <table>__shadow 建置新版本，成功後以 EXCHANGE TABLES 原子發佈，上一個版本保留為 <table>__previous
+
+    copy_live 時影子表先以 ATTACH PARTITION FROM 複製線上資料 (hard link，不複製檔案)，供增量更新；
+    建置失敗時丟棄影子表，線上表不受影響。讀取端在發佈前後只會看到完整的舊版或新版。
+    發佈期間線上表應只由本流程寫入，否則複製之後寫入線上表的資料會在交換時遺失。
+    """
+    shadow = f'{table}{SHADOW_SUFFIX}'
+    client.command(f"DROP TABLE IF EXISTS {shadow}")
+    client.command(f"CREATE TABLE {shadow} AS {table}")
+    try:
+        if copy_live:
+            for partition_id in sorted(partition_ids(client, table)):
+                client.command(f"ALTER TABLE {shadow} ATTACH PARTITION ID '{partition_id}' FROM {table}")
+        yield shadow
+    except BaseException:
+        client.command(f"DROP TABLE IF EXISTS {shadow}")
+        raise
+
+    previous = f'{table}{PREVIOUS_SUFFIX}'
+    client.command(f"EXCHANGE TABLES {table} AND {shadow}")
+    client.command(f"DROP TABLE IF EXISTS {previous}")
+    client.command(f"RENAME TABLE {shadow} TO {previous}")
+
+def rollback(client, table: str) -> None:
+    """以 EXCHANGE TABLES 將線上表換回上一個發佈版本；再執行一次即恢復為 rollback 前的版本"""
+    previous = f'{table}{PREVIOUS_SUFFIX}'
+    if not table_exists(client, previous):
+        raise ValueError(f"{table} has no previous version to roll back to")
+    client.command(f"EXCHANGE TABLES {table} AND {previous}")
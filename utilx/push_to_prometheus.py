@@ -1,15 +1,45 @@
 from prometheus_client import CollectorRegistry, push_to_gateway, Gauge
 import os
+import time
+from typing import Dict, Iterable, Tuple
 from dotenv import load_dotenv
 load_dotenv()
 
-def guage(metrics_name: str, value: float):
-    PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "localhost:9091")
+def push_gauges(
+    job: str,
+    samples: Iterable[Tuple[str, str, Dict[str, str], float]],
+    timeout: float = 10,
+    retries: int = 3,
+) -> CollectorRegistry:
+    """
+    將所有 (名稱, 說明, labels, 值) 註冊到同一個 registry，並以一次 push_to_gateway 推送到 job
+
+    同名指標共用一個 Gauge (labels 的 key 須相同)；推送與重試見 push_registry
+    """
     registry = CollectorRegistry()
-    g = Gauge(
-        metrics_name,
-        documentation=metrics_name,
-        registry=registry
-    )
-    g.set(value)
-    push_to_gateway(PUSHGATEWAY_URL, job=metrics_name, registry=registry)
+    gauges: Dict[str, Gauge] = {}
+    for name, documentation, labels, value in samples:
+        if name not in gauges:
+            gauges[name] = Gauge(name, documentation=documentation, labelnames=sorted(labels), registry=registry)
+        gauges[name].labels(**labels).set(value)
+
+    push_registry(job, registry, timeout=timeout, retries=retries)
+    return registry
+
+def push_registry(
+    job: str,
+    registry: CollectorRegistry,
+    grouping_key: Dict[str, str] = None,
+    timeout: float = 10,
+    retries: int = 3,
+) -> None:
+    """以一次 push_to_gateway 推送 registry 的所有指標 (PUT 取代同一 job / grouping_key 先前的指標)，失敗時以指數退避重試"""
+    url = os.getenv("PUSHGATEWAY_URL", "localhost:9091")
+    for attempt in range(retries + 1):
+        try:
+            push_to_gateway(url, job=job, registry=registry, grouping_key=grouping_key, timeout=timeout)
+            return
+        except OSError:
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
@@ -0,0 +1,115 @@
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional
+import pandas as pd
+
+# Excel 可使用 openpyxl (純 Python) 或 calamine (Rust，需安裝 python-calamine)
+EXCEL_READERS = ('openpyxl', 'calamine')
+READERS = EXCEL_READERS + ('csv', 'parquet')
+
+EXCEL_SUFFIXES = ('.xlsx', '.xlsm')
+CSV_SUFFIXES = ('.csv',)
+PARQUET_SUFFIXES = ('.parquet',)
+
+def reader_for(path: str, excel_reader: str = 'openpyxl') -> Optional[str]:
+    """依副檔名決定 reader，Excel 檔使用 excel_reader；不支援的檔案回傳 None"""
+    if excel_reader not in EXCEL_READERS:
+        raise ValueError(f"excel_reader must be one of {EXCEL_READERS}, got {excel_reader!r}")
+    lower = path.lower()
+    if lower.endswith(EXCEL_SUFFIXES):
+        return excel_reader
+    if lower.endswith(CSV_SUFFIXES):
+        return 'csv'
+    if lower.endswith(PARQUET_SUFFIXES):
+        return 'parquet'
+    return None
+
+def list_sheets(path: str, reader: str) -> List[Optional[str]]:
+    """列出檔案中的工作表；CSV/Parquet 只有一個來源，以 None 表示"""
+    if reader == 'openpyxl':
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    if reader == 'calamine':
+        from python_calamine import CalamineWorkbook
+        return list(CalamineWorkbook.from_path(path).sheet_names)
+    _check_reader(reader)
+    return [None]
+
+def read_frame(path: str, sheet: Optional[str], reader: str) -> pd.DataFrame:
+    """一次讀取整個工作表 (或整個 CSV/Parquet 檔)"""
+    if reader in EXCEL_READERS:
+        return pd.read_excel(path, sheet_name=sheet, engine=reader)
+    if reader == 'csv':
+        return pd.read_csv(path)
+    if reader == 'parquet':
+        return pd.read_parquet(path)
+    _check_reader(reader)
+
+def iter_frames(path: str, sheet: Optional[str], reader: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """逐 chunk_size 列讀取，記憶體用量只與 chunk_size 有關"""
+    if reader == 'openpyxl':
+        yield from _iter_openpyxl(path, sheet, chunk_size)
+    elif reader == 'calamine':
+        yield from _iter_calamine(path, sheet, chunk_size)
+    elif reader == 'csv':
+        yield from pd.read_csv(path, chunksize=chunk_size)
+    elif reader == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        _check_reader(reader)
+
+def _check_reader(reader: str) -> None:
+    if reader not in READERS:
+        raise ValueError(f"reader must be one of {READERS}, got {reader!r}")
+
+def _batched(header: Iterable, rows: Iterable, chunk_size: int) -> Iterator[pd.DataFrame]:
+    header = list(header)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield pd.DataFrame(batch, columns=header)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=header)
+
+def _iter_openpyxl(path: str, sheet: Optional[str], chunk_size: int) -> Iterator[pd.DataFrame]:
+    """以 openpyxl read-only 模式逐列讀取工作表"""
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is not None:
+            yield from _batched(header, rows, chunk_size)
+    finally:
+        workbook.close()
+
+def _iter_calamine(path: str, sheet: Optional[str], chunk_size: int) -> Iterator[pd.DataFrame]:
+    """以 python-calamine 逐列讀取工作表，數值與日期轉換方式與 pd.read_excel(engine='calamine') 相同"""
+    from python_calamine import CalamineWorkbook
+    workbook = CalamineWorkbook.from_path(path)
+    worksheet = workbook.get_sheet_by_name(sheet) if sheet else workbook.get_sheet_by_index(0)
+    rows = (_calamine_row(row) for row in worksheet.iter_rows())
+    header = next(rows, None)
+    if header is not None:
+        yield from _batched(header, rows, chunk_size)
+
+def _calamine_row(row: list) -> list:
+    converted = []
+    for value in row:
+        if value == '':
+            # calamine 以空字串表示空白儲存格
+            value = None
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif isinstance(value, date) and not isinstance(value, datetime):
+            value = pd.Timestamp(value)
+        converted.append(value)
+    return converted
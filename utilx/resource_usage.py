@@ -0,0 +1,15 @@
+import sys
+from typing import Optional
+
+def peak_rss_mb(children: bool = False) -> Optional[float]:
+    """
+    回傳目前 process 的峰值 RSS (MB)；children=True 時回傳已結束子 process 中最大的峰值。
+    resource 模組在 Windows 不存在，此時回傳 None。
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 回報，macOS 以 bytes 回報
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import re
+from typing import Iterator, Optional, Union
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# 計算檔案 hash 時每次讀取的大小
+READ_BLOCK_BYTES = 1024 * 1024
+
+def file_digest(path: str) -> str:
+    """回傳檔案內容的 SHA256 (hex)"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_BYTES), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def cache_path(cache_dir: str, digest: str, sheet: Optional[str], version: str) -> str:
+    """
+    來源檔內容 hash + 工作表 + 轉換版本組成的 Parquet 路徑。
+    version 需在解析/轉換邏輯改變時更新，讓舊的快取自然失效。
+    """
+    sheet_slug = re.sub(r'[^0-9A-Za-z_-]+', '_', sheet) if sheet else 'data'
+    return os.path.join(cache_dir, f"{digest}__{sheet_slug}__v{version}.parquet")
+
+def read(path: str) -> Optional[pd.DataFrame]:
+    """讀取快取，不存在時回傳 None"""
+    return pd.read_parquet(path) if os.path.exists(path) else None
+
+def read_table(path: str) -> Optional[pa.Table]:
+    """以 pyarrow.Table 讀取快取 (不轉為 pandas)，不存在時回傳 None"""
+    return pq.read_table(path) if os.path.exists(path) else None
+
+def iter_read(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """逐 chunk_size 列讀取快取"""
+    for batch in iter_batches(path, chunk_size):
+        yield batch.to_pandas()
+
+def iter_batches(path: str, chunk_size: int) -> Iterator[pa.RecordBatch]:
+    """逐 chunk_size 列以 pyarrow.RecordBatch 讀取快取"""
+    yield from pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+
+def write(path: str, df: Union[pd.DataFrame, pa.Table], schema: pa.Schema) -> None:
+    """先寫入暫存檔再 rename，避免中斷時留下不完整的快取"""
+    writer = ChunkWriter(path, schema)
+    try:
+        writer.write(df)
+    except BaseException:
+        writer.close(commit=False)
+        raise
+    writer.close(commit=True)
+
+class ChunkWriter:
+    """
+    逐 chunk 寫入快取，close(commit=True) 時才生效。
+    以固定的 schema 寫入，避免某個 chunk 整欄皆為空值時推斷出 null 型態。
+    """
+
+    def __init__(self, path: str, schema: pa.Schema):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.tmp = f"{path}.{os.getpid()}.tmp"
+        self.schema = schema
+        self.writer = None
+
+    def write(self, df: Union[pd.DataFrame, pa.Table]) -> None:
+        table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        if self.writer is None:
+            # 沿用第一個 chunk 的 pandas metadata，讀回時可還原 Int64 等 nullable dtype
+            self.writer = pq.ParquetWriter(self.tmp, table.schema)
+        self.writer.write_table(table)
+
+    def close(self, commit: bool) -> None:
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.tmp, self.schema)
+        self.writer.close()
+        if commit:
+            os.replace(self.tmp, self.path)
+        elif os.path.exists(self.tmp):
+            os.remove(self.tmp)